@@ -0,0 +1,984 @@
+"""Бенчмарки бота.
+
+Запуск:
+    python benchmark.py pool [--calls N]
+    python benchmark.py plans
+    python benchmark.py report [--sizes 1000,10000,100000] [--calls N]
+    python benchmark.py writes [--users N] [--per-user N]
+    python benchmark.py keyboards [--iterations N]
+    python benchmark.py dispatch [--updates N]
+    python benchmark.py load [--users N] [--rounds N] [--metrics]
+    python benchmark.py charts [--users N] [--workers N]
+    python benchmark.py outbox [--chats N] [--messages N]
+    python benchmark.py digest [--users N] [--rows N]
+    python benchmark.py recurring [--rules N] [--batch N]
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import re
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import Executor, Future
+from datetime import datetime, time as day_time, timedelta
+
+import aiosqlite
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import CallbackQuery, Chat, KeyboardButton, Message, ReplyKeyboardMarkup, Update, User
+
+from charts import ChartRenderer
+from config import DEFAULT_EXPENSE_CATEGORIES
+from database import Database, to_db_date
+from digest import DigestScheduler, Schedule
+from handlers import register_handlers
+from metrics import setup_metrics
+from outbox import DetachSendsMiddleware, Outbox, TokenBucket, wait_result
+from recurring import RUN_AT, RecurringScheduler, next_occurrence
+from storage import SQLiteStorage
+from utils import MINOR_UNITS, generate_report_text
+from keyboards import category_keyboard_cache, get_category_keyboard, get_main_menu
+
+# Исходные запросы отчета по сырой таблице transactions (до агрегатов)
+LEGACY_BALANCE_QUERY = '''
+    SELECT
+        SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END),
+        SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END)
+    FROM transactions
+    WHERE user_id = ? AND date >= ? AND date <= ?
+'''
+LEGACY_STATS_QUERY = '''
+    SELECT category, SUM(amount) as total, COUNT(*) as count
+    FROM transactions
+    WHERE user_id = ? AND type = ? AND date >= ? AND date <= ?
+    GROUP BY category ORDER BY total DESC
+'''
+
+
+def percentile(samples: list, pct: float) -> float:
+    """Перцентиль по отсортированной выборке"""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+    return ordered[index]
+
+
+def print_latency(title: str, samples: list):
+    """Вывод распределения задержек в микросекундах"""
+    us = [s * 1e6 for s in samples]
+    print(f"{title:<32} p50={percentile(us, 50):8.1f}us  "
+          f"p95={percentile(us, 95):8.1f}us  p99={percentile(us, 99):8.1f}us")
+
+
+async def make_database(path: str, users: int = 10, per_user: int = 100) -> Database:
+    """Временная БД с синтетическими транзакциями"""
+    db = Database(path)
+    await db.open()
+    await db.create_tables()
+    for user_id in range(1, users + 1):
+        await db.add_user(user_id, f"user{user_id}")
+        await db.init_default_categories(user_id)
+        await asyncio.gather(*(
+            db.add_transaction(user_id, 'income' if i % 5 == 0 else 'expense', 100 + i, 'Другое')
+            for i in range(per_user)
+        ))
+    return db
+
+
+async def bench_pool(calls: int):
+    """Соединение на каждый вызов против постоянного пула"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        db = await make_database(path)
+        query = "SELECT SUM(amount) FROM transactions WHERE user_id = ?"
+
+        samples = []
+        for i in range(calls):
+            started = time.perf_counter()
+            async with aiosqlite.connect(path) as conn:
+                async with conn.execute(query, (i % 10 + 1,)) as cursor:
+                    await cursor.fetchone()
+            samples.append(time.perf_counter() - started)
+        print_latency('connect-per-call get_balance', samples)
+
+        samples = []
+        for i in range(calls):
+            started = time.perf_counter()
+            await db.get_balance(i % 10 + 1)
+            samples.append(time.perf_counter() - started)
+        print_latency('pooled get_balance', samples)
+
+        await db.close()
+
+
+async def fill_history(db: Database, user_id: int, rows: int, days: int = 1095):
+    """Пакетная вставка истории транзакций, равномерно распределенной по дням"""
+    now = datetime.now()
+    categories = ['Продукты', 'Транспорт', 'Развлечения', 'Связь', 'Другое']
+    batch = []
+    for i in range(rows):
+        moment = now - timedelta(seconds=random.randint(0, days * 86400))
+        trans_type = 'income' if i % 10 == 0 else 'expense'
+        batch.append((user_id, trans_type, random.randint(100, 50000) * MINOR_UNITS,
+                      random.choice(categories), to_db_date(moment)))
+    async with db._write() as conn:
+        await conn.executemany(
+            'INSERT INTO transactions (user_id, type, amount, category, date) VALUES (?, ?, ?, ?, ?)',
+            batch
+        )
+
+
+async def bench_report(sizes: list, calls: int):
+    """Задержка отчета: три запроса по сырой таблице против get_report"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        db = Database(path)
+        await db.open()
+        await db.create_tables()
+
+        for user_id, size in enumerate(sizes, start=1):
+            await fill_history(db, user_id, size)
+
+        end = datetime.now()
+        periods = {
+            'month': end - timedelta(days=30),
+            'all': datetime(2000, 1, 1),
+        }
+        async with aiosqlite.connect(path) as conn:
+            for user_id, size in enumerate(sizes, start=1):
+                for period, start in periods.items():
+                    low, high = to_db_date(start), to_db_date(end)
+                    samples = []
+                    for _ in range(calls):
+                        started = time.perf_counter()
+                        async with conn.execute(LEGACY_BALANCE_QUERY, (user_id, low, high)) as cursor:
+                            await cursor.fetchone()
+                        for trans_type in ('expense', 'income'):
+                            async with conn.execute(LEGACY_STATS_QUERY, (user_id, trans_type, low, high)) as cursor:
+                                await cursor.fetchall()
+                        samples.append(time.perf_counter() - started)
+                    print_latency(f'{size:>7} rows {period:<5} legacy x3', samples)
+
+                    samples = []
+                    for _ in range(calls):
+                        started = time.perf_counter()
+                        await db.get_report(user_id, start.isoformat(), end.isoformat())
+                        samples.append(time.perf_counter() - started)
+                    print_latency(f'{size:>7} rows {period:<5} get_report', samples)
+
+        await db.close()
+
+
+async def bench_writes(users: int, per_user: int):
+    """Пропускная способность записи: коммит на каждую запись против группового"""
+    configs = {
+        'commit per write': {'write_batch_size': 1, 'write_batch_delay_ms': 0},
+        'group commit': {},
+    }
+    for title, options in configs.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, 'bench.db'), **options)
+            await db.open()
+            await db.create_tables()
+
+            async def user_session(user_id: int):
+                samples = []
+                for i in range(per_user):
+                    started = time.perf_counter()
+                    await db.add_transaction(user_id, 'expense', 100 + i, 'Другое')
+                    samples.append(time.perf_counter() - started)
+                return samples
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*(user_session(user_id) for user_id in range(1, users + 1)))
+            elapsed = time.perf_counter() - started
+
+            samples = [sample for result in results for sample in result]
+            print(f"{title:<32} {len(samples) / elapsed:10.0f} writes/s")
+            print_latency(f'{title} latency', samples)
+            await db.close()
+
+
+def rebuild_keyboard(keyboard: ReplyKeyboardMarkup) -> ReplyKeyboardMarkup:
+    """Сборка клавиатуры с нуля, как до кэширования"""
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=button.text) for button in row] for row in keyboard.keyboard],
+        resize_keyboard=True
+    )
+
+
+def measure(build, iterations: int):
+    """Среднее время на вызов и пик выделенной памяти"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        build()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    for _ in range(min(iterations, 1000)):
+        build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / iterations, peak
+
+
+def bench_keyboards(iterations: int):
+    """Сборка ответа обработчика: клавиатура с нуля против готовой"""
+    categories = [{'name': name} for name in DEFAULT_EXPENSE_CATEGORIES]
+    main_menu = get_main_menu()
+    category_keyboard = get_category_keyboard(categories)
+
+    cases = {
+        'main menu: rebuilt': lambda: SendMessage(
+            chat_id=1, text='Главное меню:', reply_markup=rebuild_keyboard(main_menu)),
+        'main menu: prebuilt': lambda: SendMessage(
+            chat_id=1, text='Главное меню:', reply_markup=get_main_menu()),
+        'categories: rebuilt': lambda: SendMessage(
+            chat_id=1, text='Выберите категорию расхода:', reply_markup=rebuild_keyboard(category_keyboard)),
+        'categories: memoized': lambda: SendMessage(
+            chat_id=1, text='Выберите категорию расхода:', reply_markup=get_category_keyboard(categories)),
+    }
+    for title, build in cases.items():
+        per_call, peak = measure(build, iterations)
+        print(f"{title:<32} {per_call * 1e6:8.2f}us/call  peak alloc {peak / 1024:8.1f} KiB")
+    print(f"category keyboard cache: {category_keyboard_cache.stats()}")
+
+
+class FakeSession(BaseSession):
+    """Сессия Bot API без сети: на любой запрос отвечает сразу"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        if method.__returning__ is Message:
+            return Message(
+                message_id=self.requests, date=datetime.now(),
+                chat=Chat(id=getattr(method, 'chat_id', 1), type='private'),
+                text=getattr(method, 'text', None)
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    """Текстовое сообщение пользователя в личном чате"""
+    user = User(id=user_id, is_bot=False, first_name=f'user{user_id}')
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(),
+        chat=Chat(id=user_id, type='private'), from_user=user, text=text
+    ))
+
+
+def make_callback(update_id: int, user_id: int, data: str) -> Update:
+    """Нажатие inline-кнопки под сообщением бота"""
+    user = User(id=user_id, is_bot=False, first_name=f'user{user_id}')
+    message = Message(
+        message_id=update_id, date=datetime.now(),
+        chat=Chat(id=user_id, type='private'), text='...'
+    )
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id), from_user=user, chat_instance=str(user_id), data=data, message=message
+    ))
+
+
+def user_scenario(user_id: int, first_round: bool) -> list:
+    """Шаги одного пользователя: (сценарий, 'text' | 'callback', данные)"""
+    steps = []
+    if first_round:
+        steps.append(('start', 'text', '/start'))
+    steps += [
+        ('income flow', 'text', '➕ Добавить доход'),
+        ('income flow', 'text', str(50000 + user_id)),
+        ('income flow', 'text', 'Зарплата'),
+        ('income flow', 'text', '⏭ Пропустить'),
+        ('expense flow', 'text', '➖ Добавить расход'),
+        ('expense flow', 'text', '1500,50'),
+        ('expense flow', 'text', 'Продукты'),
+        ('expense flow', 'text', 'молоко и хлеб'),
+        ('quick entry', 'text', '-300 транспорт метро'),
+        ('balance', 'text', '💰 Баланс'),
+        ('report', 'text', '📊 Отчет'),
+        ('report', 'callback', 'report_month'),
+        ('report', 'callback', 'report_all'),
+        ('debts', 'text', '📝 Долги'),
+        ('debts', 'text', '➕ Мне должны'),
+        ('debts', 'text', f'Друг {user_id}'),
+        ('debts', 'text', '1000'),
+        ('debts', 'text', '⏭ Пропустить'),
+        ('debts', 'text', '📋 Список долгов'),
+        ('debts', 'callback', 'debts_all'),
+        # Кнопка меню посреди диалога отвечает сама, а не становится
+        # ответом на текущий шаг: долг записывается на введенное после нее имя
+        ('menu in dialog', 'text', '➕ Мне должны'),
+        ('menu in dialog', 'text', '💰 Баланс'),
+        ('menu in dialog', 'text', f'Коллега {user_id}'),
+        ('menu in dialog', 'text', '500'),
+        ('menu in dialog', 'text', '⏭ Пропустить'),
+        ('categories', 'text', '⚙️ Настройки'),
+        ('categories', 'text', '📂 Управление категориями'),
+        ('categories', 'text', '📉 Категории расходов'),
+        ('categories', 'text', '🏠 Главное меню'),
+    ]
+    if first_round:
+        # Новая категория прямо из выбора категории расхода
+        steps += [
+            ('categories', 'text', '➖ Добавить расход'),
+            ('categories', 'text', '250'),
+            ('categories', 'text', '➕ Добавить категорию'),
+            ('categories', 'text', 'Кофейни'),
+            ('categories', 'text', 'Кофейни'),
+            ('categories', 'text', '⏭ Пропустить'),
+        ]
+    return steps
+
+
+async def bench_load(users: int, rounds: int, with_metrics: bool = False):
+    """Нагрузочный прогон handlers.py: N пользователей со сценариями через Dispatcher.
+
+    Пользователи работают одновременно, шаги одного пользователя идут
+    последовательно, как сообщения одного чата в Telegram. Состояния FSM
+    хранятся в SQLiteStorage, как в боевом режиме. С with_metrics
+    включаются замеры из metrics.py — для оценки их накладных расходов.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        await db.open()
+        await db.create_tables()
+        storage = SQLiteStorage(db)
+        await storage.open()
+        session = FakeSession()
+        bot = Bot('123456:' + 'A' * 35, session=session)
+        dp = Dispatcher(storage=storage)
+        register_handlers(dp, db)
+        metrics = setup_metrics(dp, db, storage) if with_metrics else None
+
+        # Трассировка вызывается в потоках соединений; append атомарен
+        statements = []
+        await db.set_trace_callback(lambda sql: statements.append(sql.split(None, 1)[0].upper()))
+
+        samples = {}
+        unhandled = []
+        update_ids = iter(range(1, 1 << 62))
+
+        async def run_user(user_id: int):
+            for round_number in range(rounds):
+                for scenario, kind, data in user_scenario(user_id, round_number == 0):
+                    update_id = next(update_ids)
+                    if kind == 'text':
+                        update = make_update(update_id, user_id, data)
+                    else:
+                        update = make_callback(update_id, user_id, data)
+                    started = time.perf_counter()
+                    result = await dp.feed_update(bot, update)
+                    samples.setdefault(scenario, []).append(time.perf_counter() - started)
+                    if result is UNHANDLED:
+                        unhandled.append((scenario, data))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(run_user(user_id) for user_id in range(1, users + 1)))
+        elapsed = time.perf_counter() - started
+        await db.set_trace_callback(None)
+
+        total = [sample for scenario_samples in samples.values() for sample in scenario_samples]
+        queries = [kind for kind in statements if kind not in ('BEGIN', 'COMMIT', 'ROLLBACK')]
+        print(f"users={users} rounds={rounds} updates={len(total)} "
+              f"elapsed={elapsed:.2f}s  {len(total) / elapsed:.0f} updates/s")
+        print(f"DB queries per update: {len(queries) / len(total):.2f} "
+              f"(transactions: {statements.count('BEGIN') / len(total):.2f}), "
+              f"Bot API calls per update: {session.requests / len(total):.2f}")
+        for scenario, scenario_samples in samples.items():
+            print_latency(scenario, scenario_samples)
+        print_latency('all updates', total)
+        if metrics is not None:
+            started = time.perf_counter()
+            exposition = metrics.render()
+            print(f"metrics: {exposition.count(chr(10))} lines, "
+                  f"rendered in {(time.perf_counter() - started) * 1e3:.1f}ms")
+        if unhandled:
+            print(f"unhandled updates: {len(unhandled)}, e.g. {unhandled[:3]}")
+        async with db._read() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM debts WHERE person_name = '💰 Баланс'") as cursor:
+                swallowed = (await cursor.fetchone())[0]
+        if swallowed:
+            print(f"menu buttons taken as dialog input: {swallowed}")
+
+        await storage.close()
+        await db.close()
+        return not unhandled and not swallowed
+
+
+async def bench_dispatch(updates: int):
+    """Обновления в секунду через настоящий Dispatcher с фиктивной сессией"""
+    texts = ['📝 Долги', '⚙️ Настройки', '📊 Отчет', '📤 Экспорт данных', '🏠 Главное меню']
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        await db.open()
+        await db.create_tables()
+        bot = Bot('123456:' + 'A' * 35, session=FakeSession())
+        dp = Dispatcher()
+        register_handlers(dp, db)
+
+        for text in texts:
+            batch = [make_update(i, i % 100 + 1, text) for i in range(updates)]
+            samples = []
+            started = time.perf_counter()
+            for update in batch:
+                begin = time.perf_counter()
+                await dp.feed_update(bot, update)
+                samples.append(time.perf_counter() - begin)
+            elapsed = time.perf_counter() - started
+            print(f"{text:<24} {updates / elapsed:10.0f} updates/s")
+            print_latency(f'{text} latency', samples)
+        await db.close()
+
+
+class InlineExecutor(Executor):
+    """Выполнение задачи прямо в вызывающем потоке — рисование в цикле событий"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+async def watch_loop_lag(samples: list, stop: asyncio.Event, interval: float = 0.005):
+    """Насколько позже заданного просыпается задача: задержка цикла событий"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+async def bench_charts(users: int, workers: int) -> bool:
+    """Одновременные запросы отчета с графиками через Dispatcher.
+
+    Сравниваются рисование прямо в цикле событий, пул процессов без
+    кэша и повторные запросы из кэша. Задержка цикла событий показывает,
+    насколько отрисовка тормозит обработку остальных пользователей.
+    """
+    renderer = ChartRenderer(workers)
+    if not renderer.available:
+        print("matplotlib не установлен")
+        return False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        await db.open()
+        await db.create_tables()
+        for user_id in range(1, users + 1):
+            await fill_history(db, user_id, 2000, days=90)
+        await db.rebuild_totals()
+
+        session = FakeSession()
+        bot = Bot('123456:' + 'A' * 35, session=session)
+        dp = Dispatcher()
+        register_handlers(dp, db, renderer)
+        update_ids = iter(range(1, 1 << 62))
+
+        async def run(title: str):
+            samples = []
+            lag = []
+            stop = asyncio.Event()
+            watcher = asyncio.create_task(watch_loop_lag(lag, stop))
+            requests_before = session.requests
+
+            async def request(user_id: int):
+                started = time.perf_counter()
+                await dp.feed_update(bot, make_callback(next(update_ids), user_id, 'report_all'))
+                samples.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(request(user_id) for user_id in range(1, users + 1)))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await watcher
+            print(f"{title:<20} {users / elapsed:8.1f} reports/s  "
+                  f"API calls per report: {(session.requests - requests_before) / users:.1f}")
+            print_latency(f'{title} request', samples)
+            print_latency(f'{title} loop lag', lag)
+            print(f"{'':<20} max loop lag {max(lag) * 1e3:.1f}ms")
+
+        # Рисование в цикле событий, как если бы пула не было
+        renderer._pool = InlineExecutor()
+        await run('inline')
+        renderer._pool = None
+        renderer.cache.clear()
+
+        # Запуск процессов пула не входит в замер
+        renderer.start()
+        await asyncio.gather(*(
+            asyncio.get_running_loop().run_in_executor(renderer._pool, time.sleep, 0.2)
+            for _ in range(workers)
+        ))
+        await run('process pool')
+        await run('cached')
+
+        renderer.close()
+        await db.close()
+        return True
+
+
+class FakeBotAPI:
+    """Локальный сервер Bot API: отвечает как Telegram и отдает 429 при превышении лимитов.
+
+    Лимиты: chat_rate сообщений в секунду на чат (chat_burst подряд) и
+    global_rate на бота. Каждый запрос отвечает с задержкой latency.
+    """
+
+    def __init__(self, chat_rate: float = 1, chat_burst: float = 3, global_rate: float = 30,
+                 latency: float = 0.03):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.latency = latency
+        self.chat_buckets = {}
+        self.requests = 0
+        self.flood_errors = 0
+        self.delivered = {}
+        self._message_ids = iter(range(1, 1 << 62))
+
+    def _limit_delay(self, chat_id: int) -> float:
+        now = time.monotonic()
+        bucket = self.chat_buckets.setdefault(chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+        delay = max(bucket.delay(now), self.global_bucket.delay(now))
+        if delay == 0:
+            bucket.take(now)
+            self.global_bucket.take(now)
+        return delay
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        form = await request.post()
+        chat_id = int(form['chat_id'])
+        await asyncio.sleep(self.latency)
+        delay = self._limit_delay(chat_id)
+        if delay:
+            self.flood_errors += 1
+            retry_after = max(1, int(delay + 0.999))
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {retry_after}',
+                'parameters': {'retry_after': retry_after},
+            }, status=429)
+        self.delivered.setdefault(chat_id, []).append(form['text'])
+        return web.json_response({'ok': True, 'result': {
+            'message_id': next(self._message_ids), 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'}, 'text': form['text'],
+        }})
+
+    async def start(self, port: int = 0) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return runner
+
+
+async def bench_outbox(chats: int, messages: int) -> bool:
+    """Всплеск ответов обработчиков против локального сервера Bot API.
+
+    Каждый из chats чатов получает messages сообщений подряд. Без
+    очереди обработчик сам пережидает 429 и повторяет отправку; с Outbox
+    отправки только ставятся в очередь и склеиваются, а в режиме
+    outbox-wait каждая ждет ответа и уходит отдельно. Проверяется, что каждое
+    сообщение доставлено, по порядку и ровно один раз.
+    """
+    ok = True
+    for mode in ('direct', 'outbox', 'outbox-wait'):
+        api = FakeBotAPI()
+        runner = await api.start()
+        session = AiohttpSession(api=TelegramAPIServer.from_base(f'http://127.0.0.1:{api.port}'))
+        bot = Bot('123456:' + 'A' * 35, session=session)
+        outbox = None
+        if mode != 'direct':
+            outbox = Outbox()
+            session.middleware(outbox)
+        detach = DetachSendsMiddleware()
+        handler_samples = []
+
+        async def send_all(chat_id: int):
+            for number in range(messages):
+                text = f'{chat_id}:{number}'
+                while True:
+                    try:
+                        await bot.send_message(chat_id, text)
+                        break
+                    except TelegramRetryAfter as e:
+                        await asyncio.sleep(e.retry_after)
+
+        async def handler(chat_id: int, data: dict):
+            started = time.perf_counter()
+            if mode == 'outbox-wait':
+                with wait_result():
+                    await send_all(chat_id)
+            else:
+                await send_all(chat_id)
+            handler_samples.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(detach(handler, chat_id, {}) for chat_id in range(1, chats + 1)))
+        if outbox is not None:
+            await outbox.close(timeout=600)
+        elapsed = time.perf_counter() - started
+
+        lost = 0
+        for chat_id in range(1, chats + 1):
+            expected = [f'{chat_id}:{number}' for number in range(messages)]
+            delivered = '\n\n'.join(api.delivered.get(chat_id, [])).split('\n\n')
+            if delivered != expected:
+                lost += 1
+        ok = ok and not lost
+        print(f"{mode:<11} {chats * messages} messages in {elapsed:.2f}s, "
+              f"API requests {api.requests}, 429 responses {api.flood_errors}, chats with wrong delivery {lost}")
+        print_latency(f'{mode} handler time', handler_samples)
+        if outbox is not None:
+            print(f"{'':<11} {outbox.stats()}")
+
+        await session.close()
+        await runner.cleanup()
+    return ok
+
+
+async def bench_digest(users: int, rows: int) -> bool:
+    """Недельные сводки всех пользователей и их рассылка с перезапуском.
+
+    Сначала отчеты строятся запросами на каждого пользователя (баланс и
+    две статистики по категориям) и страницами Database.get_digest_page;
+    тексты должны совпасть. Затем рассылка через Outbox на локальный
+    сервер Bot API прерывается на середине, БД открывается заново и
+    рассылка продолжается: каждый активный пользователь должен получить
+    не больше одной сводки. Исключения задач, которые никто не дождался,
+    тоже считаются ошибкой: отправки не должны переживать рассылку.
+    """
+    task_errors = []
+    asyncio.get_running_loop().set_exception_handler(lambda loop, context: task_errors.append(context))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        db = Database(path)
+        await db.open()
+        await db.create_tables()
+        for user_id in range(1, users + 1):
+            await db.add_user(user_id, f"user{user_id}")
+            # Примерно у трети пользователей нет операций за последнюю неделю
+            await fill_history(db, user_id, rows, days=365 if user_id % 3 else 30)
+            if user_id % 3 == 0:
+                async with db._write() as conn:
+                    await conn.execute(
+                        "DELETE FROM transactions WHERE user_id = ? AND date >= date('now', '-10 days')",
+                        (user_id,)
+                    )
+
+        fire = datetime.combine(datetime.now().date(), day_time(20, 0))
+        schedule = Schedule('weekly', 7, fire.time(), fire.weekday())
+        start_day, end_day = schedule.period(fire)
+        title = schedule.title(fire)
+
+        statements = []
+        await db.set_trace_callback(statements.append)
+        started = time.perf_counter()
+        naive = {}
+        for user_id in range(1, users + 1):
+            start, end = f'{start_day} 00:00:00', f'{end_day} 23:59:59'
+            balance = await db.get_balance(user_id, start, end)
+            income = await db.get_category_stats(user_id, 'income', start, end)
+            expense = await db.get_category_stats(user_id, 'expense', start, end)
+            if income or expense:
+                naive[user_id] = generate_report_text(title, balance, income, expense)
+        naive_time = time.perf_counter() - started
+        naive_queries = len(statements)
+
+        statements.clear()
+        started = time.perf_counter()
+        paged = {}
+        cursor = 0
+        while True:
+            cursor, reports = await db.get_digest_page('bench', start_day, end_day, cursor, 500)
+            if cursor is None:
+                break
+            for user_id, report in reports:
+                paged[user_id] = generate_report_text(
+                    title, report['balance'], report['income_stats'], report['expense_stats'])
+        paged_time = time.perf_counter() - started
+        paged_queries = len(statements)
+        await db.set_trace_callback(None)
+
+        print(f"per-user queries  {naive_time * 1000:8.1f} ms  {naive_queries} queries")
+        print(f"grouped pages     {paged_time * 1000:8.1f} ms  {paged_queries} queries")
+        ok = naive == paged
+        print(f"active users {len(paged)} of {users}, digests {'match' if ok else 'DIFFER'}")
+
+        api = FakeBotAPI(global_rate=1000, latency=0.01)
+        runner = await api.start()
+        session = AiohttpSession(api=TelegramAPIServer.from_base(f'http://127.0.0.1:{api.port}'))
+        outbox = Outbox(global_rate=400, max_concurrent=32)
+        session.middleware(outbox)
+        bot = Bot('123456:' + 'A' * 35, session=session)
+
+        started = time.perf_counter()
+        task = asyncio.create_task(DigestScheduler(bot, db, [schedule], rate=300).broadcast(schedule, fire))
+        while sum(map(len, api.delivered.values())) < len(paged) // 2 and not task.done():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        first_part = sum(map(len, api.delivered.values()))
+        # После отмены рассылки ни одна ее отправка не должна остаться
+        leaked = [other for other in asyncio.all_tasks()
+                  if not other.done() and other.get_coro().__qualname__ == 'DigestScheduler._deliver']
+
+        # Перезапуск: новое подключение к той же БД
+        await db.close()
+        db = Database(path)
+        await db.open()
+        counts = await DigestScheduler(bot, db, [schedule], rate=300).broadcast(schedule, fire)
+        again = await DigestScheduler(bot, db, [schedule], rate=300).broadcast(schedule, fire)
+        await outbox.close()
+        elapsed = time.perf_counter() - started
+
+        received = {user_id: len(texts) for user_id, texts in api.delivered.items()}
+        duplicates = sum(1 for count in received.values() if count > 1)
+        missing = len(set(paged) - set(received))
+        unexpected = len(set(received) - set(paged))
+        print(f"broadcast {elapsed:.2f}s: {first_part} before restart, {sum(received.values())} total, "
+              f"duplicates {duplicates}, not delivered {missing}, unexpected {unexpected}")
+        print(f"resumed run {counts}, repeated run {again}, deliveries left after cancel {len(leaked)}")
+        ok = ok and not duplicates and not unexpected and again is None and not leaked
+
+        await session.close()
+        await runner.cleanup()
+        await db.close()
+
+    # "Task exception was never retrieved" сообщается при сборке задачи
+    gc.collect()
+    await asyncio.sleep(0)
+    for context in task_errors:
+        print(f"unhandled: {context.get('message')} {context.get('exception')!r}")
+    return ok and not task_errors
+
+
+async def bench_recurring(rules: int, batch: int) -> bool:
+    """Планировщик регулярных операций после простоя.
+
+    У каждого десятого правила (ежемесячные) пропущено около трех дат,
+    остальные срабатывают в ближайшие сутки. Замеряется, как быстро
+    таймер догоняет пропущенное, сколько ключей одновременно лежит в
+    куче и сколько раз читалась очередная порция. Число записанных
+    операций должно совпасть с числом пропущенных дат.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        await db.open()
+        await db.create_tables()
+
+        now = datetime.now()
+        users = max(1, rules // 10)
+        expected = 0
+        overdue = 0
+        batch_rows = []
+        for i in range(rules):
+            if i % 10 == 0:
+                day = i % 28 + 1
+                first = next_occurrence('monthly', day, now - timedelta(days=95))
+                moment = first
+                while moment <= now:
+                    expected += 1
+                    moment = next_occurrence('monthly', day, moment)
+                overdue += 1
+                batch_rows.append((i % users + 1, 'monthly', day, to_db_date(first)))
+            else:
+                next_run = now + timedelta(seconds=random.randint(60, 86400))
+                batch_rows.append((i % users + 1, 'daily', None, to_db_date(next_run)))
+        async with db._write() as conn:
+            await conn.executemany(
+                'INSERT INTO users (user_id, username) VALUES (?, ?)',
+                [(user_id, f"user{user_id}") for user_id in range(1, users + 1)]
+            )
+            await conn.executemany(
+                '''INSERT INTO recurring (user_id, type, amount, category, period, day, next_run)
+                   VALUES (?, 'expense', 10000, 'Связь', ?, ?, ?)''',
+                batch_rows
+            )
+
+        loads = 0
+        load_page = db.get_schedule_page
+
+        async def counted_load(*args, **kwargs):
+            nonlocal loads
+            loads += 1
+            return await load_page(*args, **kwargs)
+        db.get_schedule_page = counted_load
+
+        bot = Bot('123456:' + 'A' * 35, session=FakeSession())
+        scheduler = RecurringScheduler(bot, db, batch_size=batch)
+        heap_peak = 0
+        started = time.perf_counter()
+        scheduler.start()
+        while scheduler.fired < overdue and time.perf_counter() - started < 600:
+            heap_peak = max(heap_peak, len(scheduler._heap))
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - started
+        await scheduler.close()
+
+        async with db._read() as conn:
+            async with conn.execute('SELECT COUNT(*) FROM transactions') as cursor:
+                recorded = (await cursor.fetchone())[0]
+            async with conn.execute('SELECT COUNT(*) FROM recurring WHERE next_run <= ?', (to_db_date(now),)) as cursor:
+                still_due = (await cursor.fetchone())[0]
+        await db.close()
+
+        print(f"{rules} rules, {overdue} overdue: caught up in {elapsed:.2f}s ({overdue / elapsed:.0f} rules/s)")
+        print(f"transactions {recorded} (expected {expected}), still overdue {still_due}, "
+              f"heap peak {heap_peak} (batch {batch}), page loads {loads}, run time {RUN_AT:%H:%M}")
+        return recorded == expected and still_due == 0 and heap_peak <= batch
+
+
+async def check_plans() -> bool:
+    """Проверка, что горячие запросы используют индексы, а не полный скан"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        db = await make_database(path, users=3, per_user=50)
+        await db.add_debt(1, 'lent', 'Иван', 1000)
+
+        statements = []
+        await db.set_trace_callback(statements.append)
+        await db.get_categories(1, 'expense')
+        await db.get_transactions(1)
+        await db.get_transactions(1, 'expense', '2024-01-01', '2030-01-01')
+        await db.get_transactions(1, cursor=('2030-01-01 00:00:00', 5), limit=6)
+        await db.get_transactions(1, 'income', cursor=('2020-01-01 00:00:00', 5), backward=True, limit=6)
+        await db.get_balance(1)
+        await db.get_balance(1, '2024-01-01', '2030-01-01')
+        await db.get_category_stats(1, 'expense')
+        await db.get_category_stats(1, 'income', '2024-01-01', '2030-01-01')
+        await db.get_daily_totals(1, 'expense')
+        await db.get_daily_totals(1, 'expense', '2024-01-01', '2030-01-01')
+        await db.get_debts(1)
+        await db.get_debts(1, is_paid=False)
+        await db.get_debts(1, is_paid=False, debt_type='lent', limit=11)
+        await db.get_debts(1, is_paid=False, debt_type='owe', cursor=('2030-01-01 00:00:00', 5), limit=11)
+        await db.get_debts(1, is_paid=False, cursor=('2020-01-01 00:00:00', 5), backward=True, limit=11)
+        await db.get_debt_totals(1)
+        await db.get_debt_totals(1, 'lent')
+        await db.get_digest_page('weekly:2030-01-01', '2024-01-01', '2030-01-01', 0, 500)
+        await db.get_schedule_page(None, 1000)
+        await db.get_schedule_page(('2030-01-01 10:00:00', 'debt', 5), 1000)
+        await db.set_trace_callback(None)
+
+        ok = True
+        async with aiosqlite.connect(path) as conn:
+            for sql in statements:
+                if not sql.lstrip().upper().startswith('SELECT'):
+                    continue
+                async with conn.execute('EXPLAIN QUERY PLAN ' + sql) as cursor:
+                    plan = [row[3] for row in await cursor.fetchall()]
+                # Полный скан таблицы; обход подзапроса (SCAN (subquery-N)) допустим,
+                # как и обход покрывающего индекса по порядку с LIMIT: читается
+                # только LIMIT записей
+                bounded = ' LIMIT ' in sql.upper()
+                scans = [step for step in plan if re.match(r'SCAN \w', step)
+                         and not (bounded and 'USING COVERING INDEX' in step)]
+                status = 'FAIL' if scans else 'ok'
+                ok = ok and not scans
+                print(f"[{status}] {' '.join(sql.split())}")
+                for step in plan:
+                    print(f"       {step}")
+        await db.close()
+        return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарки бота')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    pool = sub.add_parser('pool', help='задержка запроса: пул против connect-per-call')
+    pool.add_argument('--calls', type=int, default=2000)
+
+    sub.add_parser('plans', help='проверка планов запросов (EXPLAIN QUERY PLAN)')
+
+    report = sub.add_parser('report', help='задержка отчета при разном размере истории')
+    report.add_argument('--sizes', default='1000,10000,100000')
+    report.add_argument('--calls', type=int, default=50)
+
+    writes = sub.add_parser('writes', help='пропускная способность записи транзакций')
+    writes.add_argument('--users', type=int, default=100)
+    writes.add_argument('--per-user', type=int, default=50)
+
+    keyboards = sub.add_parser('keyboards', help='сборка ответа с клавиатурой')
+    keyboards.add_argument('--iterations', type=int, default=20000)
+
+    dispatch = sub.add_parser('dispatch', help='маршрутизация обновлений через Dispatcher')
+    dispatch.add_argument('--updates', type=int, default=5000)
+
+    load = sub.add_parser('load', help='нагрузочный прогон сценариев пользователей')
+    load.add_argument('--users', type=int, default=50)
+    load.add_argument('--rounds', type=int, default=5)
+    load.add_argument('--metrics', action='store_true', help='включить замеры metrics.py')
+
+    outbox = sub.add_parser('outbox', help='очередь исходящих сообщений против локального Bot API')
+    outbox.add_argument('--chats', type=int, default=50)
+    outbox.add_argument('--messages', type=int, default=5)
+
+    digest = sub.add_parser('digest', help='сводки: запросы по пользователю против сгруппированных и рассылка с перезапуском')
+    digest.add_argument('--users', type=int, default=1000)
+    digest.add_argument('--rows', type=int, default=100)
+
+    recurring = sub.add_parser('recurring', help='планировщик регулярных операций: догон после простоя')
+    recurring.add_argument('--rules', type=int, default=20000)
+    recurring.add_argument('--batch', type=int, default=1000)
+
+    charts = sub.add_parser('charts', help='отчеты с графиками: пул процессов против цикла событий')
+    charts.add_argument('--users', type=int, default=20)
+    charts.add_argument('--workers', type=int, default=2)
+
+    args = parser.parse_args()
+    if args.command == 'pool':
+        asyncio.run(bench_pool(args.calls))
+    elif args.command == 'report':
+        asyncio.run(bench_report([int(size) for size in args.sizes.split(',')], args.calls))
+    elif args.command == 'writes':
+        asyncio.run(bench_writes(args.users, args.per_user))
+    elif args.command == 'keyboards':
+        bench_keyboards(args.iterations)
+    elif args.command == 'dispatch':
+        asyncio.run(bench_dispatch(args.updates))
+    elif args.command == 'load':
+        if not asyncio.run(bench_load(args.users, args.rounds, args.metrics)):
+            raise SystemExit(1)
+    elif args.command == 'outbox':
+        if not asyncio.run(bench_outbox(args.chats, args.messages)):
+            raise SystemExit(1)
+    elif args.command == 'digest':
+        if not asyncio.run(bench_digest(args.users, args.rows)):
+            raise SystemExit(1)
+    elif args.command == 'recurring':
+        if not asyncio.run(bench_recurring(args.rules, args.batch)):
+            raise SystemExit(1)
+    elif args.command == 'charts':
+        if not asyncio.run(bench_charts(args.users, args.workers)):
+            raise SystemExit(1)
+    elif args.command == 'plans':
+        if not asyncio.run(check_plans()):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
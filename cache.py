@@ -0,0 +1,83 @@
+from collections import OrderedDict
+from typing import Any, Callable
+
+
+class LRUCache:
+    """Словарь ограниченного размера с вытеснением давно не использованных записей.
+
+    Счетчики hits/misses считают обращения через get(). Поле version
+    увеличивается при каждой инвалидации: значение, прочитанное из БД до
+    инвалидации, не попадет в кэш, если передать в set() версию, снятую
+    перед чтением.
+
+    С функцией weigh maxsize ограничивает не число записей, а сумму
+    weigh(value) по всем записям (например, размер в байтах).
+    """
+
+    def __init__(self, maxsize: int, weigh: Callable[[Any], int] = None):
+        self.maxsize = max(1, maxsize)
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+        self._data = OrderedDict()
+        self._weights = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, version: int = None):
+        if version is not None and version != self.version:
+            return
+        if self.weigh is not None:
+            weight = self.weigh(value)
+            self.weight += weight - self._weights.get(key, 0)
+            self._weights[key] = weight
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while self._data and self._oversized():
+            self._remove(next(iter(self._data)))
+
+    def _oversized(self) -> bool:
+        if self.weigh is None:
+            return len(self._data) > self.maxsize
+        return self.weight > self.maxsize
+
+    def _remove(self, key):
+        del self._data[key]
+        if self.weigh is not None:
+            self.weight -= self._weights.pop(key)
+
+    def invalidate(self, *keys):
+        self.version += 1
+        for key in keys:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        self.version += 1
+        self._data.clear()
+        self._weights.clear()
+        self.weight = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'weight': self.weight,
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import importlib.util
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+from typing import Optional
+
+from cache import LRUCache
+from config import CHART_WORKERS, CHART_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Сколько крупнейших категорий показывать отдельно, остальные — одной долей
+TOP_CATEGORIES = 7
+OTHER_LABEL = 'Прочее'
+
+
+def _init_worker():
+    """Импорт matplotlib один раз при старте процесса пула, без дисплея"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.figure  # noqa: F401
+
+
+def _top_categories(categories: list) -> list:
+    if len(categories) <= TOP_CATEGORIES:
+        return categories
+    head = categories[:TOP_CATEGORIES - 1]
+    rest = sum(total for _, total in categories[TOP_CATEGORIES - 1:])
+    return head + [(OTHER_LABEL, rest)]
+
+
+def _fill_days(daily: list) -> tuple:
+    """Дни без расходов добавляются с нулем, чтобы линия не соединяла пропуски"""
+    totals = {date.fromisoformat(day): total for day, total in daily}
+    first, last = min(totals), max(totals)
+    days = [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+    return days, [totals.get(day, 0) for day in days]
+
+
+def render_report_chart(title: str, categories: list, daily: list) -> bytes:
+    """PNG с долями и суммами расходов по категориям и расходами по дням.
+
+    Выполняется в процессе пула. categories — [(категория, сумма)] по
+    убыванию суммы, daily — [(день 'YYYY-MM-DD', сумма)].
+    """
+    from matplotlib.figure import Figure
+
+    # Поля заданы вручную: автоматическая раскладка вдвое замедляет отрисовку
+    figure = Figure(figsize=(10, 8))
+    grid = figure.add_gridspec(2, 2, left=0.1, right=0.97, top=0.92, bottom=0.1, wspace=0.5, hspace=0.3)
+    figure.suptitle(f'Расходы: {title}')
+
+    names = [name for name, _ in categories]
+    totals = [total for _, total in categories]
+
+    # Цвета долей и столбцов совпадают: подписи категорий есть только у столбцов
+    colors = [f'C{index}' for index in range(len(categories))]
+
+    pie = figure.add_subplot(grid[0, 0])
+    pie.pie(totals, colors=colors, startangle=90, counterclock=False,
+            autopct=lambda percent: f'{percent:.0f}%' if percent >= 5 else '')
+    pie.set_aspect('equal')
+
+    bars = figure.add_subplot(grid[0, 1])
+    bars.barh(names[::-1], totals[::-1], color=colors[::-1])
+    bars.set_xlabel('₸')
+
+    line = figure.add_subplot(grid[1, :])
+    if daily:
+        days, amounts = _fill_days(daily)
+        line.plot(days, amounts, marker='o' if len(days) <= 31 else None)
+        line.fill_between(days, amounts, alpha=0.2)
+    line.set_ylabel('₸ в день')
+    line.grid(alpha=0.3)
+    line.tick_params(axis='x', labelrotation=30)
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png', dpi=80)
+    return buffer.getvalue()
+
+
+class ChartRenderer:
+    """Графики отчета в пуле процессов с кэшем готовых PNG.
+
+    Рисование занимает процессор на десятки миллисекунд и в цикле
+    событий задерживало бы обработку остальных пользователей, поэтому
+    выполняется в отдельных процессах. Ключ кэша — (пользователь,
+    период, версия данных), где версия — отпечаток входных данных
+    графика; одинаковые одновременные запросы ждут одну отрисовку.
+    """
+
+    def __init__(self, workers: int = CHART_WORKERS, cache_size: int = CHART_CACHE_SIZE):
+        self.workers = workers
+        self.cache = LRUCache(cache_size)
+        # Без matplotlib отчет отправляется без графиков
+        self.available = importlib.util.find_spec('matplotlib') is not None
+        self._pool = None
+        self._pending = {}
+
+    def start(self):
+        if self._pool is not None or not self.available:
+            return
+        # spawn: процессы не наследуют потоки соединений БД и журналов
+        self._pool = ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker
+        )
+
+    def close(self):
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._pool = None
+
+    async def render(self, user_id: int, period: str, title: str,
+                     categories: list, daily: list) -> Optional[bytes]:
+        """PNG для отчета; None, если графики недоступны, расходов нет или отрисовка не удалась"""
+        if not self.available or not categories:
+            return None
+        categories = [(name, float(total)) for name, total in _top_categories(categories)]
+        daily = [(day, float(total)) for day, total in daily]
+        version = hashlib.sha1(repr((title, categories, daily)).encode('utf-8')).hexdigest()
+        key = (user_id, period, version)
+
+        png = self.cache.get(key)
+        if png is not None:
+            return png
+
+        future = self._pending.get(key)
+        pool = self._pool
+        try:
+            if future is None:
+                self.start()
+                pool = self._pool
+                future = asyncio.get_running_loop().run_in_executor(
+                    pool, render_report_chart, title, categories, daily
+                )
+                self._pending[key] = future
+                future.add_done_callback(lambda _: self._pending.pop(key, None))
+            # Отмена одного ожидающего не должна отменять общую отрисовку
+            png = await asyncio.shield(future)
+        except BrokenProcessPool:
+            # Процесс пула умер: следующий вызов start() создаст новый пул
+            logger.exception("Пул процессов графиков сломан, он будет пересоздан")
+            if pool is not None and self._pool is pool:
+                self._pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+            return None
+        except Exception:
+            # Отчет уже отправлен текстом: без графика он остается полным
+            logger.exception("Ошибка отрисовки графика отчета")
+            return None
+        # Устаревшие версии не удаляются явно: их вытесняет LRU
+        self.cache.set(key, png)
+        return png
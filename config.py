@@ -7,9 +7,42 @@ load_dotenv()
 # Токен бота (получить у @BotFather)
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Вебхук: публичный адрес бота (https://example.com); если пусто, вебхук
+# в Telegram не регистрируется и сервер принимает обновления только локально
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+
+# Вебхук: путь, адрес и порт локального HTTP-сервера
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+
+# Вебхук: секрет, который Telegram присылает в X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+
+# Вебхук: сколько обновлений обрабатывается одновременно
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv('WEBHOOK_MAX_IN_FLIGHT', '64'))
+
 # Путь к базе данных
 DATABASE_PATH = 'budget_bot.db'
 
+# Пул соединений с БД: число соединений на чтение (писатель всегда один)
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '4'))
+
+# Сколько ждать снятия блокировки записи, мс
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+
+# Размер страничного кэша SQLite на соединение, КБ
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '8192'))
+
+# Групповой коммит: максимум записей в одной транзакции
+DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', '256'))
+
+# Групповой коммит: сколько ждать попутные записи перед коммитом, мс
+DB_WRITE_BATCH_DELAY_MS = float(os.getenv('DB_WRITE_BATCH_DELAY_MS', '2'))
+
 # Категории расходов по умолчанию
 DEFAULT_EXPENSE_CATEGORIES = [
     'Продукты',
@@ -30,3 +63,117 @@ DEFAULT_INCOME_CATEGORIES = [
     'Подарки',
     'Другое'
 ]
+
+# Сколько долгов показывать на одной странице списка
+DEBTS_PAGE_SIZE = int(os.getenv('DEBTS_PAGE_SIZE', '10'))
+
+# Сколько транзакций показывать на одной странице истории
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '5'))
+
+# Экспорт: сколько строк читать из БД за один раз
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '1000'))
+
+# Экспорт: до какого размера файл держится в памяти, дальше — на диске
+EXPORT_SPOOL_MAX_BYTES = int(os.getenv('EXPORT_SPOOL_MAX_BYTES', str(1024 * 1024)))
+
+# Экспорт: сколько выгрузок выполняется одновременно
+EXPORT_MAX_CONCURRENT = int(os.getenv('EXPORT_MAX_CONCURRENT', '2'))
+
+# Кэш категорий: сколько наборов (пользователь, тип) держать в памяти
+CATEGORY_CACHE_SIZE = int(os.getenv('CATEGORY_CACHE_SIZE', '10000'))
+
+# Кэш клавиатур выбора категории: сколько разных наборов категорий хранить
+KEYBOARD_CACHE_SIZE = int(os.getenv('KEYBOARD_CACHE_SIZE', '1024'))
+
+# Хранилище FSM: сколько состояний держать в памяти (LRU)
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '10000'))
+
+# Хранилище FSM: через сколько часов бездействия незавершенный диалог удаляется
+FSM_STATE_TTL_HOURS = float(os.getenv('FSM_STATE_TTL_HOURS', '72'))
+
+# Хранилище FSM: период очистки устаревших состояний, минуты
+FSM_CLEANUP_INTERVAL_MINUTES = float(os.getenv('FSM_CLEANUP_INTERVAL_MINUTES', '60'))
+
+# Импорт выписок: сколько строк вставлять одной транзакцией
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '5000'))
+
+# Импорт выписок: максимальный размер файла, байты (Bot API отдает файлы до 20 МБ)
+IMPORT_MAX_BYTES = int(os.getenv('IMPORT_MAX_BYTES', str(20 * 1024 * 1024)))
+
+# Импорт выписок: как часто обновлять сообщение о ходе импорта, секунды
+IMPORT_PROGRESS_INTERVAL = float(os.getenv('IMPORT_PROGRESS_INTERVAL', '1'))
+
+# Метрики Prometheus: порт HTTP-сервера с /metrics (0 — метрики выключены)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Метрики Prometheus: адрес, на котором слушает сервер метрик
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+# Профилирование запросов к БД: 1 — писать время каждого запроса в журнал
+DB_PROFILE = os.getenv('DB_PROFILE', '0') == '1'
+
+# Профилирование: порог, после которого к запросу записывается EXPLAIN QUERY PLAN, мс
+DB_PROFILE_SLOW_MS = float(os.getenv('DB_PROFILE_SLOW_MS', '50'))
+
+# Профилирование: файл журнала (JSON-строки), его размер и число архивных копий
+DB_PROFILE_LOG = os.getenv('DB_PROFILE_LOG', 'db_profile.log')
+DB_PROFILE_LOG_MAX_BYTES = int(os.getenv('DB_PROFILE_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+DB_PROFILE_LOG_BACKUPS = int(os.getenv('DB_PROFILE_LOG_BACKUPS', '5'))
+
+# Графики к отчету (нужен matplotlib): 1 — прикладывать картинку к отчету
+REPORT_CHARTS = os.getenv('REPORT_CHARTS', '1') == '1'
+
+# Графики: сколько процессов рисуют картинки
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))
+
+# Графики: сколько готовых картинок держать в памяти (около 60 КБ каждая)
+CHART_CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', '256'))
+
+# Кэш готовых отчетов: сколько памяти он может занимать, байты
+REPORT_CACHE_MAX_BYTES = int(os.getenv('REPORT_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+# Кэш готовых отчетов: для скольких недавно писавших пользователей помнить
+# поколение данных; у остальных отчеты просто пересчитываются
+GENERATION_CACHE_SIZE = int(os.getenv('GENERATION_CACHE_SIZE', '100000'))
+
+# Исходящие сообщения: сообщений в секунду от бота в целом (лимит Telegram — около 30)
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '25'))
+
+# Исходящие сообщения: в секунду в один личный чат и сколько можно отправить подряд
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+SEND_CHAT_BURST = float(os.getenv('SEND_CHAT_BURST', '3'))
+
+# Исходящие сообщения: в минуту в одну группу (лимит Telegram — 20)
+SEND_GROUP_RATE_PER_MINUTE = float(os.getenv('SEND_GROUP_RATE_PER_MINUTE', '18'))
+
+# Исходящие сообщения: сколько запросов к Bot API выполняется одновременно
+SEND_MAX_CONCURRENT = int(os.getenv('SEND_MAX_CONCURRENT', '8'))
+
+# Исходящие сообщения: сколько раз повторять запрос после ответа 429
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))
+
+# Периодические сводки: время ежедневной сводки ЧЧ:ММ по времени сервера (пусто — не отправлять)
+DIGEST_DAILY_TIME = os.getenv('DIGEST_DAILY_TIME', '')
+
+# Периодические сводки: день недели (0 — понедельник) и время еженедельной сводки
+DIGEST_WEEKLY_DAY = int(os.getenv('DIGEST_WEEKLY_DAY', '6'))
+DIGEST_WEEKLY_TIME = os.getenv('DIGEST_WEEKLY_TIME', '20:00')
+
+# Периодические сводки: сколько минут после назначенного времени запущенный
+# бот еще досылает пропущенную или прерванную рассылку
+DIGEST_CATCH_UP_MINUTES = int(os.getenv('DIGEST_CATCH_UP_MINUTES', '180'))
+
+# Периодические сводки: сообщений в секунду (часть SEND_GLOBAL_RATE остается ответам)
+DIGEST_SEND_RATE = float(os.getenv('DIGEST_SEND_RATE', '15'))
+
+# Периодические сводки: пользователей на одну страницу сгруппированного запроса
+DIGEST_PAGE_SIZE = int(os.getenv('DIGEST_PAGE_SIZE', '500'))
+
+# Регулярные операции и напоминания о долгах: время срабатывания ЧЧ:ММ по времени сервера
+REMINDER_TIME = os.getenv('REMINDER_TIME', '10:00')
+
+# Напоминания о долгах: через сколько дней повторять, пока долг не погашен
+DEBT_REMIND_EVERY_DAYS = int(os.getenv('DEBT_REMIND_EVERY_DAYS', '3'))
+
+# Планировщик: сколько ближайших срабатываний держать в памяти
+SCHEDULER_BATCH_SIZE = int(os.getenv('SCHEDULER_BATCH_SIZE', '1000'))
@@ -1,84 +1,440 @@
+import asyncio
+import functools
+import inspect
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from time import perf_counter
+
 import aiosqlite
-from datetime import datetime
-from config import DATABASE_PATH
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from itertools import groupby
+
+from config import (
+    DATABASE_PATH, DB_READ_POOL_SIZE, DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_KB,
+    DB_WRITE_BATCH_SIZE, DB_WRITE_BATCH_DELAY_MS, CATEGORY_CACHE_SIZE, DB_PROFILE,
+    GENERATION_CACHE_SIZE
+)
+from cache import LRUCache
+from migrations import apply_migrations
+from profiler import QueryProfiler
+from utils import to_minor, from_minor
+
+# PRAGMA, применяемые к каждому соединению пула
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}',
+    f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}',
+)
+
+# Таблицы агрегатов: (таблица, колонка периода, длина префикса даты)
+ROLLUP_TABLES = (
+    ('rollup_daily', 'day', 10),
+    ('rollup_monthly', 'month', 7),
+)
+
+# Методы Database, которые не являются запросами и не замеряются instrument()
+SERVICE_METHODS = frozenset({'open', 'close', 'create_tables', 'set_trace_callback'})
+
+# Формат даты в колонке transactions.date (как у CURRENT_TIMESTAMP)
+DB_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _money_row(row, *columns) -> dict:
+    """Строка запроса в словарь с суммами в Decimal вместо целых тиынов"""
+    result = dict(row)
+    for column in columns:
+        result[column] = from_minor(result[column])
+    return result
+
+
+def _balance(income: int, expense: int) -> dict:
+    """Баланс из сумм в тиынах: разность считается до перевода в Decimal"""
+    return {'income': from_minor(income), 'expense': from_minor(expense), 'balance': from_minor(income - expense)}
+
+
+def _report_from_rows(rows) -> dict:
+    """Отчет как в get_report из строк (type, category, total, count) по убыванию суммы"""
+    stats = {'income': [], 'expense': []}
+    for row in rows:
+        stats[row['type']].append(
+            {'category': row['category'], 'total': from_minor(row['total']), 'count': row['count']}
+        )
+
+    # Итоги складываются в целых тиынах, до перевода в Decimal
+    income = sum(row['total'] for row in rows if row['type'] == 'income')
+    expense = sum(row['total'] for row in rows if row['type'] == 'expense')
+    return {
+        'balance': _balance(income, expense),
+        'income_stats': stats['income'],
+        'expense_stats': stats['expense'],
+    }
+
+
+def to_db_date(value) -> str:
+    """Приведение границы периода (datetime или ISO-строки) к формату БД"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.strftime(DB_DATE_FORMAT)
+
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _next_month(day: date) -> date:
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def split_period(start: datetime = None, end: datetime = None):
+    """Разбиение периода на целые месяцы, целые дни и неполные сутки по краям.
+
+    Возвращает (months, days, edges): списки пар границ (включительно) для
+    rollup_monthly, rollup_daily и сырых строк transactions. None в
+    границе означает отсутствие ограничения с этой стороны.
+    """
+    first_day = None
+    last_day = None
+    edges = []
+
+    if start is not None:
+        first_day = start.date() if start.time() == time.min else start.date() + timedelta(days=1)
+    if end is not None:
+        last_day = end.date() if end.time() >= time(23, 59, 59) else end.date() - timedelta(days=1)
+
+    if first_day is not None and last_day is not None and first_day > last_day:
+        # Период не содержит ни одних полных суток
+        return [], [], [(to_db_date(start), to_db_date(end))]
+
+    if start is not None and first_day != start.date():
+        edges.append((to_db_date(start), to_db_date(datetime.combine(start.date(), time(23, 59, 59)))))
+    if end is not None and last_day != end.date():
+        edges.append((to_db_date(datetime.combine(end.date(), time.min)), to_db_date(end)))
+
+    # Полные месяцы внутри [first_day, last_day]
+    first_month = None
+    if first_day is not None:
+        first_month = first_day if first_day.day == 1 else _next_month(first_day)
+    last_month = None
+    if last_day is not None:
+        if (last_day + timedelta(days=1)).day == 1:
+            last_month = _month_start(last_day)
+        else:
+            last_month = _month_start(_month_start(last_day) - timedelta(days=1))
+
+    if first_month is not None and last_month is not None and first_month > last_month:
+        return [], [(first_day.isoformat(), last_day.isoformat())], edges
+
+    months = [(
+        first_month.strftime('%Y-%m') if first_month else None,
+        last_month.strftime('%Y-%m') if last_month else None,
+    )]
+    days = []
+    if first_day is not None and first_day < first_month:
+        days.append((first_day.isoformat(), (first_month - timedelta(days=1)).isoformat()))
+    if last_day is not None:
+        after_months = _next_month(last_month)
+        if after_months <= last_day:
+            days.append((after_months.isoformat(), last_day.isoformat()))
+    return months, days, edges
+
+
+def _period_parts_query(user_id: int, start_date=None, end_date=None, trans_type: str = None):
+    """Запрос (type, category, total, count) за период по агрегатам и краевым строкам"""
+    start = datetime.fromisoformat(to_db_date(start_date)) if start_date else None
+    end = datetime.fromisoformat(to_db_date(end_date)) if end_date else None
+    months, days, edges = split_period(start, end)
+
+    parts = []
+    params = []
+
+    def add_part(select: str, column: str, low, high):
+        sql = select + ' WHERE user_id = ?'
+        params.append(user_id)
+        if trans_type:
+            sql += ' AND type = ?'
+            params.append(trans_type)
+        if low is not None:
+            sql += f' AND {column} >= ?'
+            params.append(low)
+        if high is not None:
+            sql += f' AND {column} <= ?'
+            params.append(high)
+        parts.append(sql)
+
+    for low, high in months:
+        add_part('SELECT type, category, total, count FROM rollup_monthly', 'month', low, high)
+    for low, high in days:
+        add_part('SELECT type, category, total, count FROM rollup_daily', 'day', low, high)
+    for low, high in edges:
+        add_part('SELECT type, category, amount AS total, 1 AS count FROM transactions', 'date', low, high)
+
+    query = f'''
+        SELECT type, category, SUM(total) AS total, SUM(count) AS count
+        FROM ({' UNION ALL '.join(parts)})
+        GROUP BY type, category
+    '''
+    return query, params
+
+
+def _timed(method, name: str, observe):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            observe(name, perf_counter() - started)
+    return wrapper
 
 
 class Database:
-    def __init__(self):
-        self.db_path = DATABASE_PATH
+    def __init__(self, db_path: str = DATABASE_PATH, readers: int = DB_READ_POOL_SIZE,
+                 write_batch_size: int = DB_WRITE_BATCH_SIZE,
+                 write_batch_delay_ms: float = DB_WRITE_BATCH_DELAY_MS,
+                 profile: bool = DB_PROFILE):
+        self.db_path = db_path
+        self.readers = max(1, readers)
+        self.write_batch_size = max(1, write_batch_size)
+        self.write_batch_delay = max(0, write_batch_delay_ms) / 1000
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._read_pool = None
+        self._read_conns = []
+        self._write_queue = None
+        self._write_task = None
+        # Категории пользователей: (user_id, type) -> кортеж записей
+        self.category_cache = LRUCache(CATEGORY_CACHE_SIZE)
+        # Поколения данных пользователей (см. data_generation)
+        self._generation_clock = 0
+        self._generation_floor = 0
+        self._generations = OrderedDict()
+        # Журнал времени запросов и планов медленных запросов (см. profiler.py)
+        self.profiler = QueryProfiler() if profile else None
 
-    async def create_tables(self):
-        """Создание таблиц в базе данных"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Таблица пользователей
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+    async def _connect(self):
+        """Открытие соединения с настроенными PRAGMA"""
+        conn = await aiosqlite.connect(self.db_path)
+        conn.row_factory = aiosqlite.Row
+        for pragma in CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        return conn
 
-            # Таблица транзакций (доходы и расходы)
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    type TEXT NOT NULL CHECK(type IN ('income', 'expense')),
-                    amount REAL NOT NULL,
-                    category TEXT NOT NULL,
-                    description TEXT,
-                    date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
+    async def open(self):
+        """Открытие пула: одно соединение на запись и несколько на чтение"""
+        if self._writer is not None:
+            return
+        if self.profiler is not None:
+            self.profiler.start()
+        # Писатель открывается первым, чтобы включить WAL до появления читателей
+        self._writer = self._profiled(await self._connect(), 'writer')
+        self._read_pool = asyncio.Queue()
+        for _ in range(self.readers):
+            conn = self._profiled(await self._connect(), 'reader')
+            self._read_conns.append(conn)
+            self._read_pool.put_nowait(conn)
+        self._write_queue = asyncio.Queue()
+        self._write_task = asyncio.create_task(self._group_commit_loop())
 
-            # Таблица долгов
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS debts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    type TEXT NOT NULL CHECK(type IN ('owe', 'lent')),
-                    person_name TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    description TEXT,
-                    is_paid BOOLEAN DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    paid_at TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
+    async def close(self):
+        """Закрытие всех соединений пула"""
+        if self._write_task is not None:
+            # Дожидаемся записи всего, что уже поставлено в очередь
+            self._write_queue.put_nowait(None)
+            await self._write_task
+            self._write_task = None
+            self._write_queue = None
+        for conn in self._read_conns:
+            await conn.close()
+        self._read_conns = []
+        self._read_pool = None
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+        if self.profiler is not None:
+            self.profiler.stop()
 
-            # Таблица категорий
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS categories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    type TEXT NOT NULL CHECK(type IN ('income', 'expense')),
-                    name TEXT NOT NULL,
-                    is_default BOOLEAN DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id),
-                    UNIQUE(user_id, type, name)
-                )
-            ''')
+    def _profiled(self, conn, role: str):
+        return conn if self.profiler is None else self.profiler.wrap(conn, role)
+
+    async def set_trace_callback(self, callback):
+        """Установка обработчика выполняемого SQL на все соединения пула"""
+        for conn in [self._writer, *self._read_conns]:
+            await conn.set_trace_callback(callback)
+
+    def instrument(self, observe):
+        """Замер времени каждого запроса: observe(имя метода, секунды).
+
+        Методы оборачиваются на этом экземпляре, поэтому без вызова
+        instrument() замеры ничего не стоят.
+        """
+        for name, _ in inspect.getmembers(type(self), inspect.iscoroutinefunction):
+            if name.startswith('_') or name in SERVICE_METHODS:
+                continue
+            setattr(self, name, _timed(getattr(self, name), name, observe))
 
-            await db.commit()
+    def data_generation(self, user_id: int) -> int:
+        """Поколение данных пользователя: растет после каждой записи его данных.
+
+        Подходит как часть ключа кэша того, что вычисляется из этих данных:
+        поколение снимается до чтения из БД и увеличивается только после
+        фиксации записи, поэтому значение не попадет в кэш под ключом
+        более нового поколения, чем данные, из которых оно построено.
+        """
+        return max(self._generations.get(user_id, 0), self._generation_floor)
+
+    def _touch(self, user_id: int):
+        self._generation_clock += 1
+        self._generations[user_id] = self._generation_clock
+        self._generations.move_to_end(user_id)
+        if len(self._generations) > GENERATION_CACHE_SIZE:
+            # Давно не писавший пользователь забывается: пол поднимается до
+            # его поколения, и его поколение не уменьшится
+            _, generation = self._generations.popitem(last=False)
+            self._generation_floor = max(self._generation_floor, generation)
+
+    def _touch_all(self):
+        self._generation_clock += 1
+        self._generation_floor = self._generation_clock
+        self._generations.clear()
+
+    def pending_writes(self) -> int:
+        """Число записей, ожидающих группового коммита"""
+        return self._write_queue.qsize() if self._write_queue is not None else 0
+
+    @asynccontextmanager
+    async def _read(self):
+        """Соединение для чтения из пула"""
+        if self._read_pool is None:
+            raise RuntimeError('Database is not open, call open() first')
+        if self.profiler is None:
+            conn = await self._read_pool.get()
+        else:
+            started = perf_counter()
+            conn = await self._read_pool.get()
+            self.profiler.record_wait('reader_pool', perf_counter() - started)
+        try:
+            yield conn
+        finally:
+            self._read_pool.put_nowait(conn)
+
+    @asynccontextmanager
+    async def _write(self):
+        """Единственное соединение для записи; транзакция фиксируется при выходе"""
+        if self._writer is None:
+            raise RuntimeError('Database is not open, call open() first')
+        started = perf_counter()
+        async with self._write_lock:
+            if self.profiler is not None:
+                self.profiler.record_wait('write_lock', perf_counter() - started)
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+
+    async def _enqueue_write(self, sql: str, params: tuple, rowcount: bool = False):
+        """Постановка записи в очередь группового коммита; ждет фиксации транзакции.
+
+        С rowcount=True возвращает число строк, измененных этим запросом:
+        такие запросы выполняются в пакете по одному, а не через executemany.
+        """
+        if self._write_queue is None:
+            raise RuntimeError('Database is not open, call open() first')
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((sql, params, future, rowcount))
+        if self.profiler is None:
+            return await future
+        # Ожидание в очереди вместе с фиксацией пакета
+        started = perf_counter()
+        try:
+            return await future
+        finally:
+            self.profiler.record_wait('write_queue', perf_counter() - started)
+
+    def _drain_write_queue(self, batch: list) -> bool:
+        """Добор ожидающих записей в пакет; False, если встречен сигнал остановки"""
+        while len(batch) < self.write_batch_size:
+            try:
+                item = self._write_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is None:
+                return False
+            batch.append(item)
+        return True
+
+    async def _group_commit_loop(self):
+        """Фоновая задача: собирает записи за несколько миллисекунд и фиксирует их разом"""
+        running = True
+        while running:
+            item = await self._write_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            running = self._drain_write_queue(batch)
+            if running and len(batch) < self.write_batch_size and self.write_batch_delay:
+                await asyncio.sleep(self.write_batch_delay)
+                running = self._drain_write_queue(batch)
+            await self._apply_write_batch(batch)
+
+    async def _apply_write_batch(self, batch: list):
+        """Применение пакета записей в одной транзакции"""
+        async with self._write_lock:
+            results = {}
+            try:
+                # Подряд идущие одинаковые запросы выполняются одним executemany
+                for (sql, rowcount), items in groupby(batch, key=lambda item: (item[0], item[3])):
+                    if rowcount:
+                        for _, params, future, _ in items:
+                            cursor = await self._writer.execute(sql, params)
+                            results[future] = cursor.rowcount
+                    else:
+                        await self._writer.executemany(sql, [params for _, params, _, _ in items])
+                await self._writer.commit()
+            except Exception:
+                await self._writer.rollback()
+                # Пакет откатился целиком: повторяем записи по одной,
+                # чтобы ошибка досталась только виновнику
+                for sql, params, future, rowcount in batch:
+                    try:
+                        cursor = await self._writer.execute(sql, params)
+                        await self._writer.commit()
+                    except Exception as error:
+                        await self._writer.rollback()
+                        if not future.done():
+                            future.set_exception(error)
+                    else:
+                        if not future.done():
+                            future.set_result(cursor.rowcount if rowcount else None)
+                return
+
+        for _, _, future, _ in batch:
+            if not future.done():
+                future.set_result(results.get(future))
+
+    async def create_tables(self):
+        """Создание таблиц в базе данных и применение миграций схемы"""
+        async with self._write() as db:
+            await apply_migrations(db)
 
     async def add_user(self, user_id: int, username: str):
         """Добавление нового пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute(
                 'INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)',
                 (user_id, username)
             )
-            await db.commit()
 
     async def init_default_categories(self, user_id: int):
         """Инициализация категорий по умолчанию для нового пользователя"""
         from config import DEFAULT_EXPENSE_CATEGORIES, DEFAULT_INCOME_CATEGORIES
 
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             # Добавление категорий расходов
             for category in DEFAULT_EXPENSE_CATEGORIES:
                 await db.execute(
@@ -93,68 +449,84 @@ class Database:
                     (user_id, 'income', category, 1)
                 )
 
-            await db.commit()
+        self.category_cache.invalidate((user_id, 'expense'), (user_id, 'income'))
+        self._touch(user_id)
 
     async def get_categories(self, user_id: int, cat_type: str):
-        """Получение категорий пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        """Получение категорий пользователя (кэшируется до изменения категорий)"""
+        key = (user_id, cat_type)
+        categories = self.category_cache.get(key)
+        if categories is not None:
+            return categories
+
+        version = self.category_cache.version
+        async with self._read() as db:
             async with db.execute(
                 'SELECT * FROM categories WHERE user_id = ? AND type = ? ORDER BY is_default DESC, name',
                 (user_id, cat_type)
             ) as cursor:
                 rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                categories = tuple(dict(row) for row in rows)
+
+        self.category_cache.set(key, categories, version=version)
+        return categories
 
     async def add_category(self, user_id: int, cat_type: str, name: str):
         """Добавление новой категории"""
-        async with aiosqlite.connect(self.db_path) as db:
-            try:
+        try:
+            async with self._write() as db:
                 await db.execute(
                     'INSERT INTO categories (user_id, type, name) VALUES (?, ?, ?)',
                     (user_id, cat_type, name)
                 )
-                await db.commit()
-                return True
-            except aiosqlite.IntegrityError:
-                return False
+        except aiosqlite.IntegrityError:
+            return False
+
+        self.category_cache.invalidate((user_id, cat_type))
+        self._touch(user_id)
+        return True
 
     async def delete_category(self, user_id: int, cat_type: str, name: str):
         """Удаление категории (только пользовательские, не дефолтные)"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute(
                 'DELETE FROM categories WHERE user_id = ? AND type = ? AND name = ? AND is_default = 0',
                 (user_id, cat_type, name)
             )
-            await db.commit()
 
-    async def add_transaction(self, user_id: int, trans_type: str, amount: float,
+        self.category_cache.invalidate((user_id, cat_type))
+        self._touch(user_id)
+
+    async def add_transaction(self, user_id: int, trans_type: str, amount: Decimal,
                             category: str, description: str = None):
         """Добавление транзакции (дохода или расхода)"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                '''INSERT INTO transactions (user_id, type, amount, category, description)
-                   VALUES (?, ?, ?, ?, ?)''',
-                (user_id, trans_type, amount, category, description)
-            )
-            await db.commit()
+        await self._enqueue_write(
+            '''INSERT INTO transactions (user_id, type, amount, category, description)
+               VALUES (?, ?, ?, ?, ?)''',
+            (user_id, trans_type, to_minor(amount), category, description)
+        )
+        self._touch(user_id)
 
     async def add_debt(self, user_id: int, debt_type: str, person_name: str,
-                      amount: float, description: str = None):
+                      amount: Decimal, description: str = None):
         """Добавление долга"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                '''INSERT INTO debts (user_id, type, person_name, amount, description)
-                   VALUES (?, ?, ?, ?, ?)''',
-                (user_id, debt_type, person_name, amount, description)
-            )
-            await db.commit()
+        await self._enqueue_write(
+            '''INSERT INTO debts (user_id, type, person_name, amount, description)
+               VALUES (?, ?, ?, ?, ?)''',
+            (user_id, debt_type, person_name, to_minor(amount), description)
+        )
+        self._touch(user_id)
 
     async def get_transactions(self, user_id: int, trans_type: str = None,
-                              start_date: str = None, end_date: str = None):
-        """Получение транзакций пользователя с фильтрацией"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+                              start_date: str = None, end_date: str = None,
+                              category: str = None, cursor: tuple = None,
+                              backward: bool = False, limit: int = None):
+        """Получение транзакций пользователя с фильтрацией, от новых к старым.
+
+        cursor — ключ (date, id) границы страницы: без backward
+        возвращаются транзакции старше нее, с backward — новее нее.
+        """
+        async with self._read() as db:
             query = 'SELECT * FROM transactions WHERE user_id = ?'
             params = [user_id]
 
@@ -162,24 +534,177 @@ class Database:
                 query += ' AND type = ?'
                 params.append(trans_type)
 
+            if category:
+                query += ' AND category = ?'
+                params.append(category)
+
             if start_date:
                 query += ' AND date >= ?'
-                params.append(start_date)
+                params.append(to_db_date(start_date))
 
             if end_date:
                 query += ' AND date <= ?'
-                params.append(end_date)
+                params.append(to_db_date(end_date))
+
+            if cursor:
+                query += ' AND (date, id) > (?, ?)' if backward else ' AND (date, id) < (?, ?)'
+                params.extend(cursor)
+
+            order = 'ASC' if backward else 'DESC'
+            query += f' ORDER BY date {order}, id {order}'
+
+            if limit:
+                query += ' LIMIT ?'
+                params.append(limit)
 
-            query += ' ORDER BY date DESC'
+            async with db.execute(query, params) as db_cursor:
+                rows = await db_cursor.fetchall()
+                transactions = [_money_row(row, 'amount') for row in rows]
+                if backward:
+                    transactions.reverse()
+                return transactions
 
+    async def import_transactions(self, user_id: int, rows: list) -> int:
+        """Пакетная вставка транзакций (type, amount, category, description, date, import_hash).
+
+        Строки с уже импортированным import_hash пропускаются. Итоги и
+        агрегаты по периодам пересчитываются одним проходом по новым
+        строкам вместо срабатывания триггера на каждую. Возвращает число
+        добавленных строк.
+        """
+        async with self._write() as db:
+            async with db.execute('SELECT COALESCE(MAX(id), 0) FROM transactions') as cursor:
+                last_id = (await cursor.fetchone())[0]
+
+            await db.execute('INSERT OR IGNORE INTO bulk_write_guard (id) VALUES (1)')
+            await db.executemany(
+                '''INSERT OR IGNORE INTO transactions
+                   (user_id, type, amount, category, description, date, import_hash)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                [(user_id, trans_type, to_minor(amount), *rest) for trans_type, amount, *rest in rows]
+            )
+            await db.execute('DELETE FROM bulk_write_guard')
+
+            async with db.execute(
+                'SELECT COUNT(*) FROM transactions WHERE id > ? AND user_id = ?',
+                (last_id, user_id)
+            ) as cursor:
+                inserted = (await cursor.fetchone())[0]
+
+            if inserted:
+                await db.execute('''
+                    INSERT INTO user_totals (user_id, income, expense)
+                    SELECT
+                        user_id,
+                        SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END),
+                        SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END)
+                    FROM transactions
+                    WHERE id > ? AND user_id = ?
+                    GROUP BY user_id
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        income = income + excluded.income,
+                        expense = expense + excluded.expense
+                ''', (last_id, user_id))
+                for table, column, length in ROLLUP_TABLES:
+                    await db.execute(f'''
+                        INSERT INTO {table} (user_id, {column}, type, category, total, count)
+                        SELECT user_id, substr(date, 1, {length}), type, category, SUM(amount), COUNT(*)
+                        FROM transactions
+                        WHERE id > ? AND user_id = ?
+                        GROUP BY user_id, substr(date, 1, {length}), type, category
+                        ON CONFLICT(user_id, {column}, type, category) DO UPDATE SET
+                            total = total + excluded.total,
+                            count = count + excluded.count
+                    ''', (last_id, user_id))
+
+        if inserted:
+            self._touch(user_id)
+        return inserted
+
+    async def _iter_rows(self, query: str, params: tuple, chunk_size: int, money: int = None):
+        """Потоковое чтение результата запроса пакетами по chunk_size строк.
+
+        money — номер колонки с суммой: она отдается в Decimal.
+        """
+        async with self._read() as db:
             async with db.execute(query, params) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                while True:
+                    rows = await cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    if money is not None:
+                        rows = [(*row[:money], from_minor(row[money]), *row[money + 1:]) for row in rows]
+                    yield rows
+
+    def iter_transactions(self, user_id: int, columns: tuple, chunk_size: int = 1000):
+        """Все транзакции пользователя пакетами строк, в порядке добавления"""
+        return self._iter_rows(
+            f'SELECT {", ".join(columns)} FROM transactions WHERE user_id = ? ORDER BY date, id',
+            (user_id,), chunk_size, columns.index('amount') if 'amount' in columns else None
+        )
+
+    def iter_debts(self, user_id: int, columns: tuple, chunk_size: int = 1000):
+        """Все долги пользователя пакетами строк, в порядке добавления"""
+        return self._iter_rows(
+            f'SELECT {", ".join(columns)} FROM debts WHERE user_id = ? ORDER BY created_at, id',
+            (user_id,), chunk_size, columns.index('amount') if 'amount' in columns else None
+        )
+
+    async def get_transaction(self, user_id: int, trans_id: int):
+        """Получение одной транзакции пользователя"""
+        async with self._read() as db:
+            async with db.execute(
+                'SELECT * FROM transactions WHERE id = ? AND user_id = ?',
+                (trans_id, user_id)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return _money_row(row, 'amount') if row else None
+
+    async def update_transaction(self, user_id: int, trans_id: int, amount: Decimal = None,
+                                 category: str = None, description: str = None) -> bool:
+        """Изменение транзакции; итоги и агрегаты обновляются триггерами"""
+        fields = []
+        params = []
+        if amount is not None:
+            fields.append('amount = ?')
+            params.append(to_minor(amount))
+        if category is not None:
+            fields.append('category = ?')
+            params.append(category)
+        if description is not None:
+            fields.append('description = ?')
+            params.append(description)
+        if not fields:
+            return False
 
-    async def get_debts(self, user_id: int, is_paid: bool = None):
-        """Получение долгов пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._write() as db:
+            cursor = await db.execute(
+                f'UPDATE transactions SET {", ".join(fields)} WHERE id = ? AND user_id = ?',
+                (*params, trans_id, user_id)
+            )
+            updated = cursor.rowcount > 0
+        self._touch(user_id)
+        return updated
+
+    async def delete_transaction(self, user_id: int, trans_id: int) -> bool:
+        """Удаление транзакции; итоги и агрегаты обновляются триггерами"""
+        async with self._write() as db:
+            cursor = await db.execute(
+                'DELETE FROM transactions WHERE id = ? AND user_id = ?',
+                (trans_id, user_id)
+            )
+            deleted = cursor.rowcount > 0
+        self._touch(user_id)
+        return deleted
+
+    async def get_debts(self, user_id: int, is_paid: bool = None, debt_type: str = None,
+                        cursor: tuple = None, backward: bool = False, limit: int = None):
+        """Получение долгов пользователя, от новых к старым.
+
+        cursor — ключ (created_at, id) границы страницы: без backward
+        возвращаются долги старше нее, с backward — новее нее.
+        """
+        async with self._read() as db:
             query = 'SELECT * FROM debts WHERE user_id = ?'
             params = [user_id]
 
@@ -187,69 +712,467 @@ class Database:
                 query += ' AND is_paid = ?'
                 params.append(1 if is_paid else 0)
 
-            query += ' ORDER BY created_at DESC'
+            if debt_type:
+                query += ' AND type = ?'
+                params.append(debt_type)
 
-            async with db.execute(query, params) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+            if cursor:
+                query += ' AND (created_at, id) > (?, ?)' if backward else ' AND (created_at, id) < (?, ?)'
+                params.extend(cursor)
 
-    async def mark_debt_paid(self, debt_id: int):
-        """Отметить долг как оплаченный"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                'UPDATE debts SET is_paid = 1, paid_at = CURRENT_TIMESTAMP WHERE id = ?',
-                (debt_id,)
-            )
-            await db.commit()
+            order = 'ASC' if backward else 'DESC'
+            query += f' ORDER BY created_at {order}, id {order}'
 
-    async def get_balance(self, user_id: int, start_date: str = None, end_date: str = None):
-        """Получение баланса (доходы - расходы)"""
-        async with aiosqlite.connect(self.db_path) as db:
-            query = '''
-                SELECT
-                    SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as total_income,
-                    SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as total_expense
-                FROM transactions
-                WHERE user_id = ?
-            '''
+            if limit:
+                query += ' LIMIT ?'
+                params.append(limit)
+
+            async with db.execute(query, params) as db_cursor:
+                rows = await db_cursor.fetchall()
+                debts = [_money_row(row, 'amount') for row in rows]
+                if backward:
+                    debts.reverse()
+                return debts
+
+    async def get_debt_totals(self, user_id: int, debt_type: str = None):
+        """Суммы и количество непогашенных долгов по типам"""
+        async with self._read() as db:
+            query = 'SELECT type, SUM(amount) AS total, COUNT(*) AS count FROM debts WHERE user_id = ? AND is_paid = 0'
             params = [user_id]
 
-            if start_date:
-                query += ' AND date >= ?'
-                params.append(start_date)
+            if debt_type:
+                query += ' AND type = ?'
+                params.append(debt_type)
 
-            if end_date:
-                query += ' AND date <= ?'
-                params.append(end_date)
+            query += ' GROUP BY type'
 
+            totals = {'lent': from_minor(0), 'owe': from_minor(0), 'count': 0}
             async with db.execute(query, params) as cursor:
+                async for row in cursor:
+                    totals[row['type']] = from_minor(row['total'])
+                    totals['count'] += row['count']
+            return totals
+
+    async def get_debt(self, user_id: int, debt_id: int):
+        """Получение долга по ID (только своего)"""
+        async with self._read() as db:
+            async with db.execute(
+                'SELECT * FROM debts WHERE id = ? AND user_id = ?',
+                (debt_id, user_id)
+            ) as cursor:
                 row = await cursor.fetchone()
-                income = row[0] or 0
-                expense = row[1] or 0
-                return {'income': income, 'expense': expense, 'balance': income - expense}
+                return _money_row(row, 'amount') if row else None
+
+    async def mark_debt_paid(self, user_id: int, debt_id: int) -> bool:
+        """Отметить долг как оплаченный; напоминания о нем прекращаются"""
+        updated = await self._enqueue_write(
+            '''UPDATE debts SET is_paid = 1, paid_at = CURRENT_TIMESTAMP, remind_at = NULL
+               WHERE id = ? AND user_id = ? AND is_paid = 0''',
+            (debt_id, user_id),
+            rowcount=True
+        )
+        if updated:
+            self._touch(user_id)
+        return updated > 0
+
+    async def set_debt_due(self, user_id: int, debt_id: int, due_date: str = None,
+                           remind_at: datetime = None) -> bool:
+        """Срок непогашенного долга ('YYYY-MM-DD') и время первого напоминания; None снимает срок"""
+        async with self._write() as db:
+            cursor = await db.execute(
+                'UPDATE debts SET due_date = ?, remind_at = ? WHERE id = ? AND user_id = ? AND is_paid = 0',
+                (due_date, to_db_date(remind_at) if remind_at else None, debt_id, user_id)
+            )
+            updated = cursor.rowcount > 0
+        if updated:
+            self._touch(user_id)
+        return updated
+
+    async def advance_debt_reminder(self, debt_id: int, expected: str, next_remind: datetime):
+        """Перенос напоминания о долге на next_remind; долг или None.
+
+        Переносится, только если remind_at все еще равен expected и долг не
+        погашен: иначе напоминание устарело и отправлять его не нужно.
+        """
+        async with self._write() as db:
+            cursor = await db.execute(
+                'UPDATE debts SET remind_at = ? WHERE id = ? AND remind_at = ? AND is_paid = 0',
+                (to_db_date(next_remind), debt_id, expected)
+            )
+            if cursor.rowcount == 0:
+                return None
+            async with db.execute('SELECT * FROM debts WHERE id = ?', (debt_id,)) as cursor:
+                return _money_row(await cursor.fetchone(), 'amount')
+
+    async def add_recurring(self, user_id: int, trans_type: str, amount: Decimal, category: str,
+                            description: str, period: str, day: int, next_run: datetime) -> int:
+        """Добавление регулярной операции; возвращает ее ID"""
+        async with self._write() as db:
+            cursor = await db.execute(
+                '''INSERT INTO recurring (user_id, type, amount, category, description, period, day, next_run)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                (user_id, trans_type, to_minor(amount), category, description, period, day, to_db_date(next_run))
+            )
+            return cursor.lastrowid
+
+    async def get_recurring_rules(self, user_id: int):
+        """Регулярные операции пользователя по времени ближайшей записи"""
+        async with self._read() as db:
+            async with db.execute(
+                'SELECT * FROM recurring WHERE user_id = ? ORDER BY next_run, id',
+                (user_id,)
+            ) as cursor:
+                return [_money_row(row, 'amount') async for row in cursor]
+
+    async def get_recurring(self, rule_id: int):
+        async with self._read() as db:
+            async with db.execute('SELECT * FROM recurring WHERE id = ?', (rule_id,)) as cursor:
+                row = await cursor.fetchone()
+                return _money_row(row, 'amount') if row else None
+
+    async def delete_recurring(self, user_id: int, rule_id: int) -> bool:
+        async with self._write() as db:
+            cursor = await db.execute(
+                'DELETE FROM recurring WHERE id = ? AND user_id = ?',
+                (rule_id, user_id)
+            )
+            return cursor.rowcount > 0
+
+    async def record_recurring(self, rule_id: int, expected: str, occurrences: list, next_run: datetime):
+        """Запись операций регулярного правила за моменты occurrences и перенос next_run.
+
+        Все в одной транзакции и только если next_run правила все еще
+        равен expected: удаленное или уже обработанное правило повторно не
+        записывается. Возвращает правило или None.
+        """
+        async with self._write() as db:
+            cursor = await db.execute(
+                'UPDATE recurring SET next_run = ? WHERE id = ? AND next_run = ?',
+                (to_db_date(next_run), rule_id, expected)
+            )
+            if cursor.rowcount == 0:
+                return None
+            async with db.execute('SELECT * FROM recurring WHERE id = ?', (rule_id,)) as cursor:
+                rule = await cursor.fetchone()
+            await db.executemany(
+                '''INSERT INTO transactions (user_id, type, amount, category, description, date)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                [
+                    (rule['user_id'], rule['type'], rule['amount'], rule['category'],
+                     rule['description'], to_db_date(moment))
+                    for moment in occurrences
+                ]
+            )
+        self._touch(rule['user_id'])
+        return _money_row(rule, 'amount')
+
+    async def get_schedule_page(self, after: tuple = None, limit: int = 1000) -> list:
+        """Ближайшие срабатывания планировщика: [(время, вид, id)] по возрастанию.
+
+        Вид 'debt' — напоминание о долге (debts.remind_at), 'rule' —
+        регулярная операция (recurring.next_run). after — ключ (время, вид,
+        id), после которого продолжать. Из каждой таблицы по индексу
+        читается не больше limit строк, результат обрезается до limit.
+        """
+        sources = (('debt', 'debts', 'remind_at'), ('rule', 'recurring', 'next_run'))
+        rows = []
+        async with self._read() as db:
+            for kind, table, column in sources:
+                query = f'SELECT {column} AS at, id FROM {table} WHERE {column} IS NOT NULL'
+                params = []
+                if after is not None:
+                    at, after_kind, after_id = after
+                    # Ключи сравниваются как кортежи (время, вид, id)
+                    if kind > after_kind:
+                        query += f' AND {column} >= ?'
+                        params.append(at)
+                    elif kind == after_kind:
+                        query += f' AND ({column}, id) > (?, ?)'
+                        params.extend((at, after_id))
+                    else:
+                        query += f' AND {column} > ?'
+                        params.append(at)
+                query += f' ORDER BY {column}, id LIMIT ?'
+                params.append(limit)
+                async with db.execute(query, params) as cursor:
+                    rows.extend([(row['at'], kind, row['id']) async for row in cursor])
+        rows.sort()
+        return rows[:limit]
+
+    async def get_balance(self, user_id: int, start_date: str = None, end_date: str = None):
+        """Получение баланса (доходы - расходы)"""
+        async with self._read() as db:
+            if not start_date and not end_date:
+                # Баланс за все время берется из итогов, поддерживаемых триггерами
+                async with db.execute(
+                    'SELECT income, expense FROM user_totals WHERE user_id = ?',
+                    (user_id,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+                income = (row['income'] if row else 0) or 0
+                expense = (row['expense'] if row else 0) or 0
+                return _balance(income, expense)
+
+            query, params = _period_parts_query(user_id, start_date, end_date)
+            async with db.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+
+        income = sum(row['total'] for row in rows if row['type'] == 'income')
+        expense = sum(row['total'] for row in rows if row['type'] == 'expense')
+        return _balance(income, expense)
 
     async def get_category_stats(self, user_id: int, trans_type: str,
                                  start_date: str = None, end_date: str = None):
         """Получение статистики по категориям"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            query = '''
-                SELECT category, SUM(amount) as total, COUNT(*) as count
-                FROM transactions
-                WHERE user_id = ? AND type = ?
-            '''
+        async with self._read() as db:
+            query, params = _period_parts_query(user_id, start_date, end_date, trans_type)
+            query += ' ORDER BY total DESC'
+
+            async with db.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+                return [
+                    {'category': row['category'], 'total': from_minor(row['total']), 'count': row['count']}
+                    for row in rows
+                ]
+
+    async def get_daily_totals(self, user_id: int, trans_type: str,
+                               start_date: str = None, end_date: str = None):
+        """Суммы по дням из дневных агрегатов: [(день 'YYYY-MM-DD', сумма)].
+
+        Границы периода округляются до целых дней.
+        """
+        async with self._read() as db:
+            query = 'SELECT day, SUM(total) AS total FROM rollup_daily WHERE user_id = ? AND type = ?'
             params = [user_id, trans_type]
 
             if start_date:
-                query += ' AND date >= ?'
-                params.append(start_date)
+                query += ' AND day >= ?'
+                params.append(to_db_date(start_date)[:10])
 
             if end_date:
-                query += ' AND date <= ?'
-                params.append(end_date)
+                query += ' AND day <= ?'
+                params.append(to_db_date(end_date)[:10])
+
+            query += ' GROUP BY day ORDER BY day'
 
-            query += ' GROUP BY category ORDER BY total DESC'
+            async with db.execute(query, params) as cursor:
+                return [(row['day'], from_minor(row['total'])) async for row in cursor]
+
+    async def get_report(self, user_id: int, start_date: str = None, end_date: str = None):
+        """Баланс и статистика по категориям доходов и расходов одним запросом"""
+        async with self._read() as db:
+            query, params = _period_parts_query(user_id, start_date, end_date)
+            query += ' ORDER BY total DESC'
 
             async with db.execute(query, params) as cursor:
                 rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+
+        return _report_from_rows(rows)
+
+    async def set_digest_enabled(self, user_id: int, enabled: bool):
+        """Подписка пользователя на периодические сводки"""
+        await self._enqueue_write(
+            'UPDATE users SET digest_enabled = ? WHERE user_id = ?',
+            (int(enabled), user_id)
+        )
+
+    async def get_digest_enabled(self, user_id: int) -> bool:
+        async with self._read() as db:
+            async with db.execute('SELECT digest_enabled FROM users WHERE user_id = ?', (user_id,)) as cursor:
+                row = await cursor.fetchone()
+                return bool(row and row['digest_enabled'])
+
+    async def get_digest_page(self, run: str, start_day: str, end_day: str,
+                              after_user_id: int, limit: int):
+        """Отчеты за дни [start_day, end_day] для следующих limit подписанных пользователей.
+
+        Возвращает (последний user_id страницы или None, если пользователи
+        кончились; [(user_id, отчет как в get_report)]). Суммы всех
+        пользователей страницы считаются одним сгруппированным запросом по
+        первичному ключу rollup_daily (user_id, day). Пользователи без
+        операций за период и уже отмеченные в рассылке run пропускаются.
+        """
+        async with self._read() as db:
+            async with db.execute(
+                'SELECT user_id FROM users WHERE user_id > ? AND digest_enabled = 1 ORDER BY user_id LIMIT ?',
+                (after_user_id, limit)
+            ) as cursor:
+                user_ids = [row['user_id'] async for row in cursor]
+            if not user_ids:
+                return None, []
+
+            # CROSS JOIN фиксирует порядок: для каждого пользователя поиск по
+            # (user_id, day) читает только дни периода, а не всю историю
+            async with db.execute('''
+                SELECT r.user_id, r.type, r.category, SUM(r.total) AS total, SUM(r.count) AS count
+                FROM users u
+                CROSS JOIN rollup_daily r ON r.user_id = u.user_id AND r.day BETWEEN ? AND ?
+                WHERE u.user_id BETWEEN ? AND ? AND u.digest_enabled = 1
+                  AND NOT EXISTS (
+                      SELECT 1 FROM digest_deliveries d WHERE d.run = ? AND d.user_id = u.user_id
+                  )
+                GROUP BY r.user_id, r.type, r.category
+                ORDER BY r.user_id, total DESC
+            ''', (start_day, end_day, user_ids[0], user_ids[-1], run)) as cursor:
+                rows = await cursor.fetchall()
+
+        reports = [
+            (user_id, _report_from_rows(list(user_rows)))
+            for user_id, user_rows in groupby(rows, key=lambda row: row['user_id'])
+        ]
+        return user_ids[-1], reports
+
+    async def start_digest_run(self, run: str) -> dict:
+        """Рассылка run: новая или уже начатая (cursor — последний обработанный user_id)"""
+        async with self._write() as db:
+            await db.execute('INSERT OR IGNORE INTO digest_runs (run) VALUES (?)', (run,))
+            async with db.execute(
+                'SELECT run, cursor, started_at, finished_at FROM digest_runs WHERE run = ?', (run,)
+            ) as cursor:
+                return dict(await cursor.fetchone())
+
+    async def claim_digest(self, run: str, user_id: int):
+        """Отметка перед отправкой сводки: после перезапуска она не отправится повторно"""
+        await self._enqueue_write(
+            "INSERT INTO digest_deliveries (run, user_id, status) VALUES (?, ?, 'sending')",
+            (run, user_id)
+        )
+
+    async def set_digest_status(self, run: str, user_id: int, status: str):
+        await self._enqueue_write(
+            'UPDATE digest_deliveries SET status = ? WHERE run = ? AND user_id = ?',
+            (status, run, user_id)
+        )
+
+    async def advance_digest_run(self, run: str, cursor: int):
+        """Все пользователи до cursor включительно обработаны"""
+        await self._enqueue_write('UPDATE digest_runs SET cursor = ? WHERE run = ?', (cursor, run))
+
+    async def finish_digest_run(self, run: str) -> dict:
+        """Завершение рассылки; возвращает число отметок по статусам.
+
+        Отметки о доставке нужны только для продолжения рассылки и
+        удаляются вместе с завершением.
+        """
+        async with self._write() as db:
+            async with db.execute(
+                'SELECT status, COUNT(*) AS count FROM digest_deliveries WHERE run = ? GROUP BY status', (run,)
+            ) as cursor:
+                counts = {row['status']: row['count'] async for row in cursor}
+            await db.execute(
+                'UPDATE digest_runs SET finished_at = CURRENT_TIMESTAMP WHERE run = ?', (run,)
+            )
+            await db.execute('DELETE FROM digest_deliveries WHERE run = ?', (run,))
+        return counts
+
+    async def get_fsm_record(self, key: str):
+        """Получение сохраненного состояния FSM"""
+        async with self._read() as db:
+            async with db.execute(
+                'SELECT state, data, updated_at FROM fsm_storage WHERE key = ?',
+                (key,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+
+    async def save_fsm_record(self, key: str, state: str, data: str, updated_at: int):
+        """Сохранение состояния FSM"""
+        await self._enqueue_write(
+            'INSERT OR REPLACE INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)',
+            (key, state, data, updated_at)
+        )
+
+    async def delete_fsm_record(self, key: str):
+        """Удаление состояния FSM"""
+        await self._enqueue_write('DELETE FROM fsm_storage WHERE key = ?', (key,))
+
+    async def purge_fsm_records(self, older_than: int) -> int:
+        """Удаление состояний FSM, не обновлявшихся с момента older_than"""
+        async with self._write() as db:
+            cursor = await db.execute('DELETE FROM fsm_storage WHERE updated_at < ?', (older_than,))
+            return cursor.rowcount
+
+    async def verify_totals(self):
+        """Сверка user_totals с суммами по транзакциям; возвращает расхождения"""
+        async with self._read() as db:
+            async with db.execute('''
+                SELECT
+                    u.user_id,
+                    COALESCE(t.income, 0) AS stored_income,
+                    COALESCE(t.expense, 0) AS stored_expense,
+                    COALESCE(s.income, 0) AS actual_income,
+                    COALESCE(s.expense, 0) AS actual_expense
+                FROM (
+                    SELECT user_id FROM user_totals
+                    UNION
+                    SELECT DISTINCT user_id FROM transactions
+                ) u
+                LEFT JOIN user_totals t ON t.user_id = u.user_id
+                LEFT JOIN (
+                    SELECT
+                        user_id,
+                        SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) AS income,
+                        SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) AS expense
+                    FROM transactions
+                    GROUP BY user_id
+                ) s ON s.user_id = u.user_id
+            ''') as cursor:
+                rows = await cursor.fetchall()
+                return [
+                    dict(row) for row in rows
+                    if row['stored_income'] != row['actual_income']
+                    or row['stored_expense'] != row['actual_expense']
+                ]
+
+    async def rebuild_totals(self):
+        """Пересчет user_totals и агрегатов по периодам с нуля по таблице транзакций"""
+        async with self._write() as db:
+            await db.execute('DELETE FROM user_totals')
+            await db.execute('''
+                INSERT INTO user_totals (user_id, income, expense)
+                SELECT
+                    user_id,
+                    SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END),
+                    SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END)
+                FROM transactions
+                GROUP BY user_id
+            ''')
+            for table, column, length in ROLLUP_TABLES:
+                await db.execute(f'DELETE FROM {table}')
+                await db.execute(f'''
+                    INSERT INTO {table} (user_id, {column}, type, category, total, count)
+                    SELECT user_id, substr(date, 1, {length}), type, category, SUM(amount), COUNT(*)
+                    FROM transactions
+                    GROUP BY user_id, substr(date, 1, {length}), type, category
+                ''')
+        self._touch_all()
+
+    async def verify_rollups(self):
+        """Сверка дневных и месячных агрегатов с транзакциями; возвращает расхождения"""
+        mismatches = []
+        async with self._read() as db:
+            for table, column, length in ROLLUP_TABLES:
+                async with db.execute(f'''
+                    SELECT
+                        user_id, period, type, category,
+                        SUM(stored_total) AS stored_total,
+                        SUM(stored_count) AS stored_count,
+                        SUM(actual_total) AS actual_total,
+                        SUM(actual_count) AS actual_count
+                    FROM (
+                        SELECT user_id, {column} AS period, type, category,
+                               total AS stored_total, count AS stored_count,
+                               0 AS actual_total, 0 AS actual_count
+                        FROM {table}
+                        UNION ALL
+                        SELECT user_id, substr(date, 1, {length}), type, category,
+                               0, 0, amount, 1
+                        FROM transactions
+                    )
+                    GROUP BY user_id, period, type, category
+                    HAVING SUM(stored_count) != SUM(actual_count)
+                        OR SUM(stored_total) != SUM(actual_total)
+                ''') as cursor:
+                    rows = await cursor.fetchall()
+                    mismatches.extend(dict(row, table=table) for row in rows)
+        return mismatches
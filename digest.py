@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import time as clock
+from datetime import date, datetime, time, timedelta
+from typing import NamedTuple, Optional
+
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+
+from config import (
+    DIGEST_DAILY_TIME, DIGEST_WEEKLY_DAY, DIGEST_WEEKLY_TIME, DIGEST_CATCH_UP_MINUTES,
+    DIGEST_SEND_RATE, DIGEST_PAGE_SIZE
+)
+from database import Database
+from outbox import TokenBucket, wait_result
+from utils import generate_report_text, split_message
+
+logger = logging.getLogger(__name__)
+
+# Сколько сводок одновременно ждут отправки: при паузе flood control
+# рассылка останавливается, а не копит сообщения в очереди
+MAX_IN_FLIGHT = 50
+
+DIGEST_FOOTER = "\n🔕 Отключить сводки: /digest"
+
+
+class Schedule(NamedTuple):
+    """Расписание сводки: каждый день или раз в неделю в weekday"""
+    kind: str
+    # Сколько дней, включая день отправки, охватывает сводка
+    days: int
+    at: time
+    weekday: Optional[int] = None
+
+    def previous(self, now: datetime) -> datetime:
+        """Последнее время отправки не позже now"""
+        fire = datetime.combine(now.date(), self.at)
+        if self.weekday is None:
+            return fire if fire <= now else fire - timedelta(days=1)
+        fire -= timedelta(days=(fire.weekday() - self.weekday) % 7)
+        return fire if fire <= now else fire - timedelta(days=7)
+
+    def next(self, now: datetime) -> datetime:
+        """Ближайшее время отправки позже now"""
+        return self.previous(now) + timedelta(days=1 if self.weekday is None else 7)
+
+    def period(self, fire: datetime) -> tuple:
+        """Первый и последний день сводки ('YYYY-MM-DD')"""
+        end = fire.date()
+        return (end - timedelta(days=self.days - 1)).isoformat(), end.isoformat()
+
+    def run_id(self, fire: datetime) -> str:
+        return f'{self.kind}:{fire.date().isoformat()}'
+
+    def title(self, fire: datetime) -> str:
+        start, end = (date.fromisoformat(day) for day in self.period(fire))
+        if self.days == 1:
+            return f"Сводка за {end:%d.%m.%Y}"
+        return f"Сводка за {start:%d.%m} – {end:%d.%m.%Y}"
+
+
+def _parse_time(value: str) -> Optional[time]:
+    return time.fromisoformat(value.strip()) if value.strip() else None
+
+
+def load_schedules() -> list:
+    """Расписания из конфигурации; пустое время отключает сводку"""
+    schedules = []
+    daily = _parse_time(DIGEST_DAILY_TIME)
+    if daily is not None:
+        schedules.append(Schedule('daily', 1, daily))
+    weekly = _parse_time(DIGEST_WEEKLY_TIME)
+    if weekly is not None:
+        schedules.append(Schedule('weekly', 7, weekly, DIGEST_WEEKLY_DAY % 7))
+    return schedules
+
+
+class DigestScheduler:
+    """Рассылка сводок по расписанию.
+
+    Отчеты всех подписанных пользователей считаются страницами по
+    DIGEST_PAGE_SIZE, каждая страница — один сгруппированный запрос к
+    дневным агрегатам (Database.get_digest_page). Сообщения уходят через
+    очередь Outbox с ожиданием результата и не быстрее DIGEST_SEND_RATE,
+    чтобы рассылка не вытесняла ответы на действия пользователей.
+
+    Перед отправкой пользователь отмечается в digest_deliveries, после
+    нее отметка получает итоговый статус; после каждой страницы
+    сохраняется курсор. Прерванная рассылка продолжается с курсора и
+    пропускает отмеченных, поэтому никто не получит сводку дважды.
+    Рассылка, начатая позже назначенного времени больше чем на
+    DIGEST_CATCH_UP_MINUTES, пропускается.
+    """
+
+    def __init__(self, bot, db: Database, schedules: list = None, rate: float = DIGEST_SEND_RATE,
+                 page_size: int = DIGEST_PAGE_SIZE, catch_up_minutes: float = DIGEST_CATCH_UP_MINUTES):
+        self.bot = bot
+        self.db = db
+        self.schedules = load_schedules() if schedules is None else schedules
+        self.rate = rate
+        self.page_size = max(1, page_size)
+        self.catch_up = timedelta(minutes=catch_up_minutes)
+        self._task = None
+
+    def start(self):
+        if self._task is None and self.schedules:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        now = datetime.now()
+        # Рассылки, пропущенные или прерванные, пока бот не работал
+        fires = []
+        for schedule in self.schedules:
+            fire = schedule.previous(now)
+            fires.append([fire if now - fire <= self.catch_up else schedule.next(now), schedule])
+
+        while True:
+            entry = min(fires, key=lambda item: item[0])
+            fire, schedule = entry
+            delay = (fire - datetime.now()).total_seconds()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if datetime.now() - fire <= self.catch_up:
+                try:
+                    await self.broadcast(schedule, fire)
+                except Exception:
+                    logger.exception("Рассылка %s прервана", schedule.run_id(fire))
+            else:
+                logger.warning("Рассылка %s пропущена: опоздание больше %s", schedule.run_id(fire), self.catch_up)
+            entry[0] = schedule.next(fire)
+
+    async def broadcast(self, schedule: Schedule, fire: datetime) -> Optional[dict]:
+        """Рассылка сводки за период, заканчивающийся в день fire.
+
+        Возвращает число отметок по статусам ('sent', 'failed' и 'sending' —
+        отправка прервана перезапуском и не повторялась) или None, если
+        рассылка уже была завершена.
+        """
+        run = schedule.run_id(fire)
+        state = await self.db.start_digest_run(run)
+        if state['finished_at'] is not None:
+            return None
+
+        start_day, end_day = schedule.period(fire)
+        title = schedule.title(fire)
+        cursor = state['cursor']
+        if cursor:
+            logger.info("Рассылка %s продолжается после пользователя %s", run, cursor)
+
+        bucket = TokenBucket(self.rate, 1)
+        in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        tasks = []
+        try:
+            while True:
+                last_user_id, reports = await self.db.get_digest_page(
+                    run, start_day, end_day, cursor, self.page_size
+                )
+                if last_user_id is None:
+                    break
+
+                tasks = []
+                for user_id, report in reports:
+                    await in_flight.acquire()
+                    delay = bucket.delay(clock.monotonic())
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    bucket.take(clock.monotonic())
+                    text = generate_report_text(
+                        title, report['balance'], report['income_stats'], report['expense_stats']
+                    ) + DIGEST_FOOTER
+                    task = asyncio.create_task(self._deliver(run, user_id, text))
+                    task.add_done_callback(lambda _: in_flight.release())
+                    tasks.append(task)
+                await asyncio.gather(*tasks)
+                # Курсор двигается только после отметок всей страницы
+                await self.db.advance_digest_run(run, last_user_id)
+                cursor = last_user_id
+        finally:
+            # При отмене или ошибке отправки страницы не переживают рассылку:
+            # после close() они обратились бы к закрытой БД
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        counts = await self.db.finish_digest_run(run)
+        logger.info("Рассылка %s завершена: %s", run, counts)
+        return counts
+
+    async def _deliver(self, run: str, user_id: int, text: str):
+        # Отметка фиксируется до отправки: после сбоя в этом месте сводка
+        # скорее не дойдет, чем придет дважды
+        await self.db.claim_digest(run, user_id)
+        status = 'sent'
+        try:
+            with wait_result():
+                for chunk in split_message(text):
+                    await self.bot.send_message(user_id, chunk, parse_mode="HTML")
+        except TelegramForbiddenError:
+            # Пользователь заблокировал бота: больше не пытаемся
+            status = 'failed'
+            await self.db.set_digest_enabled(user_id, False)
+        except TelegramAPIError as e:
+            status = 'failed'
+            logger.warning("Сводка %s пользователю %s не отправлена: %s", run, user_id, e)
+        await self.db.set_digest_status(run, user_id, status)
@@ -0,0 +1,93 @@
+import asyncio
+import csv
+import io
+from tempfile import SpooledTemporaryFile
+
+from aiogram.types import InputFile
+
+from config import EXPORT_CHUNK_SIZE, EXPORT_SPOOL_MAX_BYTES
+from database import Database
+
+TRANSACTION_COLUMNS = ('id', 'date', 'type', 'category', 'amount', 'description')
+DEBT_COLUMNS = ('id', 'created_at', 'type', 'person_name', 'amount', 'description', 'is_paid', 'paid_at')
+
+
+class SpooledInputFile(InputFile):
+    """Отправка временного файла в Telegram по частям, без чтения целиком в память"""
+
+    def __init__(self, file, filename: str):
+        super().__init__(filename=filename)
+        self.file = file
+
+    async def read(self, bot):
+        self.file.seek(0)
+        while chunk := await asyncio.to_thread(self.file.read, self.chunk_size):
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+def _csv_chunk(rows: list, header: tuple = None) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def _write_csv_rows(spool, rows: list):
+    spool.write(_csv_chunk(rows))
+
+
+def _append_rows(sheet, rows: list):
+    for row in rows:
+        sheet.append(tuple(row))
+
+
+async def _write_csv(chunks, columns: tuple):
+    """CSV из потока пакетов строк во временный файл"""
+    spool = SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+    # BOM, чтобы Excel открывал кириллицу без выбора кодировки
+    spool.write(b'\xef\xbb\xbf' + _csv_chunk([], columns))
+    async for rows in chunks:
+        # Форматирование и запись на диск — в потоке, чтобы не держать цикл событий
+        await asyncio.to_thread(_write_csv_rows, spool, rows)
+    return spool
+
+
+async def export_csv(db: Database, user_id: int) -> list:
+    """Экспорт транзакций и долгов в два CSV-файла"""
+    transactions = await _write_csv(
+        db.iter_transactions(user_id, TRANSACTION_COLUMNS, EXPORT_CHUNK_SIZE),
+        TRANSACTION_COLUMNS
+    )
+    debts = await _write_csv(
+        db.iter_debts(user_id, DEBT_COLUMNS, EXPORT_CHUNK_SIZE),
+        DEBT_COLUMNS
+    )
+    return [
+        SpooledInputFile(transactions, 'transactions.csv'),
+        SpooledInputFile(debts, 'debts.csv'),
+    ]
+
+
+async def export_xlsx(db: Database, user_id: int) -> list:
+    """Экспорт транзакций и долгов в одну книгу XLSX (нужен openpyxl)"""
+    from openpyxl import Workbook
+
+    # В режиме write_only строки сразу сбрасываются во временные файлы
+    workbook = Workbook(write_only=True)
+    for title, chunks, columns in (
+        ('Транзакции', db.iter_transactions(user_id, TRANSACTION_COLUMNS, EXPORT_CHUNK_SIZE), TRANSACTION_COLUMNS),
+        ('Долги', db.iter_debts(user_id, DEBT_COLUMNS, EXPORT_CHUNK_SIZE), DEBT_COLUMNS),
+    ):
+        sheet = workbook.create_sheet(title)
+        sheet.append(columns)
+        async for rows in chunks:
+            await asyncio.to_thread(_append_rows, sheet, rows)
+
+    spool = SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+    await asyncio.to_thread(workbook.save, spool)
+    return [SpooledInputFile(spool, 'budget.xlsx')]
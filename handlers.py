@@ -1,11 +1,15 @@
+import asyncio
+
 from aiogram import Router, F
-from aiogram.filters import Command, StateFilter
-from aiogram.types import Message, CallbackQuery
+from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.types import BufferedInputFile, Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
-from datetime import datetime, timedelta
+from datetime import date, datetime
+from decimal import Decimal
 
+from charts import ChartRenderer
 from database import Database
-from states import TransactionStates, DebtStates, CategoryStates
+from states import TransactionStates, DebtStates, CategoryStates, HistoryStates
 from keyboards import (
     get_main_menu,
     get_category_keyboard,
@@ -14,15 +18,60 @@ from keyboards import (
     get_debt_menu_keyboard,
     get_debt_type_keyboard,
     get_settings_keyboard,
-    get_category_management_keyboard
+    get_category_management_keyboard,
+    get_debt_page_keyboard,
+    get_history_keyboard,
+    get_export_format_keyboard,
+    get_recurring_keyboard
+)
+from utils import (
+    CachedReport, format_currency, generate_report_text, parse_amount, report_cache, report_period, split_message
+)
+from config import (
+    DEBTS_PAGE_SIZE, HISTORY_PAGE_SIZE, EXPORT_MAX_CONCURRENT,
+    IMPORT_MAX_BYTES, IMPORT_PROGRESS_INTERVAL
+)
+from export import export_csv, export_xlsx
+from importer import ImportFormatError, import_statement, new_spool
+from outbox import wait_result
+from recurring import (
+    RUN_AT, RecurringScheduler, describe_schedule, first_debt_reminder, next_occurrence, parse_schedule
 )
-from utils import format_currency, generate_report_text
+from text_commands import TextCommands
+from quick_entry import QuickEntry, parse_quick_entry, get_category_index
+
+
+EVERY_HELP = """
+🔁 <b>Регулярная операция:</b> /every расписание сумма категория описание
+
+Расписание: число месяца (<code>5</code>), день недели (<code>пн</code> … <code>вс</code>) или <code>ежедневно</code>.
+Сумма, категория и описание — как в быстром вводе:
+<code>/every 5 -150000 коммунальные аренда</code>
+<code>/every 10 +500000 зарплата</code>
+<code>/every пн -2000 связь подписка</code>
+
+Список и удаление: /recurring
+"""
 
 
-def register_handlers(dp, db: Database):
-    """Регистрация всех обработчиков"""
+def register_handlers(dp, db: Database, charts: ChartRenderer = None, scheduler: RecurringScheduler = None):
+    """Регистрация всех обработчиков.
+
+    С charts к отчетам прикладываются графики, scheduler получает новые
+    регулярные операции и сроки долгов.
+    """
     router = Router()
 
+    # Кнопки с точным текстом разбираются по словарю (см. TextCommands).
+    # priority работают в любом состоянии FSM. Кнопки menu без состояния
+    # обрабатываются сразу, а в состоянии — на месте своего объявления
+    # (menu.register_section): обработчики состояний выше кнопки
+    # получают ее текст первыми, ниже — нет
+    priority = TextCommands()
+    menu = TextCommands()
+    priority.register(router.message)
+    menu.register(router.message, StateFilter(None))
+
     # Команды
     @router.message(Command("start"))
     async def cmd_start(message: Message):
@@ -45,6 +94,7 @@ def register_handlers(dp, db: Database):
 
 💰 <b>Баланс</b> - посмотреть текущий баланс
 📊 <b>Отчет</b> - получить детальный отчет за период
+📜 <b>История</b> - просмотр, изменение и удаление записей
 
 📝 <b>Долги</b> - управление долгами
 ⚙️ <b>Настройки</b> - настройки бота и категорий
@@ -53,11 +103,142 @@ def register_handlers(dp, db: Database):
 /start - начать работу
 /help - справка
 /cancel - отменить текущее действие
+/export - выгрузить данные в CSV или Excel
+/digest - включить или отключить сводки по расписанию
+/every - добавить регулярную операцию (зарплата, аренда, подписки)
+/recurring - список регулярных операций
+/due ID ДД.ММ.ГГГГ - срок долга с напоминаниями
+
+<b>Быстрый ввод:</b> отправьте сумму, категорию и описание одним сообщением:
+<code>-500 продукты кофе</code> — расход, <code>+200000 зарплата</code> — доход
         """
         await message.answer(help_text, parse_mode="HTML")
 
+    @router.message(Command("digest"))
+    async def cmd_digest(message: Message):
+        enabled = not await db.get_digest_enabled(message.from_user.id)
+        await db.set_digest_enabled(message.from_user.id, enabled)
+        if enabled:
+            await message.answer("🔔 Сводки по расписанию включены. Отключить: /digest")
+        else:
+            await message.answer("🔕 Сводки по расписанию отключены. Включить снова: /digest")
+
+    # Регулярные операции
+    @router.message(Command("every"))
+    async def cmd_every(message: Message, command: CommandObject):
+        parts = (command.args or '').split(maxsplit=1)
+        schedule = parse_schedule(parts[0]) if parts else None
+        entry = parse_quick_entry(parts[1]) if len(parts) > 1 else None
+        if schedule is None or entry is None:
+            await message.answer(EVERY_HELP, parse_mode="HTML")
+            return
+
+        user_id = message.from_user.id
+        categories = await db.get_categories(user_id, entry.trans_type)
+        category, rest = get_category_index(categories).match(entry.words)
+        if category is None:
+            names = ', '.join(item['name'] for item in categories)
+            await message.answer(f"❌ Категория не найдена. Доступные категории: {names}")
+            return
+
+        period, day = schedule
+        next_run = next_occurrence(period, day, datetime.now())
+        description = ' '.join(rest) or None
+        rule_id = await db.add_recurring(
+            user_id, entry.trans_type, entry.amount, category, description, period, day, next_run
+        )
+        if scheduler is not None:
+            scheduler.notify('rule', rule_id, next_run)
+
+        trans_type_text = "доход" if entry.trans_type == "income" else "расход"
+        await message.answer(
+            f"🔁 Регулярный {trans_type_text} добавлен: {format_currency(entry.amount)} — {category}\n"
+            f"{describe_schedule(period, day).capitalize()} в {RUN_AT:%H:%M}\n"
+            f"Ближайшая запись: {next_run:%d.%m.%Y}"
+        )
+
+    async def recurring_list(user_id: int) -> tuple:
+        """Текст и клавиатура списка регулярных операций"""
+        rules = await db.get_recurring_rules(user_id)
+        if not rules:
+            return "Регулярных операций нет. Добавить: /every", None
+        text = "🔁 <b>Регулярные операции:</b>\n\n"
+        for rule in rules:
+            sign = "📈 +" if rule['type'] == 'income' else "📉 −"
+            next_run = datetime.fromisoformat(rule['next_run'])
+            text += f"{sign}{format_currency(rule['amount'])} — {rule['category']}\n"
+            text += f"   {describe_schedule(rule['period'], rule['day'])}, следующая: {next_run:%d.%m.%Y}"
+            if rule['description']:
+                text += f" · {rule['description']}"
+            text += f"\n   ID: {rule['id']}\n\n"
+        return text, get_recurring_keyboard(rules)
+
+    async def send_recurring_list(message: Message, chunks: list, keyboard):
+        for chunk in chunks[:-1]:
+            await message.answer(chunk, parse_mode="HTML")
+        await message.answer(chunks[-1], parse_mode="HTML", reply_markup=keyboard)
+
+    @router.message(Command("recurring"))
+    async def cmd_recurring(message: Message):
+        text, keyboard = await recurring_list(message.from_user.id)
+        await send_recurring_list(message, split_message(text), keyboard)
+
+    @router.callback_query(F.data.startswith("recdel_"))
+    async def process_recurring_delete(callback: CallbackQuery):
+        rule_id = int(callback.data.split("_")[1])
+        deleted = await db.delete_recurring(callback.from_user.id, rule_id)
+        await callback.answer("Удалено" if deleted else "Операция не найдена")
+        if not deleted:
+            return
+        text, keyboard = await recurring_list(callback.from_user.id)
+        chunks = split_message(text)
+        if len(chunks) == 1:
+            await callback.message.edit_text(chunks[0], parse_mode="HTML", reply_markup=keyboard)
+        else:
+            # Длинный список не помещается в одно сообщение: отправляется
+            # заново целиком, кнопки — под последней частью
+            await callback.message.edit_reply_markup(reply_markup=None)
+            await send_recurring_list(callback.message, chunks, keyboard)
+
+    # Срок долга и напоминания
+    @router.message(Command("due"))
+    async def cmd_due(message: Message, command: CommandObject):
+        args = (command.args or '').split()
+        try:
+            debt_id = int(args[0])
+            due_date = datetime.strptime(args[1], '%d.%m.%Y').date() if len(args) > 1 else None
+        except (IndexError, ValueError):
+            await message.answer(
+                "Срок долга: /due ID ДД.ММ.ГГГГ, снять срок: /due ID\n"
+                "ID показан в списке долгов."
+            )
+            return
+
+        user_id = message.from_user.id
+        if due_date is None:
+            updated = await db.set_debt_due(user_id, debt_id)
+            text = "Срок долга снят, напоминаний не будет."
+        else:
+            remind_at = first_debt_reminder(due_date, datetime.now())
+            updated = await db.set_debt_due(user_id, debt_id, due_date.isoformat(), remind_at)
+            if updated and scheduler is not None:
+                scheduler.notify('debt', debt_id, remind_at)
+            text = (f"⏰ Срок долга: {due_date:%d.%m.%Y}. Напомню {remind_at:%d.%m.%Y в %H:%M} "
+                    f"и буду напоминать, пока долг не погашен.")
+        if not updated:
+            text = "❌ Непогашенный долг с таким ID не найден."
+        await message.answer(text)
+
+    @router.callback_query(F.data.startswith("debtpaid_"))
+    async def process_debt_paid(callback: CallbackQuery):
+        debt_id = int(callback.data.split("_")[1])
+        paid = await db.mark_debt_paid(callback.from_user.id, debt_id)
+        await callback.answer("Долг погашен" if paid else "Долг уже погашен")
+        if paid:
+            await callback.message.edit_text(f"{callback.message.text}\n\n✅ Погашен")
+
     @router.message(Command("cancel"))
-    @router.message(F.text == "❌ Отмена")
+    @priority("❌ Отмена")
     async def cmd_cancel(message: Message, state: FSMContext):
         await state.clear()
         await message.answer(
@@ -66,7 +247,7 @@ def register_handlers(dp, db: Database):
         )
 
     # Добавление дохода
-    @router.message(F.text == "➕ Добавить доход")
+    @priority("➕ Добавить доход")
     async def add_income_start(message: Message, state: FSMContext):
         await state.set_state(TransactionStates.waiting_for_amount)
         await state.update_data(trans_type="income")
@@ -76,7 +257,7 @@ def register_handlers(dp, db: Database):
         )
 
     # Добавление расхода
-    @router.message(F.text == "➖ Добавить расход")
+    @priority("➖ Добавить расход")
     async def add_expense_start(message: Message, state: FSMContext):
         await state.set_state(TransactionStates.waiting_for_amount)
         await state.update_data(trans_type="expense")
@@ -86,15 +267,16 @@ def register_handlers(dp, db: Database):
         )
 
     # Обработка суммы
-    @router.message(TransactionStates.waiting_for_amount)
+    @router.message(StateFilter(TransactionStates.waiting_for_amount))
     async def process_amount(message: Message, state: FSMContext):
         try:
-            amount = float(message.text.replace(',', '.'))
+            amount = parse_amount(message.text)
             if amount <= 0:
                 await message.answer("Сумма должна быть положительной. Попробуйте еще раз:")
                 return
 
-            await state.update_data(amount=amount)
+            # Decimal в JSON хранилища FSM не сериализуется — храним строкой
+            await state.update_data(amount=str(amount))
             data = await state.get_data()
             trans_type = data['trans_type']
 
@@ -111,7 +293,7 @@ def register_handlers(dp, db: Database):
             await message.answer("Неверный формат. Введите число (например: 1000 или 1500.50):")
 
     # Обработка добавления новой категории из выбора
-    @router.message(TransactionStates.waiting_for_category, F.text == "➕ Добавить категорию")
+    @router.message(StateFilter(TransactionStates.waiting_for_category), F.text == "➕ Добавить категорию")
     async def add_category_from_transaction(message: Message, state: FSMContext):
         data = await state.get_data()
         # Сохраняем текущее состояние транзакции
@@ -123,7 +305,7 @@ def register_handlers(dp, db: Database):
         )
 
     # Обработка категории
-    @router.message(TransactionStates.waiting_for_category)
+    @router.message(StateFilter(TransactionStates.waiting_for_category))
     async def process_category(message: Message, state: FSMContext):
         await state.update_data(category=message.text)
         await state.set_state(TransactionStates.waiting_for_description)
@@ -133,15 +315,16 @@ def register_handlers(dp, db: Database):
         )
 
     # Обработка описания
-    @router.message(TransactionStates.waiting_for_description)
+    @router.message(StateFilter(TransactionStates.waiting_for_description))
     async def process_description(message: Message, state: FSMContext):
         description = None if message.text == "⏭ Пропустить" else message.text
 
         data = await state.get_data()
+        amount = Decimal(data['amount'])
         await db.add_transaction(
             user_id=message.from_user.id,
             trans_type=data['trans_type'],
-            amount=data['amount'],
+            amount=amount,
             category=data['category'],
             description=description
         )
@@ -149,15 +332,48 @@ def register_handlers(dp, db: Database):
         trans_type_text = "доход" if data['trans_type'] == "income" else "расход"
         await message.answer(
             f"✅ {trans_type_text.capitalize()} успешно добавлен!\n\n"
-            f"Сумма: {format_currency(data['amount'])}\n"
+            f"Сумма: {format_currency(amount)}\n"
             f"Категория: {data['category']}\n"
             f"Описание: {description or 'не указано'}",
             reply_markup=get_main_menu()
         )
         await state.clear()
 
+    # Быстрый ввод одним сообщением: «-500 продукты кофе», «+200000 зарплата»
+    # Фильтр — сам разбор: нулевая сумма подходит под шаблон, но не под
+    # parse_quick_entry, и такое сообщение обработчик не получает
+    @router.message(StateFilter(None), F.text.func(parse_quick_entry).as_('entry'))
+    async def process_quick_entry(message: Message, state: FSMContext, entry: QuickEntry):
+        categories = await db.get_categories(message.from_user.id, entry.trans_type)
+        category, rest = get_category_index(categories).match(entry.words)
+
+        if category is None:
+            # Категория не распознана: продолжаем обычный пошаговый ввод
+            await state.set_state(TransactionStates.waiting_for_category)
+            await state.update_data(trans_type=entry.trans_type, amount=str(entry.amount))
+            text = "Выберите категорию дохода:" if entry.trans_type == "income" else "Выберите категорию расхода:"
+            await message.answer(text, reply_markup=get_category_keyboard(categories))
+            return
+
+        description = ' '.join(rest) or None
+        await db.add_transaction(
+            user_id=message.from_user.id,
+            trans_type=entry.trans_type,
+            amount=entry.amount,
+            category=category,
+            description=description
+        )
+
+        trans_type_text = "доход" if entry.trans_type == "income" else "расход"
+        await message.answer(
+            f"✅ {trans_type_text.capitalize()} {format_currency(entry.amount)} — {category}"
+            + (f"\nОписание: {description}" if description else "")
+        )
+
+    menu.register_section(router.message)
+
     # Баланс
-    @router.message(F.text == "💰 Баланс")
+    @menu("💰 Баланс")
     async def show_balance(message: Message):
         balance_data = await db.get_balance(message.from_user.id)
 
@@ -172,7 +388,7 @@ def register_handlers(dp, db: Database):
         await message.answer(text, parse_mode="HTML")
 
     # Отчет
-    @router.message(F.text == "📊 Отчет")
+    @menu("📊 Отчет")
     async def show_report_menu(message: Message):
         await message.answer(
             "Выберите период для отчета:",
@@ -184,53 +400,49 @@ def register_handlers(dp, db: Database):
         period = callback.data.split("_")[1]
         user_id = callback.from_user.id
 
-        # Определение дат
         end_date = datetime.now()
-        if period == "today":
-            start_date = end_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            period_text = "Сегодня"
-        elif period == "week":
-            start_date = end_date - timedelta(days=7)
-            period_text = "За неделю"
-        elif period == "month":
-            start_date = end_date - timedelta(days=30)
-            period_text = "За месяц"
-        else:
-            start_date = None
-            period_text = "За весь период"
-
-        # Получение данных
-        balance = await db.get_balance(
-            user_id,
-            start_date.isoformat() if start_date else None,
-            end_date.isoformat()
-        )
-        expense_stats = await db.get_category_stats(
-            user_id,
-            "expense",
-            start_date.isoformat() if start_date else None,
-            end_date.isoformat()
-        )
-        income_stats = await db.get_category_stats(
-            user_id,
-            "income",
-            start_date.isoformat() if start_date else None,
-            end_date.isoformat()
-        )
+        start_date, period_text = report_period(period, end_date)
+
+        # Отчет пересобирается, только если данные пользователя изменились
+        key = (user_id, period, end_date.date(), db.data_generation(user_id))
+        cached = report_cache.get(key)
+        if cached is None:
+            report = await db.get_report(
+                user_id,
+                start_date.isoformat() if start_date else None,
+                end_date.isoformat()
+            )
+            daily = ()
+            if charts is not None and report['expense_stats']:
+                daily = tuple(await db.get_daily_totals(
+                    user_id, 'expense', start_date.isoformat() if start_date else None, end_date.isoformat()
+                ))
+            cached = CachedReport(
+                generate_report_text(
+                    period_text, report['balance'], report['income_stats'], report['expense_stats']
+                ),
+                tuple((stat['category'], stat['total']) for stat in report['expense_stats']),
+                daily,
+            )
+            report_cache.set(key, cached)
 
-        report_text = generate_report_text(period_text, balance, income_stats, expense_stats)
-        await callback.message.answer(report_text, parse_mode="HTML")
+        await callback.message.answer(cached.text, parse_mode="HTML")
         await callback.answer()
 
+        if charts is not None and cached.expenses:
+            png = await charts.render(user_id, period, period_text, list(cached.expenses), list(cached.daily))
+            if png is not None:
+                await callback.message.answer_photo(BufferedInputFile(png, 'report.png'))
+
     # Долги
-    @router.message(F.text == "📝 Долги")
+    @menu("📝 Долги")
     async def show_debt_menu(message: Message):
         await message.answer(
             "Управление долгами:",
             reply_markup=get_debt_menu_keyboard()
         )
 
-    @router.message(F.text == "➕ Мне должны")
+    @menu("➕ Мне должны")
     async def add_lent_debt(message: Message, state: FSMContext):
         await state.set_state(DebtStates.waiting_for_person_name)
         await state.update_data(debt_type="lent")
@@ -239,7 +451,7 @@ def register_handlers(dp, db: Database):
             reply_markup=get_skip_keyboard()
         )
 
-    @router.message(F.text == "➖ Я должен")
+    @menu("➖ Я должен")
     async def add_owe_debt(message: Message, state: FSMContext):
         await state.set_state(DebtStates.waiting_for_person_name)
         await state.update_data(debt_type="owe")
@@ -248,21 +460,21 @@ def register_handlers(dp, db: Database):
             reply_markup=get_skip_keyboard()
         )
 
-    @router.message(DebtStates.waiting_for_person_name)
+    @router.message(StateFilter(DebtStates.waiting_for_person_name))
     async def process_debt_person(message: Message, state: FSMContext):
         await state.update_data(person_name=message.text)
         await state.set_state(DebtStates.waiting_for_amount)
         await message.answer("Введите сумму долга:")
 
-    @router.message(DebtStates.waiting_for_amount)
+    @router.message(StateFilter(DebtStates.waiting_for_amount))
     async def process_debt_amount(message: Message, state: FSMContext):
         try:
-            amount = float(message.text.replace(',', '.'))
+            amount = parse_amount(message.text)
             if amount <= 0:
                 await message.answer("Сумма должна быть положительной. Попробуйте еще раз:")
                 return
 
-            await state.update_data(amount=amount)
+            await state.update_data(amount=str(amount))
             await state.set_state(DebtStates.waiting_for_description)
             await message.answer(
                 "Введите описание (или нажмите 'Пропустить'):",
@@ -271,16 +483,17 @@ def register_handlers(dp, db: Database):
         except ValueError:
             await message.answer("Неверный формат. Введите число:")
 
-    @router.message(DebtStates.waiting_for_description)
+    @router.message(StateFilter(DebtStates.waiting_for_description))
     async def process_debt_description(message: Message, state: FSMContext):
         description = None if message.text == "⏭ Пропустить" else message.text
 
         data = await state.get_data()
+        amount = Decimal(data['amount'])
         await db.add_debt(
             user_id=message.from_user.id,
             debt_type=data['debt_type'],
             person_name=data['person_name'],
-            amount=data['amount'],
+            amount=amount,
             description=description
         )
 
@@ -288,73 +501,228 @@ def register_handlers(dp, db: Database):
         await message.answer(
             f"✅ Долг добавлен!\n\n"
             f"{data['person_name']} {debt_type_text}\n"
-            f"Сумма: {format_currency(data['amount'])}\n"
+            f"Сумма: {format_currency(amount)}\n"
             f"Описание: {description or 'не указано'}",
             reply_markup=get_debt_menu_keyboard()
         )
         await state.clear()
 
-    @router.message(F.text == "📋 Список долгов")
+    menu.register_section(router.message)
+
+    @menu("📋 Список долгов")
     async def show_debts_list(message: Message):
         await message.answer(
             "Выберите тип долгов:",
             reply_markup=get_debt_type_keyboard()
         )
 
-    @router.callback_query(F.data.startswith("debts_"))
-    async def process_debts_list(callback: CallbackQuery):
-        debt_type = callback.data.split("_")[1]
+    async def send_debts_page(callback: CallbackQuery, debt_type: str,
+                              cursor: tuple = None, backward: bool = False):
+        """Страница списка непогашенных долгов с кнопками навигации"""
         user_id = callback.from_user.id
+        type_filter = None if debt_type == "all" else debt_type
+
+        # Запрашиваем на одну запись больше, чтобы понять, есть ли еще страница
+        debts = await db.get_debts(
+            user_id, is_paid=False, debt_type=type_filter,
+            cursor=cursor, backward=backward, limit=DEBTS_PAGE_SIZE + 1
+        )
+        has_more = len(debts) > DEBTS_PAGE_SIZE
+        if has_more:
+            debts = debts[1:] if backward else debts[:-1]
+
+        if not debts:
+            await callback.message.answer("Долгов не найдено!")
+            await callback.answer()
+            return
 
         if debt_type == "all":
-            debts = await db.get_debts(user_id, is_paid=False)
             title = "📋 Все непогашенные долги:"
         elif debt_type == "lent":
-            debts = await db.get_debts(user_id, is_paid=False)
-            debts = [d for d in debts if d['type'] == 'lent']
             title = "📋 Вам должны:"
         else:
-            debts = await db.get_debts(user_id, is_paid=False)
-            debts = [d for d in debts if d['type'] == 'owe']
             title = "📋 Вы должны:"
 
-        if not debts:
-            await callback.message.answer("Долгов не найдено!")
-            await callback.answer()
-            return
-
         text = f"<b>{title}</b>\n\n"
-        total = 0
         for debt in debts:
             debt_symbol = "➕" if debt['type'] == 'lent' else "➖"
             text += f"{debt_symbol} <b>{debt['person_name']}</b>\n"
             text += f"   Сумма: {format_currency(debt['amount'])}\n"
             if debt['description']:
                 text += f"   Описание: {debt['description']}\n"
+            if debt['due_date']:
+                text += f"   Срок: {date.fromisoformat(debt['due_date']):%d.%m.%Y}\n"
             text += f"   ID: {debt['id']}\n\n"
-            total += debt['amount'] if debt['type'] == 'lent' else -debt['amount']
 
-        text += f"\n💰 Итого: {format_currency(abs(total))}"
+        totals = await db.get_debt_totals(user_id, type_filter)
+        text += f"\n💰 Итого: {format_currency(abs(totals['lent'] - totals['owe']))}"
+        if totals['count'] > len(debts):
+            text += f" (всего долгов: {totals['count']})"
+
+        first = (debts[0]['created_at'], debts[0]['id'])
+        last = (debts[-1]['created_at'], debts[-1]['id'])
+        # Вперед: на первой странице и при движении вперед — если есть еще записи,
+        # при движении назад следующая страница есть всегда
+        has_next = has_more if not backward else True
+        has_prev = cursor is not None and (has_more if backward else True)
+        keyboard = get_debt_page_keyboard(
+            debt_type,
+            prev_cursor=first if has_prev else None,
+            next_cursor=last if has_next else None
+        )
 
-        await callback.message.answer(text, parse_mode="HTML")
+        chunks = split_message(text)
+        if cursor is not None and len(chunks) == 1:
+            # Листание страниц редактирует то же сообщение
+            await callback.message.edit_text(chunks[0], parse_mode="HTML", reply_markup=keyboard)
+        else:
+            for chunk in chunks[:-1]:
+                await callback.message.answer(chunk, parse_mode="HTML")
+            await callback.message.answer(chunks[-1], parse_mode="HTML", reply_markup=keyboard)
         await callback.answer()
 
+    @router.callback_query(F.data.startswith("debts_"))
+    async def process_debts_list(callback: CallbackQuery):
+        debt_type = callback.data.split("_")[1]
+        await send_debts_page(callback, debt_type)
+
+    @router.callback_query(F.data.startswith("debtpage_"))
+    async def process_debts_page(callback: CallbackQuery):
+        _, debt_type, direction, created_at, debt_id = callback.data.split("_")
+        await send_debts_page(
+            callback, debt_type,
+            cursor=(created_at, int(debt_id)),
+            backward=direction == "prev"
+        )
+
+    # История операций
+    async def send_history_page(message: Message, user_id: int, trans_type: str = "all",
+                                cursor: tuple = None, backward: bool = False, edit: bool = False):
+        """Страница истории транзакций с фильтром по типу и навигацией"""
+        type_filter = None if trans_type == "all" else trans_type
+
+        # Запрашиваем на одну запись больше, чтобы понять, есть ли еще страница
+        transactions = await db.get_transactions(
+            user_id, trans_type=type_filter,
+            cursor=cursor, backward=backward, limit=HISTORY_PAGE_SIZE + 1
+        )
+        has_more = len(transactions) > HISTORY_PAGE_SIZE
+        if has_more:
+            transactions = transactions[1:] if backward else transactions[:-1]
+
+        text = "📜 <b>История операций:</b>\n\n"
+        if not transactions:
+            text += "Записей не найдено."
+        for trans in transactions:
+            sign = "📈 +" if trans['type'] == 'income' else "📉 −"
+            text += f"{sign}{format_currency(trans['amount'])} — {trans['category']}\n"
+            text += f"   {trans['date'][:16]}"
+            if trans['description']:
+                text += f" · {trans['description']}"
+            text += f"\n   ID: {trans['id']}\n\n"
+
+        prev_cursor = next_cursor = None
+        if transactions:
+            has_next = has_more if not backward else True
+            has_prev = cursor is not None and (has_more if backward else True)
+            if has_prev:
+                prev_cursor = (transactions[0]['date'], transactions[0]['id'])
+            if has_next:
+                next_cursor = (transactions[-1]['date'], transactions[-1]['id'])
+        keyboard = get_history_keyboard(trans_type, transactions, prev_cursor, next_cursor)
+
+        if edit:
+            await message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+        else:
+            await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+    @menu("📜 История")
+    async def show_history(message: Message):
+        await send_history_page(message, message.from_user.id)
+
+    @router.callback_query(F.data.startswith("hist_"))
+    async def process_history_filter(callback: CallbackQuery):
+        trans_type = callback.data.split("_")[1]
+        await send_history_page(callback.message, callback.from_user.id, trans_type, edit=True)
+        await callback.answer()
+
+    @router.callback_query(F.data.startswith("histpage_"))
+    async def process_history_page(callback: CallbackQuery):
+        _, trans_type, direction, date, trans_id = callback.data.split("_")
+        await send_history_page(
+            callback.message, callback.from_user.id, trans_type,
+            cursor=(date, int(trans_id)),
+            backward=direction == "prev",
+            edit=True
+        )
+        await callback.answer()
+
+    @router.callback_query(F.data.startswith("histdel_"))
+    async def process_history_delete(callback: CallbackQuery):
+        _, trans_type, trans_id = callback.data.split("_")
+        deleted = await db.delete_transaction(callback.from_user.id, int(trans_id))
+        await send_history_page(callback.message, callback.from_user.id, trans_type, edit=True)
+        await callback.answer("Запись удалена" if deleted else "Запись не найдена")
+
+    @router.callback_query(F.data.startswith("histedit_"))
+    async def process_history_edit(callback: CallbackQuery, state: FSMContext):
+        trans_id = int(callback.data.split("_")[1])
+        trans = await db.get_transaction(callback.from_user.id, trans_id)
+        if not trans:
+            await callback.answer("Запись не найдена")
+            return
+
+        await state.set_state(HistoryStates.waiting_for_new_amount)
+        await state.update_data(edit_trans_id=trans_id)
+        await callback.message.answer(
+            f"Запись {trans_id}: {format_currency(trans['amount'])} — {trans['category']}\n\n"
+            "Введите новую сумму:",
+            reply_markup=get_skip_keyboard()
+        )
+        await callback.answer()
+
+    @router.message(StateFilter(HistoryStates.waiting_for_new_amount))
+    async def process_history_new_amount(message: Message, state: FSMContext):
+        if message.text == "⏭ Пропустить":
+            await state.clear()
+            await message.answer("Действие отменено.", reply_markup=get_main_menu())
+            return
+
+        try:
+            amount = parse_amount(message.text)
+            if amount <= 0:
+                await message.answer("Сумма должна быть положительной. Попробуйте еще раз:")
+                return
+        except ValueError:
+            await message.answer("Неверный формат. Введите число (например: 1000 или 1500.50):")
+            return
+
+        data = await state.get_data()
+        updated = await db.update_transaction(message.from_user.id, data['edit_trans_id'], amount=amount)
+        await state.clear()
+        await message.answer(
+            f"✅ Сумма изменена: {format_currency(amount)}" if updated else "Запись не найдена.",
+            reply_markup=get_main_menu()
+        )
+
+    menu.register_section(router.message)
+
     # Настройки
-    @router.message(F.text == "⚙️ Настройки")
+    @menu("⚙️ Настройки")
     async def settings(message: Message):
         await message.answer(
             "⚙️ Настройки:",
             reply_markup=get_settings_keyboard()
         )
 
-    @router.message(F.text == "📂 Управление категориями")
+    @menu("📂 Управление категориями")
     async def category_management(message: Message):
         await message.answer(
             "Управление категориями:",
             reply_markup=get_category_management_keyboard()
         )
 
-    @router.message(F.text == "📈 Категории доходов")
+    @menu("📈 Категории доходов")
     async def show_income_categories(message: Message):
         categories = await db.get_categories(message.from_user.id, "income")
 
@@ -369,7 +737,7 @@ def register_handlers(dp, db: Database):
 
         await message.answer(text, parse_mode="HTML")
 
-    @router.message(F.text == "📉 Категории расходов")
+    @menu("📉 Категории расходов")
     async def show_expense_categories(message: Message):
         categories = await db.get_categories(message.from_user.id, "expense")
 
@@ -385,7 +753,7 @@ def register_handlers(dp, db: Database):
         await message.answer(text, parse_mode="HTML")
 
     # Обработка добавления новой категории
-    @router.message(CategoryStates.waiting_for_new_category_name)
+    @router.message(StateFilter(CategoryStates.waiting_for_new_category_name))
     async def process_new_category_name(message: Message, state: FSMContext):
         if message.text == "⏭ Пропустить":
             data = await state.get_data()
@@ -436,7 +804,88 @@ def register_handlers(dp, db: Database):
                 reply_markup=get_skip_keyboard()
             )
 
-    @router.message(F.text == "🏠 Главное меню")
+    # Экспорт данных (импорт выписок делит с ним тот же лимит одновременных задач)
+    export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+
+    menu.register_section(router.message)
+
+    @router.message(Command("export"))
+    @menu("📤 Экспорт данных")
+    async def show_export_menu(message: Message):
+        await message.answer(
+            "Выберите формат выгрузки:",
+            reply_markup=get_export_format_keyboard()
+        )
+
+    @router.callback_query(F.data.startswith("export_"))
+    async def process_export(callback: CallbackQuery):
+        export_format = callback.data.split("_")[1]
+        user_id = callback.from_user.id
+        await callback.answer()
+        await callback.message.answer("⏳ Готовлю выгрузку...")
+
+        async with export_slots:
+            try:
+                if export_format == "xlsx":
+                    files = await export_xlsx(db, user_id)
+                else:
+                    files = await export_csv(db, user_id)
+            except ImportError:
+                await callback.message.answer("Экспорт в Excel недоступен: не установлен openpyxl. Выберите CSV.")
+                return
+
+        try:
+            for file in files:
+                await callback.message.answer_document(file)
+        finally:
+            for file in files:
+                file.close()
+
+    # Импорт выписки
+    @router.message(StateFilter(None), F.document)
+    async def process_statement(message: Message):
+        document = message.document
+        if not (document.file_name or '').lower().endswith('.csv'):
+            await message.answer("Для импорта отправьте выписку в формате CSV.")
+            return
+        if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+            await message.answer("❌ Файл слишком большой для импорта.")
+            return
+
+        # Сообщение о ходе импорта потом редактируется: нужен его id
+        with wait_result():
+            status = await message.answer("⏳ Загружаю выписку...")
+        last_update = 0.0
+
+        async def report_progress(processed: int):
+            nonlocal last_update
+            now = asyncio.get_running_loop().time()
+            if now - last_update < IMPORT_PROGRESS_INTERVAL:
+                return
+            last_update = now
+            await status.edit_text(f"⏳ Обработано строк: {processed}")
+
+        async with export_slots:
+            with new_spool() as spool:
+                await message.bot.download(document, destination=spool)
+                spool.seek(0)
+                try:
+                    result = await import_statement(db, message.from_user.id, spool, report_progress)
+                except ImportFormatError as e:
+                    await status.edit_text(
+                        f"❌ Не удалось прочитать выписку: {e}.\n"
+                        "Нужны колонки «Дата» и «Сумма»; «Описание», «Категория» и «Тип» — по желанию."
+                    )
+                    return
+
+        text = f"✅ Импорт завершен\n\nДобавлено: {result['added']}"
+        if result['duplicates']:
+            text += f"\nУже были загружены: {result['duplicates']}"
+        if result['skipped']:
+            text += f"\nПропущено строк с ошибками: {result['skipped']}"
+        await status.edit_text(text)
+
+    @menu("🏠 Главное меню")
     async def back_to_main(message: Message, state: FSMContext):
         await state.clear()
         await message.answer("Главное меню:", reply_markup=get_main_menu())
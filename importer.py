@@ -0,0 +1,189 @@
+import asyncio
+import codecs
+import csv
+import hashlib
+import io
+import re
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+
+from config import IMPORT_CHUNK_SIZE, EXPORT_SPOOL_MAX_BYTES
+from database import Database, DB_DATE_FORMAT
+from utils import parse_amount
+
+# Допустимые названия колонок выписки (в нижнем регистре)
+COLUMN_ALIASES = {
+    'date': ('date', 'дата', 'дата операции', 'дата платежа'),
+    'amount': ('amount', 'сумма', 'сумма операции', 'сумма платежа'),
+    'description': ('description', 'описание', 'назначение', 'назначение платежа', 'комментарий'),
+    'category': ('category', 'категория'),
+    'type': ('type', 'тип'),
+}
+TYPE_ALIASES = {
+    'income': 'income', 'доход': 'income', 'пополнение': 'income',
+    'expense': 'expense', 'расход': 'expense', 'списание': 'expense',
+}
+# Даты вида 2024-05-31 и 31.05.2024, время необязательно
+# (strptime с перебором форматов на больших выписках заметно медленнее)
+DATE_PATTERNS = (
+    re.compile(r'(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})'
+               r'(?:[ T](?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?)?'),
+    re.compile(r'(?P<day>\d{1,2})\.(?P<month>\d{1,2})\.(?P<year>\d{4})'
+               r'(?: (?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?)?'),
+)
+FALLBACK_CATEGORY = 'Другое'
+
+
+class ImportFormatError(ValueError):
+    """Файл не похож на выписку: нет обязательных колонок"""
+
+
+def detect_encoding(sample: bytes) -> str:
+    """UTF-8 (с BOM или без), иначе cp1251 — в ней выгружают многие банки"""
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return 'cp1251'
+    return 'utf-8-sig'
+
+
+def _map_columns(header: list) -> dict:
+    names = [name.strip().lower() for name in header]
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for index, name in enumerate(names):
+            if name in aliases:
+                columns[field] = index
+                break
+    missing = {'date', 'amount'} - columns.keys()
+    if missing:
+        raise ImportFormatError(f"нет колонок: {', '.join(sorted(missing))}")
+    return columns
+
+
+def parse_date(value: str) -> str:
+    value = value.strip()
+    for pattern in DATE_PATTERNS:
+        match = pattern.fullmatch(value)
+        if match:
+            parts = {name: int(part) for name, part in match.groupdict(default='0').items()}
+            # Конструктор проверяет корректность даты (31.02 и т.п.)
+            return datetime(**parts).strftime(DB_DATE_FORMAT)
+    raise ValueError(f"неизвестный формат даты: {value}")
+
+
+class CategoryMatcher:
+    """Подбор категории пользователя по колонке выписки или описанию"""
+
+    def __init__(self, categories: dict):
+        # type -> {название в нижнем регистре: название}
+        self.names = {
+            trans_type: {category['name'].lower(): category['name'] for category in items}
+            for trans_type, items in categories.items()
+        }
+
+    def match(self, trans_type: str, category: str, description: str) -> str:
+        names = self.names.get(trans_type, {})
+        if category:
+            found = names.get(category.strip().lower())
+            if found:
+                return found
+        if description:
+            text = description.lower()
+            for lowered, name in names.items():
+                if lowered in text:
+                    return name
+        return FALLBACK_CATEGORY
+
+
+class StatementReader:
+    """Потоковый разбор CSV-выписки пакетами строк для import_transactions.
+
+    Одинаковые строки внутри файла различаются порядковым номером
+    повторения, поэтому настоящие повторные покупки сохраняются, а
+    повторная загрузка того же файла ничего не добавляет.
+    """
+
+    def __init__(self, file, matcher: CategoryMatcher):
+        sample = file.read(64 * 1024)
+        file.seek(0)
+        encoding = detect_encoding(sample)
+        self.text = io.TextIOWrapper(file, encoding=encoding, newline='')
+        # Разделитель определяется по первым целым строкам файла
+        head = sample[:sample.rfind(b'\n') + 1] or sample
+        try:
+            dialect = csv.Sniffer().sniff(head.decode(encoding, errors='ignore'), delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        self.reader = csv.reader(self.text, dialect)
+        self.columns = _map_columns(next(self.reader, []))
+        self.matcher = matcher
+        self.seen = {}
+        self.skipped = 0
+
+    def _field(self, row: list, name: str) -> str:
+        index = self.columns.get(name)
+        if index is None or index >= len(row):
+            return ''
+        return row[index].strip()
+
+    def _parse(self, row: list):
+        amount = parse_amount(self._field(row, 'amount'))
+        trans_type = TYPE_ALIASES.get(self._field(row, 'type').lower())
+        if trans_type is None:
+            # Без колонки типа знак суммы определяет расход
+            trans_type = 'expense' if amount < 0 else 'income'
+        amount = abs(amount)
+        if not amount:
+            raise ValueError("нулевая сумма")
+        date = parse_date(self._field(row, 'date'))
+        description = self._field(row, 'description') or None
+        category = self.matcher.match(trans_type, self._field(row, 'category'), description)
+
+        content = f"{date}|{trans_type}|{amount:.2f}|{description or ''}"
+        occurrence = self.seen.get(content, 0)
+        self.seen[content] = occurrence + 1
+        digest = hashlib.sha1(f"{content}|{occurrence}".encode('utf-8')).hexdigest()
+        return (trans_type, amount, category, description, date, digest)
+
+    def read_batch(self, size: int = IMPORT_CHUNK_SIZE) -> list:
+        """Следующие size разобранных строк; пустой список — конец файла"""
+        batch = []
+        for row in self.reader:
+            if not any(field.strip() for field in row):
+                continue
+            try:
+                batch.append(self._parse(row))
+            except ValueError:
+                self.skipped += 1
+                continue
+            if len(batch) >= size:
+                break
+        return batch
+
+
+async def import_statement(db: Database, user_id: int, file, progress=None) -> dict:
+    """Импорт CSV-выписки из бинарного файла.
+
+    progress — необязательная корутина progress(processed), вызывается
+    после каждого пакета. Возвращает {'added', 'duplicates', 'skipped'}.
+    """
+    matcher = CategoryMatcher({
+        trans_type: await db.get_categories(user_id, trans_type)
+        for trans_type in ('income', 'expense')
+    })
+    reader = await asyncio.to_thread(StatementReader, file, matcher)
+
+    processed = added = 0
+    while batch := await asyncio.to_thread(reader.read_batch):
+        added += await db.import_transactions(user_id, batch)
+        processed += len(batch)
+        if progress is not None:
+            await progress(processed)
+
+    return {'added': added, 'duplicates': processed - added, 'skipped': reader.skipped}
+
+
+def new_spool() -> SpooledTemporaryFile:
+    """Временный файл для скачиваемой выписки"""
+    return SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
@@ -1,51 +1,111 @@
+from typing import Tuple
+
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from pydantic import ConfigDict, field_serializer
 
+from cache import LRUCache
+from config import KEYBOARD_CACHE_SIZE
 
-def get_main_menu():
-    """Главное меню бота"""
-    keyboard = ReplyKeyboardMarkup(
+# Статические клавиатуры собираются один раз при импорте, а клавиатуры
+# категорий запоминаются по набору названий категорий. Один объект
+# отдается всем обработчикам, поэтому общие клавиатуры замораживаются
+# (_freeze): клавиатуры aiogram изменяемы, и правка одной из них
+# затронула бы всех пользователей
+category_keyboard_cache = LRUCache(KEYBOARD_CACHE_SIZE)
+
+
+class _FrozenKeyboardButton(KeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+
+class _FrozenInlineKeyboardButton(InlineKeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+
+class _FrozenReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+    keyboard: Tuple[Tuple[_FrozenKeyboardButton, ...], ...]
+
+    @field_serializer('keyboard')
+    def _dump_rows(self, rows):
+        # Bot API ждет списки: кортежи сессия aiogram не очищает от None
+        return [[button.model_dump() for button in row] for row in rows]
+
+
+class _FrozenInlineKeyboardMarkup(InlineKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+    inline_keyboard: Tuple[Tuple[_FrozenInlineKeyboardButton, ...], ...]
+
+    @field_serializer('inline_keyboard')
+    def _dump_rows(self, rows):
+        return [[button.model_dump() for button in row] for row in rows]
+
+
+def _freeze(markup):
+    """Неизменяемая копия клавиатуры: ряды — кортежи, кнопки — frozen-модели"""
+    if isinstance(markup, InlineKeyboardMarkup):
+        return _FrozenInlineKeyboardMarkup.model_validate(markup.model_dump(exclude_unset=True))
+    return _FrozenReplyKeyboardMarkup.model_validate(markup.model_dump(exclude_unset=True))
+
+
+# Главное меню бота
+_MAIN_MENU = _freeze(ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="➕ Добавить доход"), KeyboardButton(text="➖ Добавить расход")],
             [KeyboardButton(text="💰 Баланс"), KeyboardButton(text="📊 Отчет")],
-            [KeyboardButton(text="📝 Долги"), KeyboardButton(text="⚙️ Настройки")]
+            [KeyboardButton(text="📝 Долги"), KeyboardButton(text="⚙️ Настройки")],
+            [KeyboardButton(text="📜 История")]
         ],
         resize_keyboard=True
-    )
-    return keyboard
+    ))
+
+
+def get_main_menu():
+    """Главное меню бота"""
+    return _MAIN_MENU
 
 
 def get_category_keyboard(categories: list):
     """Клавиатура выбора категории"""
+    names = tuple(category['name'] for category in categories)
+    keyboard = category_keyboard_cache.get(names)
+    if keyboard is not None:
+        return keyboard
+
     # Создаем кнопки по 2 в ряд для удобства
     buttons = []
-    for i in range(0, len(categories), 2):
-        row = [KeyboardButton(text=categories[i]['name'])]
-        if i + 1 < len(categories):
-            row.append(KeyboardButton(text=categories[i + 1]['name']))
+    for i in range(0, len(names), 2):
+        row = [KeyboardButton(text=names[i])]
+        if i + 1 < len(names):
+            row.append(KeyboardButton(text=names[i + 1]))
         buttons.append(row)
 
     # Кнопки управления
     buttons.append([KeyboardButton(text="➕ Добавить категорию")])
     buttons.append([KeyboardButton(text="❌ Отмена")])
 
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+    keyboard = _freeze(ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True))
+    category_keyboard_cache.set(names, keyboard)
+    return keyboard
 
 
-def get_skip_keyboard():
-    """Клавиатура с кнопкой пропуска"""
-    keyboard = ReplyKeyboardMarkup(
+# Клавиатура с кнопкой пропуска
+_SKIP_KEYBOARD = _freeze(ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="⏭ Пропустить")],
             [KeyboardButton(text="❌ Отмена")]
         ],
         resize_keyboard=True
-    )
-    return keyboard
+    ))
 
 
-def get_report_period_keyboard():
-    """Клавиатура выбора периода отчета"""
-    keyboard = InlineKeyboardMarkup(
+def get_skip_keyboard():
+    """Клавиатура с кнопкой пропуска"""
+    return _SKIP_KEYBOARD
+
+
+# Клавиатура выбора периода отчета
+_REPORT_PERIOD_KEYBOARD = _freeze(InlineKeyboardMarkup(
         inline_keyboard=[
             [
                 InlineKeyboardButton(text="Сегодня", callback_data="report_today"),
@@ -56,26 +116,32 @@ def get_report_period_keyboard():
                 InlineKeyboardButton(text="Весь период", callback_data="report_all")
             ]
         ]
-    )
-    return keyboard
+    ))
 
 
-def get_debt_menu_keyboard():
-    """Меню управления долгами"""
-    keyboard = ReplyKeyboardMarkup(
+def get_report_period_keyboard():
+    """Клавиатура выбора периода отчета"""
+    return _REPORT_PERIOD_KEYBOARD
+
+
+# Меню управления долгами
+_DEBT_MENU_KEYBOARD = _freeze(ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="➕ Мне должны"), KeyboardButton(text="➖ Я должен")],
             [KeyboardButton(text="📋 Список долгов"), KeyboardButton(text="✅ Закрыть долг")],
             [KeyboardButton(text="🏠 Главное меню")]
         ],
         resize_keyboard=True
-    )
-    return keyboard
+    ))
 
 
-def get_debt_type_keyboard():
-    """Клавиатура типа долга для отображения"""
-    keyboard = InlineKeyboardMarkup(
+def get_debt_menu_keyboard():
+    """Меню управления долгами"""
+    return _DEBT_MENU_KEYBOARD
+
+
+# Клавиатура типа долга для отображения
+_DEBT_TYPE_KEYBOARD = _freeze(InlineKeyboardMarkup(
         inline_keyboard=[
             [
                 InlineKeyboardButton(text="Мне должны", callback_data="debts_lent"),
@@ -85,29 +151,126 @@ def get_debt_type_keyboard():
                 InlineKeyboardButton(text="Все долги", callback_data="debts_all")
             ]
         ]
-    )
-    return keyboard
+    ))
 
 
-def get_settings_keyboard():
-    """Клавиатура настроек"""
-    keyboard = ReplyKeyboardMarkup(
+def get_debt_type_keyboard():
+    """Клавиатура типа долга для отображения"""
+    return _DEBT_TYPE_KEYBOARD
+
+
+def get_debt_page_keyboard(debt_type: str, prev_cursor: tuple = None, next_cursor: tuple = None):
+    """Кнопки перехода между страницами списка долгов"""
+    buttons = []
+    if prev_cursor:
+        buttons.append(InlineKeyboardButton(
+            text="⬅️ Назад",
+            callback_data=f"debtpage_{debt_type}_prev_{prev_cursor[0]}_{prev_cursor[1]}"
+        ))
+    if next_cursor:
+        buttons.append(InlineKeyboardButton(
+            text="Вперед ➡️",
+            callback_data=f"debtpage_{debt_type}_next_{next_cursor[0]}_{next_cursor[1]}"
+        ))
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+
+def get_debt_reminder_keyboard(debt_id: int):
+    """Кнопка под напоминанием о долге"""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Погашен", callback_data=f"debtpaid_{debt_id}")
+    ]])
+
+
+def get_recurring_keyboard(rules: list):
+    """Кнопки удаления регулярных операций"""
+    if not rules:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"🗑 {rule['id']}", callback_data=f"recdel_{rule['id']}")]
+        for rule in rules
+    ])
+
+
+def get_history_keyboard(trans_type: str, transactions: list,
+                         prev_cursor: tuple = None, next_cursor: tuple = None):
+    """Фильтры, действия с записями и навигация по истории транзакций"""
+    filters = [("all", "Все"), ("income", "Доходы"), ("expense", "Расходы")]
+    rows = [[
+        InlineKeyboardButton(
+            text=f"• {title}" if value == trans_type else title,
+            callback_data=f"hist_{value}"
+        )
+        for value, title in filters
+    ]]
+
+    for trans in transactions:
+        rows.append([
+            InlineKeyboardButton(text=f"✏️ {trans['id']}", callback_data=f"histedit_{trans['id']}"),
+            InlineKeyboardButton(text=f"🗑 {trans['id']}", callback_data=f"histdel_{trans_type}_{trans['id']}")
+        ])
+
+    navigation = []
+    if prev_cursor:
+        navigation.append(InlineKeyboardButton(
+            text="⬅️ Новее",
+            callback_data=f"histpage_{trans_type}_prev_{prev_cursor[0]}_{prev_cursor[1]}"
+        ))
+    if next_cursor:
+        navigation.append(InlineKeyboardButton(
+            text="Старше ➡️",
+            callback_data=f"histpage_{trans_type}_next_{next_cursor[0]}_{next_cursor[1]}"
+        ))
+    if navigation:
+        rows.append(navigation)
+
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+# Клавиатура выбора формата экспорта
+_EXPORT_FORMAT_KEYBOARD = _freeze(InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="CSV", callback_data="export_csv"),
+                InlineKeyboardButton(text="Excel (XLSX)", callback_data="export_xlsx")
+            ]
+        ]
+    ))
+
+
+def get_export_format_keyboard():
+    """Клавиатура выбора формата экспорта"""
+    return _EXPORT_FORMAT_KEYBOARD
+
+
+# Клавиатура настроек
+_SETTINGS_KEYBOARD = _freeze(ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="📂 Управление категориями")],
+            [KeyboardButton(text="📤 Экспорт данных")],
             [KeyboardButton(text="🏠 Главное меню")]
         ],
         resize_keyboard=True
-    )
-    return keyboard
+    ))
 
 
-def get_category_management_keyboard():
-    """Клавиатура управления категориями"""
-    keyboard = ReplyKeyboardMarkup(
+def get_settings_keyboard():
+    """Клавиатура настроек"""
+    return _SETTINGS_KEYBOARD
+
+
+# Клавиатура управления категориями
+_CATEGORY_MANAGEMENT_KEYBOARD = _freeze(ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="📈 Категории доходов"), KeyboardButton(text="📉 Категории расходов")],
             [KeyboardButton(text="🏠 Главное меню")]
         ],
         resize_keyboard=True
-    )
-    return keyboard
+    ))
+
+
+def get_category_management_keyboard():
+    """Клавиатура управления категориями"""
+    return _CATEGORY_MANAGEMENT_KEYBOARD
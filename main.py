@@ -1,41 +1,93 @@
 import logging
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
-from aiogram.fsm.storage.memory import MemoryStorage
 import asyncio
 
+from charts import ChartRenderer
 from database import Database
+from digest import DigestScheduler
+from storage import SQLiteStorage
 from handlers import register_handlers
-from config import BOT_TOKEN
+from config import BOT_TOKEN, BOT_MODE, METRICS_HOST, METRICS_PORT, REPORT_CHARTS
+from metrics import setup_metrics, start_metrics_server
+from outbox import setup_outbox
+from recurring import RecurringScheduler
+from webhook import run_webhook
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-
-# Инициализация базы данных
-db = Database()
-
 
 async def main():
     """Главная функция запуска бота"""
+    # Объекты бота создаются здесь, а не при импорте: процессы графиков
+    # (spawn) заново импортируют этот модуль как __mp_main__
+
+    # Инициализация бота и диспетчера
+    bot = Bot(token=BOT_TOKEN)
+
+    # Инициализация базы данных
+    db = Database()
+
+    # Состояния FSM хранятся в БД и переживают перезапуск
+    storage = SQLiteStorage(db)
+    dp = Dispatcher(storage=storage)
+
+    # Исходящие сообщения идут через очередь с учетом лимитов Telegram
+    outbox = setup_outbox(bot, dp)
+
+    # Сводки по расписанию (DIGEST_DAILY_TIME, DIGEST_WEEKLY_TIME)
+    digests = DigestScheduler(bot, db)
+
+    # Регулярные операции и напоминания о долгах
+    scheduler = RecurringScheduler(bot, db)
+
+    # Графики отчетов рисуются в отдельных процессах
+    charts = ChartRenderer() if REPORT_CHARTS else None
+
+    # Открытие пула соединений с БД
+    await db.open()
+    metrics_runner = None
     try:
         # Создание таблиц в БД
         await db.create_tables()
+        await storage.open()
+
+        if charts is not None and not charts.available:
+            logger.warning("matplotlib не установлен: отчеты отправляются без графиков")
 
         # Регистрация обработчиков
-        register_handlers(dp, db)
+        register_handlers(dp, db, charts, scheduler)
+
+        # Метрики включаются только при заданном METRICS_PORT
+        if METRICS_PORT:
+            metrics = setup_metrics(dp, db, storage, charts, outbox)
+            metrics_runner = await start_metrics_server(metrics, METRICS_HOST, METRICS_PORT)
+
+        digests.start()
+        scheduler.start()
 
-        # Удаление вебхуков и запуск поллинга
-        await bot.delete_webhook(drop_pending_updates=True)
-        logger.info("Бот запущен и готов к работе!")
-        await dp.start_polling(bot)
+        if BOT_MODE == 'webhook':
+            logger.info("Бот запущен в режиме вебхука!")
+            await run_webhook(dp, bot)
+        else:
+            # Удаление вебхука и запуск поллинга; накопившиеся обновления
+            # обрабатываются, а не выбрасываются
+            await bot.delete_webhook(drop_pending_updates=False)
+            logger.info("Бот запущен и готов к работе!")
+            await dp.start_polling(bot)
     finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        if charts is not None:
+            charts.close()
+        await digests.close()
+        await scheduler.close()
+        await outbox.close()
         await bot.session.close()
+        await storage.close()
+        await db.close()
 
 
 if __name__ == '__main__':
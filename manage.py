@@ -0,0 +1,98 @@
+"""Служебные команды для обслуживания базы данных.
+
+Запуск:
+    python manage.py verify-totals
+    python manage.py rebuild-totals
+    python manage.py slow-queries [--log db_profile.log] [--top 10]
+"""
+import argparse
+import asyncio
+
+from config import DATABASE_PATH, DB_PROFILE_LOG
+from database import Database
+from profiler import read_log, summarize
+
+
+async def verify_totals(db: Database) -> bool:
+    """Сверка итогов пользователей с транзакциями"""
+    mismatches = await db.verify_totals()
+    for row in mismatches:
+        print(f"user {row['user_id']}: "
+              f"income {row['stored_income']} != {row['actual_income']}, "
+              f"expense {row['stored_expense']} != {row['actual_expense']}")
+
+    rollup_mismatches = await db.verify_rollups()
+    for row in rollup_mismatches:
+        print(f"{row['table']} user {row['user_id']} {row['period']} {row['type']}/{row['category']}: "
+              f"total {row['stored_total']} != {row['actual_total']}, "
+              f"count {row['stored_count']} != {row['actual_count']}")
+
+    print(f"Расхождений: {len(mismatches) + len(rollup_mismatches)}")
+    return not mismatches and not rollup_mismatches
+
+
+async def rebuild_totals(db: Database) -> bool:
+    """Пересчет итогов пользователей и агрегатов по периодам"""
+    await db.rebuild_totals()
+    print("Итоги пересчитаны")
+    return True
+
+
+def slow_queries(log_path: str, top: int) -> bool:
+    """Самые затратные запросы по суммарному времени из журнала профилирования"""
+    queries, waits = summarize(read_log(log_path))
+    if not queries and not waits:
+        print(f"Журнал {log_path} пуст: включите DB_PROFILE=1 и повторите нагрузку")
+        return True
+
+    ranked = sorted(queries.items(), key=lambda item: item[1]['total_ms'], reverse=True)[:top]
+    print(f"{'total ms':>10} {'count':>7} {'avg ms':>8} {'max ms':>8} {'avg rows':>8}  запрос")
+    for sql, stats in ranked:
+        print(f"{stats['total_ms']:10.1f} {stats['count']:7} {stats['total_ms'] / stats['count']:8.2f} "
+              f"{stats['max_ms']:8.2f} {stats['rows'] / stats['count']:8.1f}  {sql[:120]}")
+        for step in stats['plan'] or []:
+            print(f"{'':>46}{step}")
+
+    if waits:
+        print("\nОжидания дольше порога:")
+        for role, stats in sorted(waits.items(), key=lambda item: item[1]['total_ms'], reverse=True):
+            print(f"{stats['total_ms']:10.1f} {stats['count']:7} {stats['total_ms'] / stats['count']:8.2f} "
+                  f"{stats['max_ms']:8.2f}  {role}")
+    return True
+
+
+COMMANDS = {
+    'verify-totals': verify_totals,
+    'rebuild-totals': rebuild_totals,
+}
+
+
+async def run(command: str, db_path: str) -> bool:
+    db = Database(db_path, readers=1)
+    await db.open()
+    try:
+        await db.create_tables()
+        return await COMMANDS[command](db)
+    finally:
+        await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Обслуживание базы данных бота')
+    parser.add_argument('command', choices=sorted([*COMMANDS, 'slow-queries']))
+    parser.add_argument('--db', default=DATABASE_PATH, help='путь к файлу БД')
+    parser.add_argument('--log', default=DB_PROFILE_LOG, help='журнал профилирования (slow-queries)')
+    parser.add_argument('--top', type=int, default=10, help='сколько запросов показать (slow-queries)')
+    args = parser.parse_args()
+
+    if args.command == 'slow-queries':
+        # Команда читает только журнал, БД не открывается
+        ok = slow_queries(args.log, args.top)
+    else:
+        ok = asyncio.run(run(args.command, args.db))
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
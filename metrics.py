@@ -0,0 +1,220 @@
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject
+
+from charts import ChartRenderer
+from database import Database
+from keyboards import category_keyboard_cache
+from outbox import Outbox
+from quick_entry import category_index_cache
+from storage import SQLiteStorage
+from utils import report_cache
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+# Тип ответа текстового формата экспозиции Prometheus
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _header(name: str, help_text: str, metric_type: str) -> list:
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+
+
+class Histogram:
+    """Гистограмма с одной меткой в формате Prometheus.
+
+    observe() только увеличивает счетчик корзины; накопительные суммы
+    по корзинам считаются при выдаче метрик.
+    """
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        # значение метки -> [счетчики корзин..., +Inf, сумма, количество]
+        self._series = {}
+
+    def observe(self, label_value: str, value: float):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [0] * (len(self.buckets) + 3)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = _header(self.name, self.help_text, 'histogram')
+        for label_value, series in sorted(self._series.items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{label}}} {series[-1]}')
+        return lines
+
+
+class Counter:
+    """Счетчик с одной меткой"""
+
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+
+    def inc(self, label_value: str, amount: float = 1):
+        self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self) -> list:
+        lines = _header(self.name, self.help_text, 'counter')
+        for label_value, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{{{self.label}="{_escape(label_value)}"}} {value}')
+        return lines
+
+
+def sample_lines(name: str, help_text: str, metric_type: str, samples: Dict[str, float], label: str = None) -> list:
+    """Метрика, значения которой снимаются в момент сбора"""
+    lines = _header(name, help_text, metric_type)
+    for label_value, value in samples.items():
+        if label is None:
+            lines.append(f'{name} {value}')
+        else:
+            lines.append(f'{name}{{{label}="{_escape(label_value)}"}} {value}')
+    return lines
+
+
+class Metrics:
+    """Реестр метрик бота.
+
+    Время обработчиков и запросов к БД копится в гистограммах при каждом
+    вызове; размеры очередей, кэшей и состояния FSM снимаются только в
+    момент запроса /metrics функциями-сборщиками.
+    """
+
+    def __init__(self):
+        self.handler_seconds = Histogram(
+            'budget_bot_handler_seconds', 'Время выполнения обработчика, секунды', 'handler')
+        self.handler_errors = Counter(
+            'budget_bot_handler_errors_total', 'Исключения в обработчиках', 'handler')
+        self.query_seconds = Histogram(
+            'budget_bot_db_query_seconds', 'Время вызова метода Database, секунды', 'query')
+        self._collectors = []
+
+    def add_collector(self, collect: Callable[[], list]):
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.handler_seconds, self.handler_errors, self.query_seconds):
+            lines += metric.render()
+        for collect in self._collectors:
+            try:
+                lines += collect()
+            except Exception:
+                logger.exception("Ошибка сбора метрик")
+        return '\n'.join(lines) + '\n'
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Замер времени каждого обработчика по имени функции"""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        # Для кнопок из TextCommands настоящий обработчик лежит в text_handler
+        target = data.get('text_handler') or data.get('handler')
+        name = getattr(getattr(target, 'callback', None), '__name__', 'unknown')
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.metrics.handler_errors.inc(name)
+            raise
+        finally:
+            self.metrics.handler_seconds.observe(name, time.perf_counter() - started)
+
+
+def _cache_lines(caches: dict) -> list:
+    stats = {name: cache.stats() for name, cache in caches.items()}
+    lines = sample_lines('budget_bot_cache_hits_total', 'Попадания в кэш', 'counter',
+                         {name: s['hits'] for name, s in stats.items()}, 'cache')
+    lines += sample_lines('budget_bot_cache_misses_total', 'Промахи кэша', 'counter',
+                          {name: s['misses'] for name, s in stats.items()}, 'cache')
+    lines += sample_lines('budget_bot_cache_entries', 'Записей в кэше', 'gauge',
+                          {name: s['size'] for name, s in stats.items()}, 'cache')
+    lines += sample_lines('budget_bot_cache_bytes', 'Примерный объем кэша с ограничением по памяти, байты', 'gauge',
+                          {name: stats[name]['weight'] for name, cache in caches.items() if cache.weigh}, 'cache')
+    return lines
+
+
+def _outbox_lines(stats: dict) -> list:
+    lines = sample_lines('budget_bot_outbox_pending', 'Сообщения в очереди на отправку', 'gauge',
+                         {'': stats['pending']})
+    lines += sample_lines('budget_bot_outbox_sent_total', 'Отправленные запросы очереди', 'counter',
+                          {'': stats['sent']})
+    lines += sample_lines('budget_bot_outbox_coalesced_total', 'Сообщения, склеенные с предыдущими', 'counter',
+                          {'': stats['coalesced']})
+    lines += sample_lines('budget_bot_outbox_retries_total', 'Повторы после ответа 429', 'counter',
+                          {'': stats['retries']})
+    return lines
+
+
+def setup_metrics(dp: Dispatcher, db: Database, storage: SQLiteStorage,
+                  charts: ChartRenderer = None, outbox: Outbox = None) -> Metrics:
+    """Подключение замеров к диспетчеру, БД и хранилищу FSM"""
+    metrics = Metrics()
+    middleware = HandlerMetricsMiddleware(metrics)
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
+    db.instrument(metrics.query_seconds.observe)
+
+    caches = {
+        'categories': db.category_cache,
+        'category_keyboards': category_keyboard_cache,
+        'category_index': category_index_cache,
+        'reports': report_cache,
+    }
+    if charts is not None:
+        caches['report_charts'] = charts.cache
+    metrics.add_collector(lambda: _cache_lines(caches))
+    metrics.add_collector(lambda: sample_lines(
+        'budget_bot_db_pending_writes', 'Записи в очереди группового коммита', 'gauge',
+        {'': db.pending_writes()}))
+    metrics.add_collector(lambda: sample_lines(
+        'budget_bot_fsm_states', 'Диалоги в памяти хранилища FSM по состояниям', 'gauge',
+        storage.state_counts(), 'state'))
+    if outbox is not None:
+        metrics.add_collector(lambda: _outbox_lines(outbox.stats()))
+    return metrics
+
+
+async def start_metrics_server(metrics: Metrics, host: str, port: int) -> web.AppRunner:
+    """HTTP-сервер с метриками в текстовом формате Prometheus на /metrics"""
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=metrics.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,635 @@
+"""Версионированные миграции схемы БД.
+
+Текущая версия схемы хранится в PRAGMA user_version. Каждая миграция —
+список SQL-выражений; миграция с номером N переводит схему из версии N-1
+в версию N. Новые миграции добавляются только в конец списка.
+"""
+
+MIGRATIONS = [
+    # 1: базовые таблицы
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL CHECK(type IN ('income', 'expense')),
+            amount REAL NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS debts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL CHECK(type IN ('owe', 'lent')),
+            person_name TEXT NOT NULL,
+            amount REAL NOT NULL,
+            description TEXT,
+            is_paid BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            paid_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL CHECK(type IN ('income', 'expense')),
+            name TEXT NOT NULL,
+            is_default BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            UNIQUE(user_id, type, name)
+        )
+        ''',
+    ],
+    # 2: покрывающие индексы для отчетов и списка долгов
+    [
+        # get_category_stats и get_balance по типу за период
+        '''
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_type_date
+        ON transactions (user_id, type, date, category, amount)
+        ''',
+        # get_transactions и get_balance по всем типам, сортировка по дате
+        # (заменен в миграции 7)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_date
+        ON transactions (user_id, date, type, amount)
+        ''',
+        # get_debts с фильтром по статусу и сортировкой по дате
+        '''
+        CREATE INDEX IF NOT EXISTS idx_debts_user_paid_created
+        ON debts (user_id, is_paid, created_at)
+        ''',
+    ],
+    # 3: итоги по пользователю, поддерживаемые триггерами
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS user_totals (
+            user_id INTEGER PRIMARY KEY,
+            income REAL NOT NULL DEFAULT 0,
+            expense REAL NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_totals_insert
+        AFTER INSERT ON transactions
+        BEGIN
+            INSERT INTO user_totals (user_id, income, expense)
+            VALUES (
+                NEW.user_id,
+                CASE WHEN NEW.type = 'income' THEN NEW.amount ELSE 0 END,
+                CASE WHEN NEW.type = 'expense' THEN NEW.amount ELSE 0 END
+            )
+            ON CONFLICT(user_id) DO UPDATE SET
+                income = income + excluded.income,
+                expense = expense + excluded.expense;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_totals_delete
+        AFTER DELETE ON transactions
+        BEGIN
+            UPDATE user_totals SET
+                income = income - CASE WHEN OLD.type = 'income' THEN OLD.amount ELSE 0 END,
+                expense = expense - CASE WHEN OLD.type = 'expense' THEN OLD.amount ELSE 0 END
+            WHERE user_id = OLD.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_totals_update
+        AFTER UPDATE OF user_id, type, amount ON transactions
+        BEGIN
+            UPDATE user_totals SET
+                income = income - CASE WHEN OLD.type = 'income' THEN OLD.amount ELSE 0 END,
+                expense = expense - CASE WHEN OLD.type = 'expense' THEN OLD.amount ELSE 0 END
+            WHERE user_id = OLD.user_id;
+            INSERT INTO user_totals (user_id, income, expense)
+            VALUES (
+                NEW.user_id,
+                CASE WHEN NEW.type = 'income' THEN NEW.amount ELSE 0 END,
+                CASE WHEN NEW.type = 'expense' THEN NEW.amount ELSE 0 END
+            )
+            ON CONFLICT(user_id) DO UPDATE SET
+                income = income + excluded.income,
+                expense = expense + excluded.expense;
+        END
+        ''',
+        # Заполнение итогов по уже существующим транзакциям
+        '''
+        INSERT OR REPLACE INTO user_totals (user_id, income, expense)
+        SELECT
+            user_id,
+            SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END),
+            SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END)
+        FROM transactions
+        GROUP BY user_id
+        ''',
+    ],
+    # 4: дневные и месячные агрегаты по категориям для отчетов за период
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS rollup_daily (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total REAL NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, type, category)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS rollup_monthly (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total REAL NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month, type, category)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_insert
+        AFTER INSERT ON transactions
+        BEGIN
+            INSERT INTO rollup_daily (user_id, day, type, category, total, count)
+            VALUES (NEW.user_id, substr(NEW.date, 1, 10), NEW.type, NEW.category, NEW.amount, 1)
+            ON CONFLICT(user_id, day, type, category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+            INSERT INTO rollup_monthly (user_id, month, type, category, total, count)
+            VALUES (NEW.user_id, substr(NEW.date, 1, 7), NEW.type, NEW.category, NEW.amount, 1)
+            ON CONFLICT(user_id, month, type, category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_delete
+        AFTER DELETE ON transactions
+        BEGIN
+            UPDATE rollup_daily SET total = total - OLD.amount, count = count - 1
+            WHERE user_id = OLD.user_id AND day = substr(OLD.date, 1, 10)
+              AND type = OLD.type AND category = OLD.category;
+            DELETE FROM rollup_daily
+            WHERE user_id = OLD.user_id AND day = substr(OLD.date, 1, 10)
+              AND type = OLD.type AND category = OLD.category AND count <= 0;
+            UPDATE rollup_monthly SET total = total - OLD.amount, count = count - 1
+            WHERE user_id = OLD.user_id AND month = substr(OLD.date, 1, 7)
+              AND type = OLD.type AND category = OLD.category;
+            DELETE FROM rollup_monthly
+            WHERE user_id = OLD.user_id AND month = substr(OLD.date, 1, 7)
+              AND type = OLD.type AND category = OLD.category AND count <= 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_update
+        AFTER UPDATE OF user_id, type, amount, category, date ON transactions
+        BEGIN
+            UPDATE rollup_daily SET total = total - OLD.amount, count = count - 1
+            WHERE user_id = OLD.user_id AND day = substr(OLD.date, 1, 10)
+              AND type = OLD.type AND category = OLD.category;
+            DELETE FROM rollup_daily
+            WHERE user_id = OLD.user_id AND day = substr(OLD.date, 1, 10)
+              AND type = OLD.type AND category = OLD.category AND count <= 0;
+            UPDATE rollup_monthly SET total = total - OLD.amount, count = count - 1
+            WHERE user_id = OLD.user_id AND month = substr(OLD.date, 1, 7)
+              AND type = OLD.type AND category = OLD.category;
+            DELETE FROM rollup_monthly
+            WHERE user_id = OLD.user_id AND month = substr(OLD.date, 1, 7)
+              AND type = OLD.type AND category = OLD.category AND count <= 0;
+            INSERT INTO rollup_daily (user_id, day, type, category, total, count)
+            VALUES (NEW.user_id, substr(NEW.date, 1, 10), NEW.type, NEW.category, NEW.amount, 1)
+            ON CONFLICT(user_id, day, type, category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+            INSERT INTO rollup_monthly (user_id, month, type, category, total, count)
+            VALUES (NEW.user_id, substr(NEW.date, 1, 7), NEW.type, NEW.category, NEW.amount, 1)
+            ON CONFLICT(user_id, month, type, category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+        END
+        ''',
+        # Заполнение агрегатов по уже существующим транзакциям
+        '''
+        INSERT OR REPLACE INTO rollup_daily (user_id, day, type, category, total, count)
+        SELECT user_id, substr(date, 1, 10), type, category, SUM(amount), COUNT(*)
+        FROM transactions
+        GROUP BY user_id, substr(date, 1, 10), type, category
+        ''',
+        '''
+        INSERT OR REPLACE INTO rollup_monthly (user_id, month, type, category, total, count)
+        SELECT user_id, substr(date, 1, 7), type, category, SUM(amount), COUNT(*)
+        FROM transactions
+        GROUP BY user_id, substr(date, 1, 7), type, category
+        ''',
+    ],
+    # 5: хранилище состояний FSM
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated
+        ON fsm_storage (updated_at)
+        ''',
+    ],
+    # 6: постраничный список долгов с фильтром по типу
+    [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_debts_user_paid_type_created
+        ON debts (user_id, is_paid, type, created_at)
+        ''',
+    ],
+    # 7: постраничная история транзакций по ключу (date, id)
+    [
+        # Индекс (user_id, date, type, amount) не дает порядка (date, id);
+        # для краевых строк отчетов хватает и простого (user_id, date)
+        'DROP INDEX IF EXISTS idx_transactions_user_date',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_date_id
+        ON transactions (user_id, date)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_type_date_id
+        ON transactions (user_id, type, date)
+        ''',
+    ],
+    # 8: пакетный импорт выписок
+    [
+        # Хеш содержимого импортированной строки для защиты от повторного импорта
+        'ALTER TABLE transactions ADD COLUMN import_hash TEXT',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_user_import_hash
+        ON transactions (user_id, import_hash)
+        WHERE import_hash IS NOT NULL
+        ''',
+        # Пока в таблице есть строка, триггер вставки не обновляет итоги и
+        # агрегаты: пакетная запись пересчитывает их одним запросом сама
+        '''
+        CREATE TABLE IF NOT EXISTS bulk_write_guard (
+            id INTEGER PRIMARY KEY
+        )
+        ''',
+        'DROP TRIGGER IF EXISTS trg_transactions_totals_insert',
+        'DROP TRIGGER IF EXISTS trg_transactions_rollup_insert',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_derived_insert
+        AFTER INSERT ON transactions
+        WHEN NOT EXISTS (SELECT 1 FROM bulk_write_guard)
+        BEGIN
+            INSERT INTO user_totals (user_id, income, expense)
+            VALUES (
+                NEW.user_id,
+                CASE WHEN NEW.type = 'income' THEN NEW.amount ELSE 0 END,
+                CASE WHEN NEW.type = 'expense' THEN NEW.amount ELSE 0 END
+            )
+            ON CONFLICT(user_id) DO UPDATE SET
+                income = income + excluded.income,
+                expense = expense + excluded.expense;
+            INSERT INTO rollup_daily (user_id, day, type, category, total, count)
+            VALUES (NEW.user_id, substr(NEW.date, 1, 10), NEW.type, NEW.category, NEW.amount, 1)
+            ON CONFLICT(user_id, day, type, category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+            INSERT INTO rollup_monthly (user_id, month, type, category, total, count)
+            VALUES (NEW.user_id, substr(NEW.date, 1, 7), NEW.type, NEW.category, NEW.amount, 1)
+            ON CONFLICT(user_id, month, type, category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+        END
+        ''',
+    ],
+    # 9: суммы в целых тиынах (INTEGER) вместо REAL.
+    # Тип колонки в SQLite не меняется, поэтому таблицы пересоздаются;
+    # индексы и триггеры transactions удаляются вместе с таблицей и
+    # создаются заново, итоги и агрегаты пересчитываются по новым суммам
+    [
+        '''
+        CREATE TABLE transactions_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL CHECK(type IN ('income', 'expense')),
+            amount INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            import_hash TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        '''
+        INSERT INTO transactions_new (id, user_id, type, amount, category, description, date, import_hash)
+        SELECT id, user_id, type, CAST(ROUND(amount * 100) AS INTEGER), category, description, date, import_hash
+        FROM transactions
+        ''',
+        'DROP TABLE transactions',
+        'ALTER TABLE transactions_new RENAME TO transactions',
+        '''
+        CREATE INDEX idx_transactions_user_type_date
+        ON transactions (user_id, type, date, category, amount)
+        ''',
+        '''
+        CREATE INDEX idx_transactions_user_date_id
+        ON transactions (user_id, date)
+        ''',
+        '''
+        CREATE INDEX idx_transactions_user_type_date_id
+        ON transactions (user_id, type, date)
+        ''',
+        '''
+        CREATE UNIQUE INDEX idx_transactions_user_import_hash
+        ON transactions (user_id, import_hash)
+        WHERE import_hash IS NOT NULL
+        ''',
+        '''
+        CREATE TABLE debts_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL CHECK(type IN ('owe', 'lent')),
+            person_name TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            description TEXT,
+            is_paid BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            paid_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        '''
+        INSERT INTO debts_new (id, user_id, type, person_name, amount, description, is_paid, created_at, paid_at)
+        SELECT id, user_id, type, person_name, CAST(ROUND(amount * 100) AS INTEGER),
+               description, is_paid, created_at, paid_at
+        FROM debts
+        ''',
+        'DROP TABLE debts',
+        'ALTER TABLE debts_new RENAME TO debts',
+        '''
+        CREATE INDEX idx_debts_user_paid_created
+        ON debts (user_id, is_paid, created_at)
+        ''',
+        '''
+        CREATE INDEX idx_debts_user_paid_type_created
+        ON debts (user_id, is_paid, type, created_at)
+        ''',
+        'DROP TABLE user_totals',
+        '''
+        CREATE TABLE user_totals (
+            user_id INTEGER PRIMARY KEY,
+            income INTEGER NOT NULL DEFAULT 0,
+            expense INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        'DROP TABLE rollup_daily',
+        '''
+        CREATE TABLE rollup_daily (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, type, category)
+        ) WITHOUT ROWID
+        ''',
+        'DROP TABLE rollup_monthly',
+        '''
+        CREATE TABLE rollup_monthly (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month, type, category)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER trg_transactions_derived_insert
+        AFTER INSERT ON transactions
+        WHEN NOT EXISTS (SELECT 1 FROM bulk_write_guard)
+        BEGIN
+            INSERT INTO user_totals (user_id, income, expense)
+            VALUES (
+                NEW.user_id,
+                CASE WHEN NEW.type = 'income' THEN NEW.amount ELSE 0 END,
+                CASE WHEN NEW.type = 'expense' THEN NEW.amount ELSE 0 END
+            )
+            ON CONFLICT(user_id) DO UPDATE SET
+                income = income + excluded.income,
+                expense = expense + excluded.expense;
+            INSERT INTO rollup_daily (user_id, day, type, category, total, count)
+            VALUES (NEW.user_id, substr(NEW.date, 1, 10), NEW.type, NEW.category, NEW.amount, 1)
+            ON CONFLICT(user_id, day, type, category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+            INSERT INTO rollup_monthly (user_id, month, type, category, total, count)
+            VALUES (NEW.user_id, substr(NEW.date, 1, 7), NEW.type, NEW.category, NEW.amount, 1)
+            ON CONFLICT(user_id, month, type, category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_transactions_totals_delete
+        AFTER DELETE ON transactions
+        BEGIN
+            UPDATE user_totals SET
+                income = income - CASE WHEN OLD.type = 'income' THEN OLD.amount ELSE 0 END,
+                expense = expense - CASE WHEN OLD.type = 'expense' THEN OLD.amount ELSE 0 END
+            WHERE user_id = OLD.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_transactions_totals_update
+        AFTER UPDATE OF user_id, type, amount ON transactions
+        BEGIN
+            UPDATE user_totals SET
+                income = income - CASE WHEN OLD.type = 'income' THEN OLD.amount ELSE 0 END,
+                expense = expense - CASE WHEN OLD.type = 'expense' THEN OLD.amount ELSE 0 END
+            WHERE user_id = OLD.user_id;
+            INSERT INTO user_totals (user_id, income, expense)
+            VALUES (
+                NEW.user_id,
+                CASE WHEN NEW.type = 'income' THEN NEW.amount ELSE 0 END,
+                CASE WHEN NEW.type = 'expense' THEN NEW.amount ELSE 0 END
+            )
+            ON CONFLICT(user_id) DO UPDATE SET
+                income = income + excluded.income,
+                expense = expense + excluded.expense;
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_transactions_rollup_delete
+        AFTER DELETE ON transactions
+        BEGIN
+            UPDATE rollup_daily SET total = total - OLD.amount, count = count - 1
+            WHERE user_id = OLD.user_id AND day = substr(OLD.date, 1, 10)
+              AND type = OLD.type AND category = OLD.category;
+            DELETE FROM rollup_daily
+            WHERE user_id = OLD.user_id AND day = substr(OLD.date, 1, 10)
+              AND type = OLD.type AND category = OLD.category AND count <= 0;
+            UPDATE rollup_monthly SET total = total - OLD.amount, count = count - 1
+            WHERE user_id = OLD.user_id AND month = substr(OLD.date, 1, 7)
+              AND type = OLD.type AND category = OLD.category;
+            DELETE FROM rollup_monthly
+            WHERE user_id = OLD.user_id AND month = substr(OLD.date, 1, 7)
+              AND type = OLD.type AND category = OLD.category AND count <= 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_transactions_rollup_update
+        AFTER UPDATE OF user_id, type, amount, category, date ON transactions
+        BEGIN
+            UPDATE rollup_daily SET total = total - OLD.amount, count = count - 1
+            WHERE user_id = OLD.user_id AND day = substr(OLD.date, 1, 10)
+              AND type = OLD.type AND category = OLD.category;
+            DELETE FROM rollup_daily
+            WHERE user_id = OLD.user_id AND day = substr(OLD.date, 1, 10)
+              AND type = OLD.type AND category = OLD.category AND count <= 0;
+            UPDATE rollup_monthly SET total = total - OLD.amount, count = count - 1
+            WHERE user_id = OLD.user_id AND month = substr(OLD.date, 1, 7)
+              AND type = OLD.type AND category = OLD.category;
+            DELETE FROM rollup_monthly
+            WHERE user_id = OLD.user_id AND month = substr(OLD.date, 1, 7)
+              AND type = OLD.type AND category = OLD.category AND count <= 0;
+            INSERT INTO rollup_daily (user_id, day, type, category, total, count)
+            VALUES (NEW.user_id, substr(NEW.date, 1, 10), NEW.type, NEW.category, NEW.amount, 1)
+            ON CONFLICT(user_id, day, type, category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+            INSERT INTO rollup_monthly (user_id, month, type, category, total, count)
+            VALUES (NEW.user_id, substr(NEW.date, 1, 7), NEW.type, NEW.category, NEW.amount, 1)
+            ON CONFLICT(user_id, month, type, category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+        END
+        ''',
+        # Итоги и агрегаты по уже пересчитанным суммам
+        '''
+        INSERT INTO user_totals (user_id, income, expense)
+        SELECT
+            user_id,
+            SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END),
+            SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END)
+        FROM transactions
+        GROUP BY user_id
+        ''',
+        '''
+        INSERT INTO rollup_daily (user_id, day, type, category, total, count)
+        SELECT user_id, substr(date, 1, 10), type, category, SUM(amount), COUNT(*)
+        FROM transactions
+        GROUP BY user_id, substr(date, 1, 10), type, category
+        ''',
+        '''
+        INSERT INTO rollup_monthly (user_id, month, type, category, total, count)
+        SELECT user_id, substr(date, 1, 7), type, category, SUM(amount), COUNT(*)
+        FROM transactions
+        GROUP BY user_id, substr(date, 1, 7), type, category
+        ''',
+    ],
+    # 10: периодические сводки (см. digest.py): отписка пользователя,
+    # рассылки и отметки о доставке, по которым прерванная рассылка
+    # продолжается без повторной отправки
+    [
+        'ALTER TABLE users ADD COLUMN digest_enabled INTEGER NOT NULL DEFAULT 1',
+        '''
+        CREATE TABLE IF NOT EXISTS digest_runs (
+            run TEXT PRIMARY KEY,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS digest_deliveries (
+            run TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL CHECK(status IN ('sending', 'sent', 'failed')),
+            PRIMARY KEY (run, user_id)
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 11: регулярные операции и напоминания о сроке долга (см. recurring.py).
+    # Планировщик читает ближайшие срабатывания по индексам next_run и remind_at
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS recurring (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL CHECK(type IN ('income', 'expense')),
+            amount INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            period TEXT NOT NULL CHECK(period IN ('daily', 'weekly', 'monthly')),
+            day INTEGER,
+            next_run TIMESTAMP NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_recurring_next_run ON recurring (next_run)',
+        'CREATE INDEX IF NOT EXISTS idx_recurring_user ON recurring (user_id)',
+        'ALTER TABLE debts ADD COLUMN due_date TEXT',
+        'ALTER TABLE debts ADD COLUMN remind_at TIMESTAMP',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_debts_remind_at
+        ON debts (remind_at)
+        WHERE remind_at IS NOT NULL
+        ''',
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def get_schema_version(db) -> int:
+    """Текущая версия схемы"""
+    async with db.execute('PRAGMA user_version') as cursor:
+        row = await cursor.fetchone()
+        return row[0]
+
+
+async def apply_migrations(db) -> int:
+    """Применение недостающих миграций; возвращает итоговую версию схемы.
+
+    Каждая миграция выполняется в отдельной транзакции вместе с
+    обновлением user_version, поэтому прерванный запуск не оставляет
+    схему в промежуточном состоянии.
+    """
+    version = await get_schema_version(db)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f'Database schema version {version} is newer than supported {SCHEMA_VERSION}'
+        )
+
+    for number in range(version + 1, SCHEMA_VERSION + 1):
+        await db.execute('BEGIN')
+        try:
+            for statement in MIGRATIONS[number - 1]:
+                await db.execute(statement)
+            await db.execute(f'PRAGMA user_version = {number}')
+        except BaseException:
+            await db.rollback()
+            raise
+        await db.commit()
+
+    return SCHEMA_VERSION
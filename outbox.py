@@ -0,0 +1,364 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, SendDocument, SendMessage, SendPhoto
+from aiogram.types import TelegramObject
+
+from config import (
+    SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_GROUP_RATE_PER_MINUTE,
+    SEND_MAX_CONCURRENT, SEND_MAX_RETRIES
+)
+from utils import MESSAGE_LIMIT
+
+logger = logging.getLogger(__name__)
+
+# Методы, которые идут через очередь с ограничением скорости по чатам
+QUEUED_METHODS = (SendMessage, EditMessageText, SendPhoto, SendDocument)
+
+# Из них методы, результат которых обработчики не используют: внутри
+# обработчика они только ставятся в очередь. Отправка файлов всегда
+# ждет ответа — файл закрывается вызывающим кодом сразу после нее
+DETACHED_METHODS = (SendMessage, EditMessageText)
+
+# Через сколько секунд простоя состояние чата забывается
+CHAT_IDLE_TTL = 60
+
+# Отправки без ожидания результата (см. DetachSendsMiddleware)
+_detached = ContextVar('outbox_detached', default=False)
+
+
+@contextmanager
+def wait_result():
+    """Внутри блока отправки из обработчика ждут ответа Telegram.
+
+    Нужно, когда результат используется, например сообщение потом
+    редактируется.
+    """
+    token = _detached.set(False)
+    try:
+        yield
+    finally:
+        _detached.reset(token)
+
+
+@contextmanager
+def detach_sends():
+    """Внутри блока сообщения и правки только ставятся в очередь, как в обработчиках.
+
+    Для фоновых задач, которым результат отправки не нужен.
+    """
+    token = _detached.set(True)
+    try:
+        yield
+    finally:
+        _detached.reset(token)
+
+
+class TokenBucket:
+    """Не больше rate событий в секунду в среднем и burst подряд"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен очередной токен"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Pending:
+    __slots__ = ('make_request', 'bot', 'method', 'futures', 'detached', 'attempts')
+
+    def __init__(self, make_request, bot, method, future, detached: bool):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.futures = [future]
+        # Результат никто не ждет — сообщение можно склеить с соседним
+        self.detached = detached
+        self.attempts = 0
+
+
+class _Chat:
+    __slots__ = ('queue', 'bucket', 'paused_until', 'scheduled', 'busy', 'last_used')
+
+    def __init__(self, bucket: TokenBucket):
+        self.queue = deque()
+        self.bucket = bucket
+        self.paused_until = 0.0
+        self.scheduled = False
+        self.busy = False
+        self.last_used = time.monotonic()
+
+
+def _coalesce(first: _Pending, second: _Pending) -> bool:
+    """Объединение second в first, если Telegram покажет это как одно сообщение.
+
+    Подряд идущие правки одного сообщения сводятся к последней. Тексты
+    без клавиатуры у первого склеиваются, пока влезают в одно сообщение,
+    и только если ни один отправитель не ждет свое сообщение в ответ.
+    """
+    a, b = first.method, second.method
+    if type(a) is not type(b) or first.bot is not second.bot:
+        return False
+    if isinstance(a, EditMessageText):
+        if a.message_id is None or a.message_id != b.message_id:
+            return False
+        first.method = b
+    elif isinstance(a, SendMessage):
+        if not (first.detached and second.detached):
+            return False
+        if a.reply_markup is not None or len(a.text) + 2 + len(b.text) > MESSAGE_LIMIT:
+            return False
+        if a.model_dump(exclude={'text', 'reply_markup'}) != b.model_dump(exclude={'text', 'reply_markup'}):
+            return False
+        first.method = a.model_copy(update={'text': f'{a.text}\n\n{b.text}', 'reply_markup': b.reply_markup})
+    else:
+        return False
+    first.futures += second.futures
+    return True
+
+
+class Outbox(BaseRequestMiddleware):
+    """Очередь исходящих сообщений перед Bot API.
+
+    Подключается как middleware сессии бота: отправки и правки сообщений
+    проходят через очереди по чатам с корзинами токенов на чат и на бота
+    целиком, сообщения одного чата уходят строго по порядку, одновременно
+    выполняется не больше max_concurrent запросов. Ответ 429 приостанавливает
+    только свой чат на retry_after секунд, после чего запрос повторяется.
+    Несколько ожидающих сообщений одного чата по возможности отправляются
+    одним. Остальные методы Bot API проходят без очереди.
+    """
+
+    def __init__(self, global_rate: float = SEND_GLOBAL_RATE, chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: float = SEND_CHAT_BURST, group_rate_per_minute: float = SEND_GROUP_RATE_PER_MINUTE,
+                 max_concurrent: int = SEND_MAX_CONCURRENT, max_retries: int = SEND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_minute / 60
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._slots = asyncio.Semaphore(max(1, max_concurrent))
+        self._chats: Dict[Any, _Chat] = {}
+        self._heap = []
+        self._sequence = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._sending = set()
+        self._pruned = time.monotonic()
+        self.pending = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if not isinstance(method, QUEUED_METHODS) or chat_id is None:
+            return await make_request(bot, method)
+
+        future = asyncio.get_running_loop().create_future()
+        detached = _detached.get() and isinstance(method, DETACHED_METHODS)
+        self._enqueue(chat_id, _Pending(make_request, bot, method, future, detached))
+        if detached:
+            future.add_done_callback(self._log_failure)
+            return None
+        return await future
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Сообщение не отправлено: %s", future.exception())
+
+    def _chat(self, chat_id) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            # Отрицательные id — группы и каналы, для них лимит Telegram ниже
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.chat_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            chat = self._chats[chat_id] = _Chat(bucket)
+        return chat
+
+    def _enqueue(self, chat_id, item: _Pending):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        chat = self._chat(chat_id)
+        chat.queue.append(item)
+        self.pending += 1
+        self._schedule(chat_id, chat)
+
+    def _schedule(self, chat_id, chat: _Chat):
+        if chat.scheduled or chat.busy or not chat.queue:
+            return
+        now = time.monotonic()
+        ready = max(now + chat.bucket.delay(now), chat.paused_until)
+        self._sequence += 1
+        heapq.heappush(self._heap, (ready, self._sequence, chat_id))
+        chat.scheduled = True
+        self._wakeup.set()
+
+    async def _sleep(self, delay: float):
+        """Пауза, которую прерывает появление новых сообщений в очереди"""
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _next_chat(self):
+        """Ближайший чат, которому уже можно отправлять"""
+        while True:
+            if not self._heap:
+                self._prune()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            ready, _, chat_id = self._heap[0]
+            now = time.monotonic()
+            if ready > now:
+                await self._sleep(ready - now)
+                continue
+            delay = self.global_bucket.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            heapq.heappop(self._heap)
+            return chat_id
+
+    async def _run(self):
+        while True:
+            # Слот занимается до выбора чата: пока все заняты, очередь копится
+            # и у следующего чата будет больше сообщений для склейки
+            await self._slots.acquire()
+            try:
+                chat_id = await self._next_chat()
+            except BaseException:
+                self._slots.release()
+                raise
+            chat = self._chats[chat_id]
+            chat.scheduled = False
+            now = time.monotonic()
+            chat.bucket.take(now)
+            self.global_bucket.take(now)
+
+            item = chat.queue.popleft()
+            while chat.queue and _coalesce(item, chat.queue[0]):
+                chat.queue.popleft()
+                self.coalesced += 1
+            chat.busy = True
+            task = asyncio.create_task(self._send(chat_id, chat, item))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id, chat: _Chat, item: _Pending):
+        try:
+            result = await item.make_request(item.bot, item.method)
+        except TelegramRetryAfter as e:
+            item.attempts += 1
+            if item.attempts > self.max_retries:
+                self._finish(item, exception=e)
+            else:
+                self.retries += 1
+                logger.warning("Flood control в чате %s, повтор через %s с", chat_id, e.retry_after)
+                chat.paused_until = time.monotonic() + e.retry_after
+                chat.queue.appendleft(item)
+        except Exception as e:
+            self._finish(item, exception=e)
+        else:
+            self._finish(item, result=result)
+        finally:
+            self._slots.release()
+            chat.busy = False
+            chat.last_used = time.monotonic()
+            self._schedule(chat_id, chat)
+
+    def _finish(self, item: _Pending, result=None, exception: BaseException = None):
+        self.pending -= len(item.futures)
+        if exception is None:
+            self.sent += 1
+        for future in item.futures:
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    def _prune(self):
+        """Забыть чаты без сообщений, простаивающие дольше CHAT_IDLE_TTL"""
+        now = time.monotonic()
+        if now - self._pruned < CHAT_IDLE_TTL:
+            return
+        self._pruned = now
+        idle = [chat_id for chat_id, chat in self._chats.items()
+                if not chat.queue and not chat.busy and now - chat.last_used > CHAT_IDLE_TTL]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    async def close(self, timeout: float = 10):
+        """Дождаться отправки очереди (не дольше timeout) и остановить ее"""
+        deadline = time.monotonic() + timeout
+        while (self.pending or self._sending) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._sending):
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            'pending': self.pending,
+            'chats': len(self._chats),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'retries': self.retries,
+        }
+
+
+class DetachSendsMiddleware(BaseMiddleware):
+    """Отправки сообщений из обработчиков только ставятся в очередь Outbox.
+
+    Обработчик не ждет, пока сообщение уйдет в Telegram, и не держит
+    слот обработки обновления во время паузы flood control.
+    """
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        with detach_sends():
+            return await handler(event, data)
+
+
+def setup_outbox(bot, dp) -> Outbox:
+    """Очередь исходящих сообщений для бота и диспетчера"""
+    outbox = Outbox()
+    bot.session.middleware(outbox)
+    dp.update.outer_middleware(DetachSendsMiddleware())
+    return outbox
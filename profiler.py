@@ -0,0 +1,226 @@
+import glob
+import json
+import logging
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+from time import perf_counter
+
+from config import (
+    DB_PROFILE_LOG, DB_PROFILE_SLOW_MS, DB_PROFILE_LOG_MAX_BYTES, DB_PROFILE_LOG_BACKUPS
+)
+
+# Запросы, для которых имеет смысл EXPLAIN QUERY PLAN
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def normalize_sql(sql: str) -> str:
+    return ' '.join(sql.split())
+
+
+class QueryProfiler:
+    """Профилирование запросов к БД.
+
+    Для каждого запроса в журнал пишется JSON-строка со временем
+    выполнения и числом строк; для запросов дольше порога к ней
+    добавляется план из EXPLAIN QUERY PLAN. Отдельно записываются
+    ожидания свободного соединения и блокировки записи дольше порога.
+    Файл журнала пишется в отдельном потоке и ротируется по размеру.
+    """
+
+    def __init__(self, log_path: str = DB_PROFILE_LOG, slow_ms: float = DB_PROFILE_SLOW_MS,
+                 max_bytes: int = DB_PROFILE_LOG_MAX_BYTES, backups: int = DB_PROFILE_LOG_BACKUPS):
+        self.log_path = log_path
+        self.slow = slow_ms / 1000
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.logger = logging.getLogger(f'{__name__}.{id(self)}')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self._listener = None
+        self._queue_handler = None
+
+    def start(self):
+        if self._listener is not None:
+            return
+        file_handler = RotatingFileHandler(
+            self.log_path, maxBytes=self.max_bytes, backupCount=self.backups, encoding='utf-8'
+        )
+        file_handler.setFormatter(logging.Formatter('%(message)s'))
+        queue = SimpleQueue()
+        self._queue_handler = QueueHandler(queue)
+        self.logger.addHandler(self._queue_handler)
+        self._listener = QueueListener(queue, file_handler)
+        self._listener.start()
+
+    def stop(self):
+        if self._listener is None:
+            return
+        self._listener.stop()
+        self.logger.removeHandler(self._queue_handler)
+        for handler in self._listener.handlers:
+            handler.close()
+        self._listener = None
+        self._queue_handler = None
+
+    def wrap(self, conn, role: str) -> 'ProfiledConnection':
+        return ProfiledConnection(conn, self, role)
+
+    def _write(self, entry: dict):
+        entry['ts'] = round(time.time(), 3)
+        self.logger.info(json.dumps(entry, ensure_ascii=False))
+
+    async def _explain(self, conn, sql: str, params) -> list:
+        try:
+            async with conn.execute('EXPLAIN QUERY PLAN ' + sql, params or ()) as cursor:
+                return [row[3] for row in await cursor.fetchall()]
+        except Exception as e:
+            return [f'explain failed: {e}']
+
+    async def record(self, conn, role: str, sql: str, params, elapsed: float, rows):
+        sql = normalize_sql(sql)
+        entry = {'event': 'query', 'role': role, 'sql': sql, 'ms': round(elapsed * 1000, 3), 'rows': rows}
+        if elapsed >= self.slow and params is not None and sql.split(None, 1)[0].upper() in EXPLAINABLE:
+            entry['plan'] = await self._explain(conn, sql, params)
+        self._write(entry)
+
+    def record_wait(self, role: str, elapsed: float):
+        """Ожидание соединения из пула или блокировки записи"""
+        if elapsed >= self.slow:
+            self._write({'event': 'wait', 'role': role, 'ms': round(elapsed * 1000, 3)})
+
+
+class _CountingCursor:
+    """Курсор, считающий прочитанные строки"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.rows = 0
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    async def fetchone(self):
+        row = await self._cursor.fetchone()
+        if row is not None:
+            self.rows += 1
+        return row
+
+    async def fetchmany(self, size=None):
+        rows = await (self._cursor.fetchmany() if size is None else self._cursor.fetchmany(size))
+        self.rows += len(rows)
+        return rows
+
+    async def fetchall(self):
+        rows = await self._cursor.fetchall()
+        self.rows += len(rows)
+        return rows
+
+    async def __aiter__(self):
+        async for row in self._cursor:
+            self.rows += 1
+            yield row
+
+
+class _ProfiledQuery:
+    """Результат execute(): как и в aiosqlite, его можно ждать или открыть через async with"""
+
+    def __init__(self, owner: 'ProfiledConnection', sql: str, params):
+        self.owner = owner
+        self.sql = sql
+        self.params = params
+        self.started = None
+        self.cursor = None
+
+    async def _execute(self):
+        self.started = perf_counter()
+        return await self.owner._conn.execute(self.sql, self.params)
+
+    async def _run(self):
+        cursor = await self._execute()
+        # Без async with строки читаются позже: для изменений берем rowcount
+        rows = cursor.rowcount if cursor.rowcount >= 0 else None
+        await self.owner._record(self.sql, self.params, perf_counter() - self.started, rows)
+        return cursor
+
+    def __await__(self):
+        return self._run().__await__()
+
+    async def __aenter__(self):
+        self.cursor = _CountingCursor(await self._execute())
+        return self.cursor
+
+    async def __aexit__(self, *exc_info):
+        await self.cursor._cursor.close()
+        await self.owner._record(self.sql, self.params, perf_counter() - self.started, self.cursor.rows)
+
+
+class ProfiledConnection:
+    """Обертка соединения aiosqlite, замеряющая execute и executemany"""
+
+    def __init__(self, conn, profiler: QueryProfiler, role: str):
+        self._conn = conn
+        self.profiler = profiler
+        self.role = role
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def _record(self, sql: str, params, elapsed: float, rows):
+        await self.profiler.record(self._conn, self.role, sql, params, elapsed, rows)
+
+    def execute(self, sql: str, parameters=None) -> _ProfiledQuery:
+        return _ProfiledQuery(self, sql, parameters if parameters is not None else ())
+
+    async def executemany(self, sql: str, parameters):
+        parameters = list(parameters)
+        started = perf_counter()
+        cursor = await self._conn.executemany(sql, parameters)
+        # План для пакета не снимается: параметров много
+        await self._record(sql, None, perf_counter() - started, len(parameters))
+        return cursor
+
+
+def read_log(log_path: str = DB_PROFILE_LOG):
+    """Записи журнала профилирования, включая ротированные файлы"""
+    # RotatingFileHandler: .1 — самый новый архив; номера сравниваются
+    # как числа, иначе .10 оказался бы между .1 и .2
+    rotated = {}
+    for path in glob.glob(glob.escape(log_path) + '.*'):
+        suffix = path[len(log_path) + 1:]
+        if suffix.isdigit():
+            rotated[int(suffix)] = path
+    paths = [rotated[number] for number in sorted(rotated, reverse=True)] + [log_path]
+    for path in paths:
+        try:
+            with open(path, encoding='utf-8') as log:
+                for line in log:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            continue
+
+
+def summarize(entries) -> tuple:
+    """Сводка по запросам и ожиданиям: ({sql: статистика}, {role: статистика})"""
+    queries = {}
+    waits = {}
+    for entry in entries:
+        if entry.get('event') == 'wait':
+            stats = waits.setdefault(entry['role'], {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        elif entry.get('event') == 'query':
+            stats = queries.setdefault(entry['sql'], {
+                'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'plan': None, 'plan_ms': 0.0
+            })
+            stats['rows'] += entry.get('rows') or 0
+            if entry.get('plan') and entry['ms'] >= stats['plan_ms']:
+                stats['plan'] = entry['plan']
+                stats['plan_ms'] = entry['ms']
+        else:
+            continue
+        stats['count'] += 1
+        stats['total_ms'] += entry['ms']
+        stats['max_ms'] = max(stats['max_ms'], entry['ms'])
+    return queries, waits
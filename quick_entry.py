@@ -0,0 +1,95 @@
+import re
+from decimal import Decimal
+from difflib import get_close_matches
+from typing import NamedTuple, Optional
+
+from cache import LRUCache
+from config import KEYBOARD_CACHE_SIZE
+from utils import parse_amount
+
+# «-500 продукты кофе», «+200000 зарплата», «1499,90 связь»: знак, сумма,
+# затем категория и описание. Без знака запись считается расходом
+QUICK_ENTRY_PATTERN = re.compile(r'\s*([+-])?\s*(\d{1,12}(?:[.,]\d{1,2})?)(?:\s+(.*))?\Z', re.DOTALL)
+
+# Сколько первых слов сообщения пробовать как название категории
+MAX_CATEGORY_WORDS = 3
+
+# Минимальная длина слова для поиска категории по началу названия
+MIN_PREFIX_LENGTH = 3
+
+# Порог похожести для опечаток (difflib, от 0 до 1)
+FUZZY_CUTOFF = 0.75
+
+
+class QuickEntry(NamedTuple):
+    trans_type: str
+    amount: Decimal
+    words: tuple
+
+
+def parse_quick_entry(text: str) -> Optional[QuickEntry]:
+    """Разбор сообщения быстрого ввода; None, если это не сумма"""
+    match = QUICK_ENTRY_PATTERN.fullmatch(text or '')
+    if match is None:
+        return None
+    sign, amount, rest = match.groups()
+    amount = parse_amount(amount)
+    if amount <= 0:
+        return None
+    trans_type = 'income' if sign == '+' else 'expense'
+    return QuickEntry(trans_type, amount, tuple(rest.split()) if rest else ())
+
+
+class CategoryIndex:
+    """Поиск категории по первым словам сообщения.
+
+    Порядок: точное совпадение названия (в том числе из нескольких слов),
+    первое слово названия, однозначное совпадение по началу слова и,
+    наконец, ближайшее по написанию слово (опечатки).
+    """
+
+    def __init__(self, names: tuple):
+        self.names = {name.lower(): name for name in names}
+        self.first_words = {}
+        for name in names:
+            self.first_words.setdefault(name.split()[0].lower(), name)
+
+    def _by_prefix(self, word: str) -> Optional[str]:
+        if len(word) < MIN_PREFIX_LENGTH:
+            return None
+        found = {name for first, name in self.first_words.items()
+                 if first.startswith(word) or word.startswith(first)}
+        return found.pop() if len(found) == 1 else None
+
+    def match(self, words: tuple):
+        """(категория, оставшиеся слова) или (None, words)"""
+        lowered = [word.lower() for word in words[:MAX_CATEGORY_WORDS]]
+        for count in range(len(lowered), 0, -1):
+            name = self.names.get(' '.join(lowered[:count]))
+            if name:
+                return name, words[count:]
+        if not lowered:
+            return None, words
+
+        first = lowered[0]
+        name = self.first_words.get(first) or self._by_prefix(first)
+        if name is None:
+            close = get_close_matches(first, self.first_words, n=1, cutoff=FUZZY_CUTOFF)
+            name = self.first_words[close[0]] if close else None
+        if name is None:
+            return None, words
+        return name, words[1:]
+
+
+# Индексы строятся один раз на набор названий категорий, как и клавиатуры
+category_index_cache = LRUCache(KEYBOARD_CACHE_SIZE)
+
+
+def get_category_index(categories) -> CategoryIndex:
+    """Индекс категорий из списка get_categories()"""
+    names = tuple(category['name'] for category in categories)
+    index = category_index_cache.get(names)
+    if index is None:
+        index = CategoryIndex(names)
+        category_index_cache.set(names, index)
+    return index
@@ -0,0 +1,254 @@
+import asyncio
+import heapq
+import logging
+from calendar import monthrange
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from aiogram.exceptions import TelegramAPIError
+
+from config import REMINDER_TIME, DEBT_REMIND_EVERY_DAYS, SCHEDULER_BATCH_SIZE
+from database import DB_DATE_FORMAT, Database, to_db_date
+from keyboards import get_debt_reminder_keyboard
+from outbox import detach_sends
+from utils import format_currency
+
+logger = logging.getLogger(__name__)
+
+# Время суток, в которое записываются регулярные операции и приходят напоминания
+RUN_AT = time.fromisoformat(REMINDER_TIME)
+
+# Расписание в /every: число месяца, день недели или «ежедневно»
+WEEKDAYS = ('пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс')
+DAILY_WORDS = ('ежедневно', 'день')
+
+# Дольше этого таймер не спит, чтобы перевод системных часов не сдвигал
+# срабатывания надолго, секунды
+MAX_SLEEP = 3600
+
+# Сколько дат пропущенных записей перечислять в уведомлении
+MAX_LISTED_DATES = 10
+
+
+def parse_schedule(token: str) -> Optional[tuple]:
+    """(period, day) из расписания /every или None"""
+    token = token.lower()
+    if token in DAILY_WORDS:
+        return 'daily', None
+    if token in WEEKDAYS:
+        return 'weekly', WEEKDAYS.index(token)
+    if token.isdigit() and 1 <= int(token) <= 31:
+        return 'monthly', int(token)
+    return None
+
+
+def describe_schedule(period: str, day: int) -> str:
+    if period == 'daily':
+        return "каждый день"
+    if period == 'weekly':
+        return f"каждую неделю, {WEEKDAYS[day]}"
+    return f"каждый месяц, {day}-го числа"
+
+
+def next_occurrence(period: str, day: int, after: datetime, at: time = RUN_AT) -> datetime:
+    """Первое срабатывание расписания позже after.
+
+    День месяца, которого нет в коротком месяце, переносится на последний
+    день этого месяца; в следующих месяцах правило снова срабатывает в
+    свой день.
+    """
+    if period == 'daily':
+        moment = datetime.combine(after.date(), at)
+        return moment if moment > after else moment + timedelta(days=1)
+    if period == 'weekly':
+        moment = datetime.combine(after.date() + timedelta(days=(day - after.weekday()) % 7), at)
+        return moment if moment > after else moment + timedelta(days=7)
+
+    year, month = after.year, after.month
+    while True:
+        moment = datetime.combine(date(year, month, min(day, monthrange(year, month)[1])), at)
+        if moment > after:
+            return moment
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def first_debt_reminder(due_date: date, now: datetime) -> datetime:
+    """Напоминание в день срока; если это время прошло — в ближайший RUN_AT"""
+    moment = datetime.combine(due_date, RUN_AT)
+    return moment if moment > now else next_occurrence('daily', None, now)
+
+
+def _parse(value: str) -> datetime:
+    return datetime.strptime(value, DB_DATE_FORMAT)
+
+
+class RecurringScheduler:
+    """Регулярные операции и напоминания о долгах на одном таймере.
+
+    Ближайшие срабатывания — ключи (время, вид, id) — лежат в куче,
+    в памяти их не больше SCHEDULER_BATCH_SIZE: они читаются по индексам
+    recurring.next_run и debts.remind_at, а следующая порция — только
+    когда куча опустела. Единственная задача спит до вершины кучи.
+
+    Новое или перенесенное срабатывание добавляется через notify(); если
+    оно позже загруженной порции и в куче нет места, его прочитает
+    следующая загрузка.
+    Устаревшие ключи в куче не удаляются: перед срабатыванием время
+    сверяется с БД, и запись с другим временем пропускается.
+
+    После простоя регулярная операция записывается за каждую пропущенную
+    дату, а напоминания о долге сводятся к одному.
+    """
+
+    def __init__(self, bot, db: Database, batch_size: int = SCHEDULER_BATCH_SIZE):
+        self.bot = bot
+        self.db = db
+        self.batch_size = max(1, batch_size)
+        self._heap = []
+        # Ключ последнего загруженного срабатывания: все, что не позже
+        # него, уже в куче
+        self._horizon = None
+        # В БД нет срабатываний позже горизонта
+        self._complete = False
+        self._loading = False
+        self._late = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.fired = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def notify(self, kind: str, item_id: int, at: datetime):
+        """Срабатывание, только что записанное в БД ('rule' или 'debt')"""
+        key = (to_db_date(at), kind, item_id)
+        if self._loading:
+            # Загрузка могла прочитать БД до этой записи
+            self._late.append(key)
+        else:
+            self._push(key)
+
+    def _push(self, key: tuple):
+        if self._horizon is not None and key <= self._horizon:
+            heapq.heappush(self._heap, key)
+        elif self._complete and len(self._heap) < self.batch_size:
+            # Позже горизонта в БД ничего нет: ключ его продлевает
+            self._horizon = key
+            heapq.heappush(self._heap, key)
+        else:
+            # Куча полна: ключ остается только в БД, его прочитает
+            # следующая загрузка
+            self._complete = False
+            return
+        self._wakeup.set()
+
+    async def _load(self):
+        self._loading = True
+        try:
+            page = await self.db.get_schedule_page(self._horizon, self.batch_size)
+        finally:
+            self._loading = False
+        self._complete = len(page) < self.batch_size
+        if page:
+            self._horizon = page[-1]
+        for key in page:
+            heapq.heappush(self._heap, key)
+        late, self._late = self._late, []
+        for key in late:
+            self._push(key)
+
+    async def _sleep(self, delay: float):
+        """Пауза, которую прерывает notify()"""
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), min(delay, MAX_SLEEP))
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                if not self._complete:
+                    await self._load()
+                else:
+                    await self._sleep(MAX_SLEEP)
+                continue
+
+            at, kind, item_id = self._heap[0]
+            now = datetime.now()
+            delay = (_parse(at) - now).total_seconds()
+            if delay > 0:
+                await self._sleep(delay)
+                continue
+
+            heapq.heappop(self._heap)
+            try:
+                if kind == 'rule':
+                    await self._fire_rule(item_id, at, now)
+                else:
+                    await self._fire_debt(item_id, at, now)
+            except Exception:
+                logger.exception("Ошибка срабатывания %s %s", kind, item_id)
+
+    async def _fire_rule(self, rule_id: int, at: str, now: datetime):
+        rule = await self.db.get_recurring(rule_id)
+        if rule is None or rule['next_run'] != at:
+            return
+
+        # Все пропущенные даты, включая текущую
+        occurrences = []
+        moment = _parse(at)
+        while moment <= now:
+            occurrences.append(moment)
+            moment = next_occurrence(rule['period'], rule['day'], moment)
+        rule = await self.db.record_recurring(rule_id, at, occurrences, moment)
+        if rule is None:
+            return
+        self.fired += 1
+        self._push((to_db_date(moment), 'rule', rule_id))
+
+        trans_type_text = "доход" if rule['type'] == 'income' else "расход"
+        text = (f"🔁 Записан регулярный {trans_type_text}: {format_currency(rule['amount'])} — {rule['category']}"
+                + (f"\nОписание: {rule['description']}" if rule['description'] else ""))
+        if len(occurrences) > 1:
+            dates = ', '.join(f"{moment:%d.%m.%Y}" for moment in occurrences[-MAX_LISTED_DATES:])
+            text += f"\nЗа пропущенные даты тоже, всего записей: {len(occurrences)} ({dates})"
+        await self._notify_user(rule['user_id'], text)
+
+    async def _fire_debt(self, debt_id: int, at: str, now: datetime):
+        # Пропущенные напоминания не повторяются: следующее — первое после now
+        step = timedelta(days=max(1, DEBT_REMIND_EVERY_DAYS))
+        remind_at = _parse(at)
+        remind_at += step * ((now - remind_at) // step + 1)
+        debt = await self.db.advance_debt_reminder(debt_id, at, remind_at)
+        if debt is None:
+            return
+        self.fired += 1
+        self._push((to_db_date(remind_at), 'debt', debt_id))
+
+        if debt['type'] == 'lent':
+            who = f"{debt['person_name']} должен вам"
+        else:
+            who = f"Вы должны: {debt['person_name']}"
+        text = (f"⏰ Напоминание о долге\n\n{who}\nСумма: {format_currency(debt['amount'])}\n"
+                f"Срок: {date.fromisoformat(debt['due_date']):%d.%m.%Y}")
+        await self._notify_user(debt['user_id'], text, get_debt_reminder_keyboard(debt_id))
+
+    async def _notify_user(self, user_id: int, text: str, reply_markup=None):
+        # Сообщение только ставится в очередь Outbox: таймер не ждет Telegram
+        try:
+            with detach_sends():
+                await self.bot.send_message(user_id, text, reply_markup=reply_markup)
+        except TelegramAPIError as e:
+            logger.warning("Уведомление пользователю %s не отправлено: %s", user_id, e)
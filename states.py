@@ -18,3 +18,8 @@ class DebtStates(StatesGroup):
 class CategoryStates(StatesGroup):
     """Состояния для управления категориями"""
     waiting_for_new_category_name = State()
+
+
+class HistoryStates(StatesGroup):
+    """Состояния для редактирования записей истории"""
+    waiting_for_new_amount = State()
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from config import FSM_CACHE_SIZE, FSM_STATE_TTL_HOURS, FSM_CLEANUP_INTERVAL_MINUTES
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM в БД бота.
+
+    Состояния переживают перезапуск бота. Последние использованные записи
+    держатся в LRU-кэше ограниченного размера, любое изменение сразу
+    пишется в БД. Диалоги без активности дольше TTL удаляются.
+    """
+
+    def __init__(self, db: Database, cache_size: int = FSM_CACHE_SIZE,
+                 ttl_hours: float = FSM_STATE_TTL_HOURS,
+                 cleanup_interval_minutes: float = FSM_CLEANUP_INTERVAL_MINUTES,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.db = db
+        self.cache_size = max(1, cache_size)
+        self.ttl = int(ttl_hours * 3600)
+        self.cleanup_interval = cleanup_interval_minutes * 60
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        # key -> (state, data, updated_at)
+        self._cache = OrderedDict()
+        self._cleanup_task = None
+
+    async def open(self):
+        """Очистка устаревших состояний и запуск периодической очистки"""
+        await self.purge_expired()
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+
+    async def close(self) -> None:
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            try:
+                await self._cleanup_task
+            except asyncio.CancelledError:
+                pass
+            self._cleanup_task = None
+        self._cache.clear()
+
+    async def purge_expired(self) -> int:
+        """Удаление диалогов, не обновлявшихся дольше TTL"""
+        older_than = int(time.time()) - self.ttl
+        for key in [key for key, record in self._cache.items() if record[2] < older_than]:
+            del self._cache[key]
+        removed = await self.db.purge_fsm_records(older_than)
+        if removed:
+            logger.info("Удалено устаревших состояний FSM: %s", removed)
+        return removed
+
+    def state_counts(self) -> Dict[str, int]:
+        """Число диалогов в кэше по текущему состоянию"""
+        counts = {}
+        for state, _, _ in self._cache.values():
+            if state is not None:
+                counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                await self.purge_expired()
+            except Exception:
+                logger.exception("Ошибка очистки состояний FSM")
+
+    def _remember(self, key: str, record: tuple):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str) -> tuple:
+        """Запись (state, data, updated_at) из кэша или БД"""
+        record = self._cache.get(key)
+        if record is None:
+            row = await self.db.get_fsm_record(key)
+            if row is None:
+                record = (None, {}, 0)
+            else:
+                record = (row['state'], json.loads(row['data']) if row['data'] else {}, row['updated_at'])
+        else:
+            self._cache.move_to_end(key)
+
+        if record[2] and record[2] < int(time.time()) - self.ttl:
+            # Диалог брошен слишком давно: начинаем с чистого состояния
+            record = (None, {}, 0)
+        self._remember(key, record)
+        return record
+
+    async def _save(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        if state is None and not data:
+            if self._cache.get(key) == (None, {}, 0):
+                # Состояния и так нет: лишняя запись в БД не нужна
+                return
+            self._remember(key, (None, {}, 0))
+            await self.db.delete_fsm_record(key)
+            return
+
+        updated_at = int(time.time())
+        self._remember(key, (state, data, updated_at))
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':')) if data else None
+        await self.db.save_fsm_record(key, state, payload, updated_at)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        _, data, _ = await self._load(storage_key)
+        await self._save(storage_key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise ValueError(f"Data must be a dict, got {type(data).__name__}")
+        storage_key = self.key_builder.build(key)
+        state, _, _ = await self._load(storage_key)
+        await self._save(storage_key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data, _ = await self._load(self.key_builder.build(key))
+        return data.copy()
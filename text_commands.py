@@ -0,0 +1,71 @@
+from typing import Any, Dict, List, Set, Union
+
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.dispatcher.event.telegram import TelegramEventObserver
+from aiogram.types import Message
+
+
+class TextCommands:
+    """Таблица обработчиков кнопок: точный текст сообщения -> обработчик.
+
+    В цепочку обработчиков роутера таблица встает одним элементом и
+    находит нужный обработчик поиском по словарю, вместо проверки
+    фильтра F.text == ... у каждого обработчика по очереди. Синхронные
+    фильтры aiogram выполняет в пуле потоков, поэтому длинная цепочка
+    таких проверок дорога даже для простого сравнения строк.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, CallableObject] = {}
+        self._sections: List[Set[str]] = []
+
+    def __call__(self, *texts: str):
+        """Декоратор: обработчик для одной или нескольких кнопок"""
+        def decorator(callback):
+            handler = CallableObject(callback)
+            for text in texts:
+                if text in self._handlers:
+                    raise ValueError(f"Для кнопки «{text}» уже есть обработчик")
+                self._handlers[text] = handler
+                if self._sections:
+                    self._sections[-1].add(text)
+            return callback
+        return decorator
+
+    def __contains__(self, text: str) -> bool:
+        return text in self._handlers
+
+    async def lookup(self, message: Message) -> Union[bool, Dict[str, Any]]:
+        """Фильтр: обработчик кнопки передается в dispatch как text_handler"""
+        handler = self._handlers.get(message.text)
+        if handler is None:
+            return False
+        return {'text_handler': handler}
+
+    async def dispatch(self, message: Message, text_handler: CallableObject, **kwargs: Any) -> Any:
+        return await text_handler.call(message, **kwargs)
+
+    def register(self, observer: TelegramEventObserver, *filters) -> None:
+        """Добавление таблицы в цепочку обработчиков сообщений.
+
+        Дополнительные фильтры проверяются после поиска по таблице.
+        """
+        observer.register(self.dispatch, self.lookup, *filters)
+
+    def register_section(self, observer: TelegramEventObserver, *filters) -> None:
+        """Добавление в цепочку части таблицы: кнопок, объявленных после
+        этого вызова и до следующего register_section.
+
+        Так кнопка в состоянии FSM проверяется там же, где стоял ее
+        обработчик: раньше состояний, объявленных ниже, и позже
+        объявленных выше.
+        """
+        texts: Set[str] = set()
+        self._sections.append(texts)
+
+        async def lookup(message: Message) -> Union[bool, Dict[str, Any]]:
+            if message.text not in texts:
+                return False
+            return await self.lookup(message)
+
+        observer.register(self.dispatch, lookup, *filters)
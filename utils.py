@@ -1,8 +1,72 @@
-def format_currency(amount: float) -> str:
+import sys
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import NamedTuple
+
+from cache import LRUCache
+from config import REPORT_CACHE_MAX_BYTES
+
+# Суммы хранятся в БД целым числом минимальных единиц (тиынов)
+MINOR_UNITS = 100
+CENT = Decimal('0.01')
+# Предел суммы: в INTEGER SQLite с запасом помещается и сумма всех записей
+MAX_AMOUNT = Decimal('1e12')
+
+
+def parse_amount(text: str) -> Decimal:
+    """Сумма из ввода пользователя («1500», «1 500,50»), округленная до тиына"""
+    cleaned = text.strip().replace('\xa0', '').replace(' ', '').replace(',', '.')
+    try:
+        amount = Decimal(cleaned)
+    except InvalidOperation:
+        raise ValueError(f"не число: {text}") from None
+    if not amount.is_finite() or abs(amount) >= MAX_AMOUNT:
+        raise ValueError(f"не число: {text}")
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def to_minor(amount) -> int:
+    """Сумма (Decimal, int или строка) в целых тиынах для записи в БД"""
+    if isinstance(amount, float):
+        amount = repr(amount)
+    return int((Decimal(amount) * MINOR_UNITS).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_minor(value) -> Decimal:
+    """Сумма из БД (целые тиыны) в Decimal"""
+    return (Decimal(value or 0) / MINOR_UNITS).quantize(CENT)
+
+
+def format_currency(amount: Decimal) -> str:
     """Форматирование суммы в валюту"""
     return f"{amount:,.2f} ₸".replace(',', ' ')
 
 
+# Максимальная длина текста сообщения в Telegram
+MESSAGE_LIMIT = 4096
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    """Разбиение длинного текста на части по границам строк"""
+    chunks = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        # Строка длиннее лимита режется по символам
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            chunks.append(current)
+            current = ""
+        current += line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
 def generate_report_text(period: str, balance: dict, income_stats: list, expense_stats: list) -> str:
     """Генерация текста отчета"""
     text = f"📊 <b>Отчет: {period}</b>\n\n"
@@ -34,3 +98,43 @@ def generate_report_text(period: str, balance: dict, income_stats: list, expense
         text += "Нет данных за выбранный период."
 
     return text
+
+
+# Периоды отчета: кнопка -> (заголовок, сколько дней назад начинается период)
+REPORT_PERIODS = {
+    'today': ("Сегодня", 0),
+    'week': ("За неделю", 7),
+    'month': ("За месяц", 30),
+    'all': ("За весь период", None),
+}
+
+
+def report_period(period: str, now: datetime) -> tuple:
+    """(начало периода или None, заголовок) для кнопки отчета.
+
+    Период начинается с полуночи: так отчет за один и тот же день
+    не зависит от времени запроса и его можно кэшировать.
+    """
+    title, days = REPORT_PERIODS.get(period, REPORT_PERIODS['all'])
+    if days is None:
+        return None, title
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    return start, title
+
+
+class CachedReport(NamedTuple):
+    text: str
+    # (категория, сумма) расходов и [(день, сумма)] для графика
+    expenses: tuple
+    daily: tuple
+
+
+def _report_size(report: CachedReport) -> int:
+    """Примерный размер отчета в памяти, байты"""
+    return sys.getsizeof(report.text) + 200 * (len(report.expenses) + len(report.daily))
+
+
+# Готовые отчеты: (user_id, период, день, поколение данных) -> CachedReport.
+# Новая запись пользователя меняет поколение, и старые отчеты просто
+# перестают запрашиваться, пока их не вытеснит LRU
+report_cache = LRUCache(REPORT_CACHE_MAX_BYTES, weigh=_report_size)
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import signal
+from contextlib import suppress
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_SECRET, WEBHOOK_MAX_IN_FLIGHT
+)
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    """Прием обновлений Telegram через вебхук.
+
+    Обновление подтверждается сразу после постановки в обработку, сами
+    обработчики выполняются конкурентно, но не более max_in_flight
+    одновременно. Если лимит исчерпан, ответ на запрос задерживается,
+    и Telegram притормаживает доставку.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str = WEBHOOK_PATH,
+                 secret: str = WEBHOOK_SECRET, max_in_flight: int = WEBHOOK_MAX_IN_FLIGHT):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self._slots = asyncio.Semaphore(max(1, max_in_flight))
+        self._tasks = set()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret:
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        except ValueError:
+            logger.warning("Некорректное обновление во входящем вебхуке")
+            return web.Response(status=400)
+
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logger.exception("Ошибка обработки обновления %s", update.update_id)
+        finally:
+            self._slots.release()
+
+    async def wait_in_flight(self):
+        """Ожидание завершения уже принятых обновлений"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+    """Запуск бота в режиме вебхука до получения SIGINT/SIGTERM"""
+    server = WebhookServer(dp, bot)
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    with suppress(NotImplementedError):
+        # На Windows обработчики сигналов не поддерживаются
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        await site.start()
+        if WEBHOOK_URL:
+            # Накопившиеся за время перезапуска обновления не сбрасываются
+            await bot.set_webhook(
+                WEBHOOK_URL.rstrip('/') + server.path,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=False,
+            )
+        else:
+            logger.info("WEBHOOK_URL не задан: вебхук в Telegram не регистрируется")
+        logger.info("Вебхук слушает http://%s:%s%s", host, port, server.path)
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await server.wait_in_flight()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)